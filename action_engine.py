@@ -0,0 +1,136 @@
+import json
+import logging
+import time
+from collections import namedtuple
+from concurrent.futures import FIRST_COMPLETED, wait
+
+# Firmware actuator of each command (see arduino.cpp); steps on the same actuator never overlap
+ACTUATORS = {
+    'forward': 'base', 'backward': 'base', 'left': 'base', 'right': 'base', 'drive': 'base',
+    'catch': 'claw', 'release': 'claw',
+    'up': 'arm', 'down': 'arm',
+}
+
+# Seconds from the start of the sequence; a step skipped because a dependency failed has no times
+StepTiming = namedtuple('StepTiming', ['step_id', 'command', 'duration_ms', 'started_s', 'finished_s', 'ok'])
+
+
+class ActionStep:
+    """One firmware command of a sequence and the steps that must finish before it starts."""
+
+    def __init__(self, step_id, command, duration, after, settle_ms=0, pwm=None):
+        self.step_id = step_id
+        self.command = command
+        self.duration = duration
+        self.after = after
+        self.settle_ms = settle_ms
+        self.pwm = pwm
+
+    @property
+    def actuator(self):
+        return ACTUATORS[self.command]
+
+
+def parse_sequence(steps_data):
+    """Build ActionSteps from a list of dicts such as {"id": "lift", "command": "up", "duration": 2000}.
+
+    `after` lists the ids a step waits for; without it the step waits for every earlier step, and
+    `"after": []` lets it start at once. A step always follows the previous step on its actuator.
+    `settle_ms` holds back the steps that depend on it after the firmware reports it done.
+    """
+    steps = []
+    last_on_actuator = {}
+    for index, data in enumerate(steps_data):
+        step_id = str(data.get('id', index))
+        command = data['command']
+        if command not in ACTUATORS:
+            raise ValueError(f"Step '{step_id}': unknown command '{command}'.")
+        known = [step.step_id for step in steps]
+        if step_id in known:
+            raise ValueError(f"Duplicate step id '{step_id}'.")
+        after = [str(dep) for dep in data['after']] if 'after' in data else list(known)
+        for dep in after:
+            if dep not in known:
+                raise ValueError(f"Step '{step_id}' waits for '{dep}', which is not an earlier step.")
+        previous = last_on_actuator.get(ACTUATORS[command])
+        if previous is not None and previous not in after:
+            after.append(previous)
+        steps.append(ActionStep(step_id, command, int(data['duration']), after,
+                                int(data.get('settle_ms', 0)), data.get('pwm')))
+        last_on_actuator[ACTUATORS[command]] = step_id
+    return steps
+
+
+def load_sequences(path):
+    """Read a JSON file mapping class names to step lists; every sequence is validated up front."""
+    with open(path) as f:
+        data = json.load(f)
+    return {name.lower(): parse_sequence(steps) for name, steps in data.items()}
+
+
+class ActionEngine:
+    """Runs a sequence by starting each step as soon as its dependencies are done.
+
+    Completion comes from the firmware's DONE replies, not from sleeping for the commanded duration,
+    so steps on different actuators overlap and nothing waits longer than the motion takes.
+    """
+
+    def __init__(self, send):
+        self.send = send  # send(command, duration, pwm=None) -> Future resolved on DONE
+
+    def run(self, steps, cancelled=None):
+        """Execute the steps and return one StepTiming per step, in start order.
+
+        A step whose command fails (ERR or timeout) never releases its dependents: they, and the steps
+        waiting on them, are skipped and reported with ok False and no times. Once `cancelled()`
+        returns True no further steps are started; running ones still report back.
+        """
+        started = time.monotonic()
+        pending = list(steps)
+        running = {}
+        ready_at = {}  # Step id -> time its dependents may start
+        timings = []
+        failed = set()  # Ids of steps that failed or were skipped
+
+        while pending or running:
+            for step in [step for step in pending if failed.intersection(step.after)]:
+                pending.remove(step)
+                failed.add(step.step_id)
+                logging.warning(f"Skipping step '{step.step_id}'; it depends on a failed step.")
+                timings.append(StepTiming(step.step_id, step.command, step.duration, None, None, False))
+            if not pending and not running:
+                break
+            if cancelled is not None and cancelled() and pending:
+                logging.warning(f"Sequence cancelled; skipping {[step.step_id for step in pending]}.")
+                pending = []
+                if not running:
+                    break
+            now = time.monotonic()
+            for step in [step for step in pending if all(ready_at.get(dep, float('inf')) <= now for dep in step.after)]:
+                pending.remove(step)
+                running[self.send(step.command, step.duration, pwm=step.pwm)] = (step, now)
+
+            # Wake for the next completion, or when a settle delay runs out
+            settling = [ready_at[dep] for step in pending for dep in step.after if dep in ready_at and ready_at[dep] > now]
+            timeout = min(settling) - now if settling else None
+            if not running:
+                if timeout is None:
+                    raise RuntimeError(f"Steps {[step.step_id for step in pending]} can never start.")
+                time.sleep(timeout)
+                continue
+            done, _ = wait(running, timeout=timeout, return_when=FIRST_COMPLETED)
+
+            for future in done:
+                step, step_started = running.pop(future)
+                finished = time.monotonic()
+                ok = future.exception() is None
+                if ok:
+                    ready_at[step.step_id] = finished + step.settle_ms / 1000.0
+                else:
+                    logging.error(f"Step '{step.step_id}' ({step.command} {step.duration}ms) failed: {future.exception()}")
+                    failed.add(step.step_id)
+                timings.append(StepTiming(step.step_id, step.command, step.duration,
+                                          round(step_started - started, 3), round(finished - started, 3), ok))
+
+        timings.sort(key=lambda timing: (timing.started_s is None, timing.started_s or 0.0))
+        return timings
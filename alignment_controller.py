@@ -0,0 +1,127 @@
+import abc
+
+import numpy as np
+
+
+class AlignmentController(abc.ABC):
+    """Maps the target's horizontal pixel error to a turn pulse.
+
+    update() returns (signed pulse length in ms, PWM duty or None). A positive length turns right;
+    None keeps the firmware's default turn speed. `offset_ms` is added to every pulse to cover the
+    time the motors need before the base starts to move, and pulses are capped at `max_ms`.
+    """
+
+    def __init__(self, offset_ms=35, max_ms=400):
+        self.offset_ms = offset_ms
+        self.max_ms = max_ms
+
+    @abc.abstractmethod
+    def update(self, error_px, now):
+        """Pulse for the current pixel error, measured at time `now` in seconds."""
+
+    def reset(self):
+        """Forget accumulated state, e.g. once the target is centred or a new object is selected."""
+
+    def _pulse(self, output_ms):
+        if output_ms == 0:
+            return 0
+        magnitude = min(self.offset_ms + abs(output_ms), self.max_ms)
+        return int(round(np.copysign(magnitude, output_ms)))
+
+    def _saturated(self, output_ms):
+        return self.offset_ms + abs(output_ms) >= self.max_ms
+
+
+class FixedPulseController(AlignmentController):
+    """The original behaviour: the same pulse whatever the error."""
+
+    def __init__(self, pulse_ms=55):
+        super().__init__(offset_ms=0, max_ms=pulse_ms)
+        self.pulse_ms = pulse_ms
+
+    def update(self, error_px, now):
+        return int(np.copysign(self.pulse_ms, error_px)), None
+
+
+class ProportionalController(AlignmentController):
+
+    def __init__(self, kp=1.0, offset_ms=35, max_ms=400):
+        super().__init__(offset_ms, max_ms)
+        self.kp = kp
+
+    def update(self, error_px, now):
+        return self._pulse(self.kp * error_px), None
+
+
+class PIDController(AlignmentController):
+    """PID on the pixel error with conditional-integration anti-windup.
+
+    The integral only accumulates while the output is not saturated (or when the error would pull it
+    back out of saturation) and is clamped to +/- `integral_limit` px*s.
+    """
+
+    def __init__(self, kp=0.9, ki=0.2, kd=0.05, integral_limit=500.0, offset_ms=35, max_ms=400):
+        super().__init__(offset_ms, max_ms)
+        self.kp = kp
+        self.ki = ki
+        self.kd = kd
+        self.integral_limit = integral_limit
+        self.reset()
+
+    def reset(self):
+        self.integral = 0.0
+        self._last_error = None
+        self._last_time = None
+
+    def update(self, error_px, now):
+        dt = 0.0 if self._last_time is None else now - self._last_time
+        derivative = 0.0
+        if self._last_error is not None and dt > 0:
+            derivative = (error_px - self._last_error) / dt
+
+        candidate = float(np.clip(self.integral + error_px * dt, -self.integral_limit, self.integral_limit))
+        output = self.kp * error_px + self.ki * candidate + self.kd * derivative
+        if not self._saturated(output) or error_px * self.integral < 0:
+            self.integral = candidate
+        output = self.kp * error_px + self.ki * self.integral + self.kd * derivative
+
+        self._last_error = error_px
+        self._last_time = now
+        return self._pulse(output), None
+
+
+class GainScheduledController(AlignmentController):
+    """Proportional control whose gain (and optionally PWM) is interpolated from the error size.
+
+    `schedule` and `pwm_schedule` are lists of (abs error px, value) pairs sorted by error.
+    """
+
+    def __init__(self, schedule=((0, 0.8), (200, 1.0), (800, 1.2)), pwm_schedule=None, offset_ms=35, max_ms=400):
+        super().__init__(offset_ms, max_ms)
+        self.errors, self.gains = map(np.asarray, zip(*schedule))
+        self.pwm_schedule = None
+        if pwm_schedule:
+            self.pwm_schedule = tuple(map(np.asarray, zip(*pwm_schedule)))
+
+    def update(self, error_px, now):
+        magnitude = abs(error_px)
+        kp = float(np.interp(magnitude, self.errors, self.gains))
+        pwm = None
+        if self.pwm_schedule is not None:
+            pwm = int(np.interp(magnitude, *self.pwm_schedule))
+        return self._pulse(kp * error_px), pwm
+
+
+def create_controller(kind, gains):
+    """Build a controller from a gains dict such as pipeline.ALIGNMENT_GAINS['default']."""
+    limits = {'offset_ms': gains.get('offset_ms', 35), 'max_ms': gains.get('max_ms', 400)}
+    if kind == 'fixed':
+        return FixedPulseController(gains.get('pulse_ms', 55))
+    if kind == 'proportional':
+        return ProportionalController(gains['kp'], **limits)
+    if kind == 'pid':
+        return PIDController(gains['kp'], gains.get('ki', 0.0), gains.get('kd', 0.0),
+                             gains.get('integral_limit', 500.0), **limits)
+    if kind == 'scheduled':
+        return GainScheduledController(gains['schedule'], gains.get('pwm_schedule'), **limits)
+    raise ValueError(f"Unknown alignment controller '{kind}'. Use 'fixed', 'proportional', 'pid' or 'scheduled'.")
@@ -20,6 +20,9 @@ const int motor3_pwm = 11; // Motor 3 PWM pin connected to Arduino D11
 const int motor4_dir = 6;  // Motor 4 Direction pin connected to Arduino D6
 const int motor4_pwm = 5;  // Motor 4 PWM pin connected to Arduino D5
 
+// Default PWM duty for turning in place; a command can override it with a third field
+const int TURN_PWM = 200;
+
 // Threshold Distance (in millimeters)
 const int MIN_DISTANCE_THRESHOLD = 1000; // 1 meter
 
@@ -32,14 +35,52 @@ const unsigned long INIT_DELAY_MS = 100;
 // Flag to indicate sensor initialization status
 bool sensorInitialized = false;
 
+// Sequence number of the last "@<seq>" command, used to drop retransmitted duplicates
+long lastSeq = -1;
+
+// Longest command line we accept; characters beyond it are dropped
+const unsigned int MAX_COMMAND_LENGTH = 48;
+
+// Partially received command line (filled without blocking)
+String commandBuffer = "";
+
+// A timed motion on one group of motors. Base, claw and arm each have their own
+// actuator, so they can run at the same time while the loop keeps reading Serial.
+struct Actuator {
+  const int *pwmPins;
+  int pinCount;
+  bool active;
+  unsigned long startedAt;
+  unsigned long duration;
+  long seq;
+};
+
+const int basePins[] = {motor1_pwm, motor2_pwm};
+const int clawPins[] = {motor3_pwm};
+const int armPins[] = {motor4_pwm};
+
+Actuator baseActuator = {basePins, 2, false, 0, 0, -1};
+Actuator clawActuator = {clawPins, 1, false, 0, 0, -1};
+Actuator armActuator = {armPins, 1, false, 0, 0, -1};
+
 // Function Prototypes
-void moveBase(String direction, int duration);
-void moveLeft(int duration);
-void moveRight(int duration);
-void controlClaw(String action, int duration);
-void moveClaw(String direction, int duration);
-void stopAllMotors();
-void measureDistance();
+bool readCommandLine(String &line);
+void handleCommand(String command);
+void moveBase(String direction, int duration, long seq);
+void moveLeft(int duration, int pwm, long seq);
+void moveRight(int duration, int pwm, long seq);
+void driveWheels(int duration, int leftPwm, int rightPwm, long seq);
+int parseFields(String text, long *fields, int maxFields);
+void controlClaw(String action, int duration, long seq);
+void moveClaw(String direction, int duration, long seq);
+void startActuator(Actuator &actuator, int duration, long seq);
+void finishActuator(Actuator &actuator, String payload);
+void updateActuator(Actuator &actuator);
+void stopAllMotors(long seq);
+void measureDistance(long seq);
+void sendAck(long seq);
+void sendDone(long seq, String payload);
+void sendError(long seq, String message);
 
 void setup() {
   // Initialize all motor pins as outputs
@@ -81,59 +122,204 @@ void setup() {
 }
 
 void loop() {
-  // Handle incoming serial commands
-  if (Serial.available() > 0) {
-    String command = Serial.readStringUntil('\n');  // Read until newline
-    command.trim();  // Remove any leading/trailing whitespace
-    int spaceIndex = command.indexOf(' ');  // Split command and duration
-
-    // Check if there's a space separating command and duration
-    if (spaceIndex == -1) {
-      // If the command is 'distance', measure and return distance
-      if (command.equalsIgnoreCase("distance")) {
-        measureDistance();
-      } else {
-        Serial.println("Error: Invalid command format.");
-      }
+  // Handle incoming serial commands without waiting for a full line
+  String command;
+  if (readCommandLine(command)) {
+    handleCommand(command);
+  }
+
+  // Stop any motion whose time is up
+  updateActuator(baseActuator);
+  updateActuator(clawActuator);
+  updateActuator(armActuator);
+}
+
+// Collect characters into commandBuffer; returns true once a full line is available
+bool readCommandLine(String &line) {
+  while (Serial.available() > 0) {
+    char c = Serial.read();
+    if (c == '\n') {
+      line = commandBuffer;
+      commandBuffer = "";
+      line.trim();  // Remove any leading/trailing whitespace
+      return line.length() > 0;
+    }
+    if (commandBuffer.length() < MAX_COMMAND_LENGTH) {
+      commandBuffer += c;
+    }
+  }
+  return false;
+}
+
+void handleCommand(String command) {
+  // Sequenced commands look like "@<seq> <action> <duration>"; plain commands are still accepted
+  long seq = -1;
+  if (command.startsWith("@")) {
+    int seqEnd = command.indexOf(' ');
+    if (seqEnd == -1) {
+      Serial.println("Error: Invalid command format.");
       return;
     }
+    seq = command.substring(1, seqEnd).toInt();
+    command = command.substring(seqEnd + 1);
+    command.trim();
 
-    String action = command.substring(0, spaceIndex);
-    int duration = command.substring(spaceIndex + 1).toInt();
-
-    if (action == "forward") moveBase("forward", duration);
-    else if (action == "backward") moveBase("backward", duration);
-    else if (action == "left") moveLeft(duration);
-    else if (action == "right") moveRight(duration);
-    else if (action == "catch") controlClaw("catch", duration);
-    else if (action == "release") controlClaw("release", duration);
-    else if (action == "up") moveClaw("up", duration);
-    else if (action == "down") moveClaw("down", duration);
-    else {
-      Serial.println("Error: Unknown command received.");
+    if (seq == lastSeq) {
+      // Retransmission of a command we already accepted: acknowledge again but do not run it twice
+      sendAck(seq);
+      return;
     }
+    lastSeq = seq;
+    sendAck(seq);
   }
-}
 
-// Function to measure and send distance
-void measureDistance() {
-  if (sensorInitialized) {
-    VL53L0X_RangingMeasurementData_t measure;
-    lox.rangingTest(&measure, false); // Set to 'true' for debug data
-
-    if (measure.RangeStatus != 4) {  // 4 indicates out of range
-      Serial.print("Distance (mm): ");
-      Serial.println(measure.RangeMilliMeter);
+  int spaceIndex = command.indexOf(' ');  // Split command and duration
+
+  // Check if there's a space separating command and duration
+  if (spaceIndex == -1) {
+    // If the command is 'distance', measure and return distance (also while motors run)
+    if (command.equalsIgnoreCase("distance")) {
+      measureDistance(seq);
     } else {
-      Serial.println("Distance: Out of range");
+      sendError(seq, "Invalid command format.");
     }
+    return;
+  }
+
+  String action = command.substring(0, spaceIndex);
+
+  // The duration can be followed by a turn PWM ("right 120 180") or by the signed
+  // left and right wheel PWMs of a drive ("drive 300 200 150")
+  long fields[3] = {0, 0, 0};
+  int fieldCount = parseFields(command.substring(spaceIndex + 1), fields, 3);
+  int duration = fields[0];
+  int pwm = fieldCount > 1 ? constrain(fields[1], 0, 255) : TURN_PWM;
+
+  // A new command on a busy actuator preempts the running one
+  if (action == "forward") moveBase("forward", duration, seq);
+  else if (action == "backward") moveBase("backward", duration, seq);
+  else if (action == "left") moveLeft(duration, pwm, seq);
+  else if (action == "right") moveRight(duration, pwm, seq);
+  else if (action == "drive") {
+    if (fieldCount < 3) sendError(seq, "drive needs <duration> <left pwm> <right pwm>.");
+    else driveWheels(duration, fields[1], fields[2], seq);
+  }
+  else if (action == "catch") controlClaw("catch", duration, seq);
+  else if (action == "release") controlClaw("release", duration, seq);
+  else if (action == "up") moveClaw("up", duration, seq);
+  else if (action == "down") moveClaw("down", duration, seq);
+  else if (action == "stop") stopAllMotors(seq);
+  else sendError(seq, "Unknown command received.");
+}
+
+// Split space-separated integers into fields; returns how many were found
+int parseFields(String text, long *fields, int maxFields) {
+  int count = 0;
+  text.trim();
+  while (text.length() > 0 && count < maxFields) {
+    int spaceIndex = text.indexOf(' ');
+    String field = spaceIndex == -1 ? text : text.substring(0, spaceIndex);
+    fields[count++] = field.toInt();
+    text = spaceIndex == -1 ? "" : text.substring(spaceIndex + 1);
+    text.trim();
+  }
+  return count;
+}
+
+// Acknowledge that a sequenced command was received
+void sendAck(long seq) {
+  Serial.print("ACK ");
+  Serial.println(seq);
+}
+
+// Report that a sequenced command has finished, with an optional payload
+void sendDone(long seq, String payload) {
+  if (seq < 0) return;
+  Serial.print("DONE ");
+  Serial.print(seq);
+  if (payload.length() > 0) {
+    Serial.print(" ");
+    Serial.print(payload);
+  }
+  Serial.println();
+}
+
+// Report a rejected command; plain commands keep the original "Error: ..." replies
+void sendError(long seq, String message) {
+  if (seq < 0) {
+    Serial.print("Error: ");
+    Serial.println(message);
+    return;
+  }
+  Serial.print("ERR ");
+  Serial.print(seq);
+  Serial.print(" ");
+  Serial.println(message);
+}
+
+// Function to measure and send distance
+void measureDistance(long seq) {
+  if (!sensorInitialized) {
+    sendError(seq, "VL53L0X sensor not initialized");
+    return;
+  }
+
+  VL53L0X_RangingMeasurementData_t measure;
+  lox.rangingTest(&measure, false); // Set to 'true' for debug data
+
+  String reading;
+  if (measure.RangeStatus != 4) {  // 4 indicates out of range
+    reading = "Distance (mm): " + String(measure.RangeMilliMeter);
+  } else {
+    reading = "Distance: Out of range";
+  }
+
+  if (seq < 0) {
+    Serial.println(reading);
   } else {
-    Serial.println("Error: VL53L0X sensor not initialized");
+    sendDone(seq, reading);
   }
 }
 
+// Start timing a motion whose motor pins have already been driven
+void startActuator(Actuator &actuator, int duration, long seq) {
+  if (actuator.active) {
+    // Preempted by the new command, which has already taken over the motor pins
+    sendDone(actuator.seq, "stopped");
+  }
+  actuator.active = true;
+  actuator.startedAt = millis();
+  actuator.duration = duration;
+  actuator.seq = seq;
+}
+
+// Cut the actuator's motors and report its command as finished
+void finishActuator(Actuator &actuator, String payload) {
+  for (int i = 0; i < actuator.pinCount; i++) {
+    analogWrite(actuator.pwmPins[i], 0);
+  }
+  if (actuator.active) {
+    actuator.active = false;
+    sendDone(actuator.seq, payload);
+  }
+}
+
+void updateActuator(Actuator &actuator) {
+  if (actuator.active && millis() - actuator.startedAt >= actuator.duration) {
+    finishActuator(actuator, "");
+  }
+}
+
+// Function to stop every motor immediately, interrupting running motions
+void stopAllMotors(long seq) {
+  finishActuator(baseActuator, "stopped");
+  finishActuator(clawActuator, "stopped");
+  finishActuator(armActuator, "stopped");
+  sendDone(seq, "");
+}
+
 // Function to control base movement forward and backward
-void moveBase(String direction, int duration) {
+void moveBase(String direction, int duration, long seq) {
   if (direction == "forward") {
     digitalWrite(motor1_dir, HIGH);
     analogWrite(motor1_pwm, 160);
@@ -146,37 +332,44 @@ void moveBase(String direction, int duration) {
     analogWrite(motor2_pwm, 160);
   }
 
-  delay(duration);
-  analogWrite(motor1_pwm, 0);
-  analogWrite(motor2_pwm, 0);
+  startActuator(baseActuator, duration, seq);
 }
 
 // Function to move base left (rotate counterclockwise)
-void moveLeft(int duration) {
+void moveLeft(int duration, int pwm, long seq) {
   digitalWrite(motor1_dir, HIGH);
-  analogWrite(motor1_pwm, 200);
+  analogWrite(motor1_pwm, pwm);
   digitalWrite(motor2_dir, HIGH);
-  analogWrite(motor2_pwm, 200);
+  analogWrite(motor2_pwm, pwm);
 
-  delay(duration);
-  analogWrite(motor1_pwm, 0);
-  analogWrite(motor2_pwm, 0);
+  startActuator(baseActuator, duration, seq);
 }
 
 // Function to move base right (rotate clockwise)
-void moveRight(int duration) {
+void moveRight(int duration, int pwm, long seq) {
   digitalWrite(motor1_dir, LOW);
-  analogWrite(motor1_pwm, 200);
+  analogWrite(motor1_pwm, pwm);
   digitalWrite(motor2_dir, LOW);
-  analogWrite(motor2_pwm, 200);
+  analogWrite(motor2_pwm, pwm);
+
+  startActuator(baseActuator, duration, seq);
+}
 
-  delay(duration);
-  analogWrite(motor1_pwm, 0);
-  analogWrite(motor2_pwm, 0);
+// Drive both wheels at signed PWM duties, for arcs and steering while moving forward.
+// Motor 1 is the right wheel (HIGH = forward), motor 2 the left wheel (LOW = forward).
+void driveWheels(int duration, int leftPwm, int rightPwm, long seq) {
+  leftPwm = constrain(leftPwm, -255, 255);
+  rightPwm = constrain(rightPwm, -255, 255);
+  digitalWrite(motor2_dir, leftPwm >= 0 ? LOW : HIGH);
+  analogWrite(motor2_pwm, abs(leftPwm));
+  digitalWrite(motor1_dir, rightPwm >= 0 ? HIGH : LOW);
+  analogWrite(motor1_pwm, abs(rightPwm));
+
+  startActuator(baseActuator, duration, seq);
 }
 
 // Function to control the claw (catch and release)
-void controlClaw(String action, int duration) {
+void controlClaw(String action, int duration, long seq) {
   if (action == "catch") {
     digitalWrite(motor3_dir, HIGH);
     analogWrite(motor3_pwm, 255);
@@ -185,12 +378,11 @@ void controlClaw(String action, int duration) {
     analogWrite(motor3_pwm, 255);
   }
 
-  delay(duration);
-  analogWrite(motor3_pwm, 0);
+  startActuator(clawActuator, duration, seq);
 }
 
 // Function to control claw movement (up and down)
-void moveClaw(String direction, int duration) {
+void moveClaw(String direction, int duration, long seq) {
   if (direction == "up") {
     digitalWrite(motor4_dir, LOW);
     analogWrite(motor4_pwm, 255);
@@ -199,6 +391,5 @@ void moveClaw(String direction, int duration) {
     analogWrite(motor4_pwm, 255);
   }
 
-  delay(duration);
-  analogWrite(motor4_pwm, 0);
+  startActuator(armActuator, duration, seq);
 }
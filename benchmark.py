@@ -0,0 +1,360 @@
+import argparse
+import contextlib
+import json
+import logging
+import os
+import platform
+import subprocess
+import time
+
+import cv2
+import numpy as np
+
+import pipeline
+import simulator
+from detector_backends import create_detector
+from frame_grabber import CapturedFrame
+from letterbox import Letterbox
+from range_sensor import RangeSensor
+from replay_capture import ReplayCapture
+from serial_channel import open_channel
+
+RESULTS_DIR = 'benchmarks'
+PERCENTILES = (50, 95, 99)
+
+
+def summarize(samples):
+    """p50/p95/p99 and mean of a list of durations in seconds, reported in milliseconds."""
+    if not samples:
+        return {'count': 0}
+    ms = np.asarray(samples) * 1000
+    summary = {f'p{q}': round(float(np.percentile(ms, q)), 3) for q in PERCENTILES}
+    summary.update(mean=round(float(ms.mean()), 3), count=len(ms))
+    return summary
+
+
+class StageTimer:
+    """Collects durations, and the start time of each measured call, per named stage."""
+
+    def __init__(self):
+        self.samples = {}
+        self.starts = {}
+
+    def add(self, stage, seconds):
+        self.samples.setdefault(stage, []).append(seconds)
+
+    @contextlib.contextmanager
+    def measure(self, stage):
+        started = time.perf_counter()
+        self.starts.setdefault(stage, []).append(started)
+        try:
+            yield
+        finally:
+            self.add(stage, time.perf_counter() - started)
+
+    def report(self):
+        return {stage: summarize(samples) for stage, samples in self.samples.items()}
+
+
+@contextlib.contextmanager
+def timed_functions(module, timer, names):
+    """Wrap module-level functions so every call is recorded under its name, then restore them."""
+    originals = {name: getattr(module, name) for name in names}
+
+    def wrap(name, function):
+        def timed(*args, **kwargs):
+            with timer.measure(name):
+                return function(*args, **kwargs)
+        return timed
+
+    for name, function in originals.items():
+        setattr(module, name, wrap(name, function))
+    try:
+        yield
+    finally:
+        for name, function in originals.items():
+            setattr(module, name, function)
+
+
+def load_frames(source=None, count=100, size=(pipeline.FRAME_WIDTH, pipeline.FRAME_HEIGHT)):
+    """Recorded frames from a video or image folder, or simulated scene frames when no source is given."""
+    if source:
+        capture = ReplayCapture(source, fps=None, loop=False, size=size)
+    else:
+        clock = simulator.SimClock()
+        capture = simulator.SimulatedCamera(simulator.WorldModel.from_scene(simulator.DEFAULT_SCENE, clock),
+                                            size=size, fps=1e6)
+    frames = []
+    while len(frames) < count:
+        ok, frame = capture.read()
+        if not ok:
+            break
+        frames.append(frame)
+    capture.release()
+    return frames
+
+
+def load_detector(backend, imgsz=pipeline.INFERENCE_SIZE):
+    return create_detector(backend, pipeline.MODEL_WEIGHTS, imgsz=imgsz, conf=pipeline.CONFIDENCE_THRESHOLD,
+                           iou=pipeline.NMS_IOU_THRESHOLD, threads=pipeline.DETECTOR_THREADS,
+                           precision=pipeline.DETECTOR_PRECISION)
+
+
+def bench_detector(backend, imgsz, frames, batch=1, warmup=3):
+    """Letterbox, inference and box mapping latency plus throughput for one backend and resolution."""
+    detector = load_detector(backend, imgsz)
+    letterboxes = [Letterbox(imgsz) for _ in range(batch)]
+    batches = [frames[i:i + batch] for i in range(0, len(frames) - batch + 1, batch)]
+
+    for chunk in batches[:warmup]:
+        detector.predict([letterboxes[i](frame) for i, frame in enumerate(chunk)])
+
+    timer = StageTimer()
+    started = time.perf_counter()
+    for chunk in batches:
+        with timer.measure('total'):
+            with timer.measure('letterbox'):
+                canvases = [letterboxes[i](frame) for i, frame in enumerate(chunk)]
+            with timer.measure('inference'):
+                outputs = detector.predict(canvases)
+            with timer.measure('postprocess'):
+                for (_, _, boxes), letterbox in zip(outputs, letterboxes):
+                    letterbox.to_frame(boxes)
+    elapsed = time.perf_counter() - started
+
+    return {
+        'detector': detector.describe(),
+        'batch': batch,
+        'stages': timer.report(),
+        'fps': round(len(batches) * batch / elapsed, 2) if elapsed else None,
+    }
+
+
+def bench_process_frame(frames, model, display=False):
+    """Per-stage latency of process_frame; alignment moves are skipped so only vision is measured."""
+    timer = StageTimer()
+    with timed_functions(pipeline, timer, ['detect_objects']), \
+            _replaced(pipeline, align_robot=lambda *args, **kwargs: None, stop_movement=lambda: None):
+        for frame_id, frame in enumerate(frames):
+            captured = CapturedFrame(frame_id, time.monotonic(), frame.copy())
+            started = time.perf_counter()
+            annotated, _ = pipeline.process_frame(captured, model)
+            total = time.perf_counter() - started
+            timer.add('process_frame', total)
+            timer.add('drawing', total - timer.samples['detect_objects'][-1])
+            if display:
+                with timer.measure('imshow'):
+                    cv2.imshow('benchmark', annotated)
+                    cv2.waitKey(1)
+    if display:
+        cv2.destroyWindow('benchmark')
+    return timer.report()
+
+
+@contextlib.contextmanager
+def _replaced(module, **replacements):
+    originals = {name: getattr(module, name) for name in replacements}
+    for name, value in replacements.items():
+        setattr(module, name, value)
+    try:
+        yield
+    finally:
+        for name, value in originals.items():
+            setattr(module, name, value)
+
+
+def bench_serial(port=None, iterations=200):
+    """Command round trip ('stop', which completes at once) and distance read latency.
+
+    Runs against the virtual Arduino unless a real port is given.
+    """
+    arduino = None
+    if port is None:
+        clock = simulator.SimClock()
+        arduino = simulator.VirtualArduino(simulator.WorldModel.from_scene(simulator.DEFAULT_SCENE, clock),
+                                           clock).start()
+        port = arduino.port
+    channel = open_channel(port, pipeline.SERIAL_BAUDRATE, startup_delay=0.0 if arduino else 2.0)
+    range_sensor = RangeSensor(channel)
+    timer = StageTimer()
+    try:
+        for _ in range(iterations):
+            with timer.measure('round_trip'):
+                channel.send('stop', 0).result()
+            with timer.measure('get_distance'):
+                range_sensor.read_mm()
+    finally:
+        channel.close()
+        if arduino:
+            arduino.close()
+    return {'port': 'virtual' if arduino else port, 'stages': timer.report()}
+
+
+def bench_time_to_grasp(classes, time_scale=10.0, distance_cm=100, bearing_deg=15):
+    """Simulated pick of each class on its own, with the loop's stage latencies and aligning frame rate."""
+    results = {}
+    for class_name in classes:
+        timer = StageTimer()
+        scene = [{'class_name': class_name, 'bearing_deg': bearing_deg, 'distance_cm': distance_cm}]
+        with timed_functions(pipeline, timer, ['process_frame', 'get_distance', 'catch_claw_command']):
+            result = simulator.run_simulation([class_name], scene, time_scale=time_scale)
+        # The aligning loop calls process_frame once per iteration; the median gap skips the approach phases
+        frame_starts = timer.starts.get('process_frame', [])
+        aligning_frames = len(frame_starts)
+        frame_period = float(np.median(np.diff(frame_starts))) if aligning_frames > 1 else 0.0
+        results[class_name] = {
+            'status': result['status'],
+            'time_to_grasp_sim_s': result['sim_seconds'],
+            'time_to_grasp_real_s': result['real_seconds'],
+            'aligning_frames': aligning_frames,
+            'aligning_fps': round(1.0 / frame_period, 2) if frame_period else None,
+            'stages': timer.report(),
+        }
+    return results
+
+
+def bench_alignment(controllers, bearings, class_name='bottle', distance_cm=100, time_scale=10.0):
+    """Simulated time from the first frame until the target is centred, per controller and start bearing."""
+    results = {}
+    for kind in controllers:
+        runs = []
+        for bearing in bearings:
+            timer = StageTimer()
+            scene = [{'class_name': class_name, 'bearing_deg': bearing, 'distance_cm': distance_cm}]
+            # Stepwise approach, so alignment ends where the first forward step starts
+            with _replaced(pipeline, ALIGNMENT_CONTROLLER=kind, APPROACH_MODE='stepwise'), \
+                    timed_functions(pipeline, timer, ['process_frame', 'move_base', 'move_forward_and_check_distance']):
+                result = simulator.run_simulation([class_name], scene, time_scale=time_scale)
+
+            # The first approach step starts as soon as the target has been centred
+            frame_starts = timer.starts.get('process_frame', [])
+            approach_starts = timer.starts.get('move_forward_and_check_distance', [])
+            run = {'bearing_deg': bearing, 'status': result['status']}
+            if frame_starts and approach_starts:
+                aligned_at = approach_starts[0]
+                run.update(
+                    time_to_align_sim_s=round((aligned_at - frame_starts[0]) * time_scale, 3),
+                    frames=sum(1 for t in frame_starts if t < aligned_at),
+                    pulses=sum(1 for t in timer.starts.get('move_base', []) if t < aligned_at),
+                )
+            runs.append(run)
+        times = [run['time_to_align_sim_s'] for run in runs if 'time_to_align_sim_s' in run]
+        results[kind] = {
+            'runs': runs,
+            'mean_time_to_align_sim_s': round(float(np.mean(times)), 3) if times else None,
+            'converged': f"{len(times)}/{len(runs)}",
+        }
+    return results
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], text=True,
+                                       stderr=subprocess.DEVNULL).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(current, baseline, path=()):
+    """Print the p50/p95 change of every stage present in both result files."""
+    for key, value in current.items():
+        if not isinstance(value, dict) or key not in baseline:
+            continue
+        if 'p50' in value and 'p50' in baseline[key]:
+            changes = []
+            for stat in ('p50', 'p95'):
+                old, new = baseline[key][stat], value[stat]
+                change = f"{(new - old) / old * 100:+.1f}%" if old else "n/a"
+                changes.append(f"{stat} {old:.2f} -> {new:.2f}ms ({change})")
+            print(f"{'/'.join(path + (key,))}: {', '.join(changes)}")
+        else:
+            compare(value, baseline[key], path + (key,))
+
+
+def run(args):
+    results = {}
+    frames = load_frames(args.frames, args.frame_count)
+    logging.info(f"Benchmarking with {len(frames)} frame(s).")
+
+    if 'detector' in args.suites:
+        results['detector'] = {}
+        for backend in args.backends:
+            for imgsz in args.sizes:
+                key = f"{backend}@{imgsz}"
+                try:
+                    results['detector'][key] = bench_detector(backend, imgsz, frames, batch=args.batch)
+                except Exception as e:
+                    logging.error(f"Detector benchmark {key} failed: {e}")
+                    results['detector'][key] = {'error': str(e)}
+
+    if 'process_frame' in args.suites:
+        try:
+            model = load_detector(args.backends[0])
+            results['process_frame'] = bench_process_frame(frames, model, display=args.display)
+        except Exception as e:
+            logging.error(f"process_frame benchmark failed: {e}")
+            results['process_frame'] = {'error': str(e)}
+
+    if 'serial' in args.suites:
+        results['serial'] = bench_serial(args.port, args.serial_iterations)
+
+    if 'grasp' in args.suites:
+        results['grasp'] = bench_time_to_grasp(args.classes, time_scale=args.time_scale)
+
+    if 'alignment' in args.suites:
+        results['alignment'] = bench_alignment(args.controllers, args.bearings, time_scale=args.time_scale)
+
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the pick pipeline and save the results as JSON.")
+    parser.add_argument('--suites', nargs='+', default=['detector', 'process_frame', 'serial', 'grasp', 'alignment'],
+                        choices=['detector', 'process_frame', 'serial', 'grasp', 'alignment'])
+    parser.add_argument('--frames', help="Recorded video or image folder (default: simulated scene frames).")
+    parser.add_argument('--frame-count', type=int, default=100)
+    parser.add_argument('--backends', nargs='+', default=[pipeline.DETECTOR_BACKEND])
+    parser.add_argument('--sizes', nargs='+', type=int, default=[pipeline.INFERENCE_SIZE])
+    parser.add_argument('--batch', type=int, default=1)
+    parser.add_argument('--display', action='store_true', help="Include cv2.imshow in the process_frame numbers.")
+    parser.add_argument('--port', help="Benchmark a real Arduino on this port instead of the virtual one.")
+    parser.add_argument('--serial-iterations', type=int, default=200)
+    parser.add_argument('--classes', nargs='+', default=list(simulator.MARKER_COLORS))
+    parser.add_argument('--controllers', nargs='+', default=['fixed', 'proportional', 'pid', 'scheduled'])
+    parser.add_argument('--bearings', nargs='+', type=float, default=[8, 20, -30],
+                        help="Start bearings (degrees) of the target for the alignment suite.")
+    parser.add_argument('--time-scale', type=float, default=10.0)
+    parser.add_argument('--output', help=f"Result file (default: {RESULTS_DIR}/<time>_<commit>.json).")
+    parser.add_argument('--compare', help="Earlier result file to compare against.")
+    parser.add_argument('--verbose', action='store_true', help="Keep the pipeline's INFO logging.")
+    args = parser.parse_args()
+
+    if not args.verbose:
+        logging.getLogger().setLevel(logging.WARNING)
+
+    commit = git_commit()
+    report = {
+        'commit': commit,
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'platform': platform.platform(),
+        'python': platform.python_version(),
+        'results': run(args),
+    }
+
+    output = args.output
+    if output is None:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        output = os.path.join(RESULTS_DIR, f"{time.strftime('%Y%m%d-%H%M%S')}_{commit or 'nogit'}.json")
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"Results saved to {output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        print(f"Compared with {args.compare} ({baseline.get('commit')}):")
+        compare(report['results'], baseline['results'])
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+import logging
+import time
+
+from metrics import metrics
+
+BEGIN_MARKER = "BEGIN COMMANDS"
+END_MARKER = "END COMMANDS"
+MOTION_COMMANDS = {'forward', 'backward', 'left', 'right', 'up', 'down', 'catch', 'release', 'stop'}
+
+
+class CommandStreamParser:
+    """Pulls command lines out of a streamed LLM reply as soon as each line is complete.
+
+    Only the first BEGIN COMMANDS ... END COMMANDS block is read, as with the non-streaming regex.
+    """
+
+    def __init__(self):
+        self.text = ''
+        self.found_block = False
+        self._line = ''
+        self._in_block = False
+        self._finished = False
+
+    def feed(self, chunk):
+        """Add streamed text; returns the command lines it completed."""
+        self.text += chunk
+        self._line += chunk
+        commands = []
+        while '\n' in self._line:
+            line, self._line = self._line.split('\n', 1)
+            commands.extend(self._parse_line(line))
+        return commands
+
+    def close(self):
+        """Flush the last line once the stream has ended."""
+        line, self._line = self._line, ''
+        return self._parse_line(line)
+
+    def _parse_line(self, line):
+        line = line.strip()
+        if self._finished:
+            return []
+        if not self._in_block:
+            if BEGIN_MARKER not in line:
+                return []
+            self._in_block = self.found_block = True
+            line = line.split(BEGIN_MARKER, 1)[1].strip()
+        if END_MARKER in line:
+            line = line.split(END_MARKER, 1)[0].strip()
+            self._in_block = False
+            self._finished = True
+        return [line] if line else []
+
+
+class CommandExecutor:
+    """Feeds streamed motion commands into one streaming 'commands' job on a JobRunner.
+
+    The job runs the commands one after another on the runner's thread, each waiting for the previous
+    one's DONE, so nothing blocks the caller and the commands queue behind a running pick instead of
+    interleaving with it. 'stop' skips the queue: `stop()` cancels the jobs and stops the robot at once.
+    """
+
+    def __init__(self, runner, stop):
+        self.runner = runner
+        self.stop = stop
+        self.job_ids = []  # Jobs started for this reply; a stop mid-reply means later commands need a new one
+        self.first_command_at = None
+        self._started = time.perf_counter()
+
+    def submit(self, line):
+        """Queue a '<command> <duration>' line. Returns False for lines that are not motion commands."""
+        parts = line.split()
+        if len(parts) != 2 or parts[0] not in MOTION_COMMANDS or not parts[1].isdigit():
+            return False
+        command, duration = parts[0], int(parts[1])
+        if self.first_command_at is None:
+            self.first_command_at = time.perf_counter() - self._started
+            metrics.observe('llm_first_command', self.first_command_at)
+            logging.info(f"First streamed command '{line}' after {self.first_command_at * 1000:.0f}ms.")
+        if command == 'stop':
+            self.stop(duration)
+        elif not self.job_ids or not self.runner.append(self.job_ids[-1], [(command, duration)]):
+            self.job_ids.append(self.runner.submit('commands', commands=[(command, duration)], streaming=True))
+        return True
+
+    def close(self):
+        """Mark the reply's jobs complete, without waiting for them, and return their ids."""
+        for job_id in self.job_ids:
+            self.runner.close(job_id)
+        return self.job_ids
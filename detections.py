@@ -0,0 +1,47 @@
+import numpy as np
+
+# One row per detection; boxes are [x1, y1, x2, y2] in frame pixels
+DETECTION_DTYPE = np.dtype([
+    ('class_id', np.int32),
+    ('conf', np.float32),
+    ('x1', np.float32),
+    ('y1', np.float32),
+    ('x2', np.float32),
+    ('y2', np.float32),
+])
+
+
+def empty_detections():
+    return np.empty(0, dtype=DETECTION_DTYPE)
+
+
+def to_structured(class_ids, confidences, boxes):
+    """Pack whole-frame class, confidence and (N, 4) box arrays into one structured array."""
+    detections = np.empty(len(class_ids), dtype=DETECTION_DTYPE)
+    detections['class_id'] = class_ids
+    detections['conf'] = confidences
+    boxes = np.asarray(boxes, dtype=np.float32).reshape(-1, 4)
+    detections['x1'] = boxes[:, 0]
+    detections['y1'] = boxes[:, 1]
+    detections['x2'] = boxes[:, 2]
+    detections['y2'] = boxes[:, 3]
+    return detections
+
+
+def boxes_of(detections):
+    """(N, 4) float32 array of the [x1, y1, x2, y2] columns."""
+    return np.stack([detections['x1'], detections['y1'], detections['x2'], detections['y2']], axis=1)
+
+
+def to_dicts(detections, class_names):
+    """Per-detection dicts in the format process_frame and the tracker work with."""
+    boxes = boxes_of(detections)
+    return [
+        {
+            'class_id': int(class_id),
+            'class_name': class_names[class_id],
+            'box': box,
+            'confidence': conf,
+        }
+        for class_id, conf, box in zip(detections['class_id'], detections['conf'], boxes)
+    ]
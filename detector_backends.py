@@ -0,0 +1,193 @@
+import abc
+import logging
+import os
+import shutil
+
+import cv2
+import numpy as np
+
+PRECISIONS = ('fp32', 'fp16', 'int8')
+NMS_MAX_WH = 7680  # Offset per class so one NMS call never suppresses across classes
+
+
+class DetectorBackend(abc.ABC):
+    """Runs the detector on letterboxed canvases.
+
+    predict() returns one (class_ids, confidences, boxes) tuple per canvas, with boxes as an
+    (N, 4) [x1, y1, x2, y2] array in canvas pixels, whatever runtime is underneath.
+    """
+
+    name = 'base'
+
+    def __init__(self, weights, imgsz=640, conf=0.5, iou=0.7):
+        self.weights = weights
+        self.imgsz = imgsz
+        self.conf = conf
+        self.iou = iou
+
+    @abc.abstractmethod
+    def predict(self, canvases):
+        """One (class_ids, confidences, boxes) tuple per canvas."""
+
+    def describe(self):
+        return f"{self.name} ({self.weights}, {self.imgsz}px)"
+
+
+class TorchBackend(DetectorBackend):
+    name = 'torch'
+
+    def __init__(self, weights, imgsz=640, conf=0.5, iou=0.7, device='cpu'):
+        super().__init__(weights, imgsz, conf, iou)
+        from ultralytics import YOLO  # Imported here so the ONNX/OpenVINO paths never load torch
+        self.device = device
+        self.model = YOLO(weights)
+
+    def predict(self, canvases):
+        results = self.model(canvases, conf=self.conf, iou=self.iou, imgsz=self.imgsz,
+                             device=self.device, verbose=False)
+        outputs = []
+        for result in results:
+            boxes = result.boxes
+            outputs.append((boxes.cls.cpu().numpy().astype(np.int32),
+                            boxes.conf.cpu().numpy(),
+                            boxes.xyxy.cpu().numpy()))
+        return outputs
+
+    def describe(self):
+        return f"{self.name} on {self.device} ({self.weights}, {self.imgsz}px)"
+
+
+def export_path(weights, backend, precision, imgsz):
+    """Where the exported model for these settings is cached, next to the .pt weights."""
+    stem = os.path.splitext(weights)[0]
+    suffix = '' if precision == 'fp32' else f'_{precision}'
+    if backend == 'onnx':
+        return f"{stem}_{imgsz}{suffix}.onnx"
+    return os.path.join(f"{stem}_{imgsz}{suffix}_openvino_model", f"{os.path.basename(stem)}.xml")
+
+
+def is_stale(exported, weights):
+    return not os.path.exists(exported) or os.path.getmtime(exported) < os.path.getmtime(weights)
+
+
+def export_model(weights, backend, precision='fp32', imgsz=640):
+    """Export `weights` once with ultralytics and return the cached path; re-exports when the weights change."""
+    if precision not in PRECISIONS:
+        raise ValueError(f"Unknown precision '{precision}'. Use one of {PRECISIONS}.")
+    target = export_path(weights, backend, precision, imgsz)
+    if not is_stale(target, weights):
+        return target
+
+    from ultralytics import YOLO
+    logging.info(f"Exporting '{weights}' to {backend} ({precision}, {imgsz}px). This only happens once.")
+    model = YOLO(weights)
+
+    if backend == 'onnx':
+        exported = model.export(format='onnx', imgsz=imgsz, dynamic=True, simplify=True)
+        if precision == 'fp16':
+            import onnx
+            from onnxconverter_common import float16
+            onnx.save(float16.convert_float_to_float16(onnx.load(exported), keep_io_types=True), target)
+        elif precision == 'int8':
+            from onnxruntime.quantization import QuantType, quantize_dynamic
+            quantize_dynamic(exported, target, weight_type=QuantType.QUInt8)
+        else:
+            os.replace(exported, target)
+    else:
+        exported = model.export(format='openvino', imgsz=imgsz, half=precision == 'fp16',
+                                int8=precision == 'int8')
+        target_dir = os.path.dirname(target)
+        if os.path.isdir(target_dir):
+            shutil.rmtree(target_dir)
+        os.replace(exported, target_dir)
+
+    logging.info(f"Cached exported model at '{target}'.")
+    return target
+
+
+def to_blob(canvases):
+    """Stack BGR uint8 canvases into one RGB float32 NCHW blob scaled to [0, 1]."""
+    batch = np.stack(canvases)[..., ::-1]
+    return np.ascontiguousarray(batch.transpose(0, 3, 1, 2), dtype=np.float32) / 255.0
+
+
+def decode_yolo_output(output, conf, iou):
+    """Turn raw (4 + num_classes, anchors) YOLO head output for one image into NMS-filtered detections."""
+    predictions = output.T  # (anchors, 4 + num_classes)
+    scores = predictions[:, 4:]
+    class_ids = scores.argmax(axis=1).astype(np.int32)
+    confidences = scores[np.arange(len(scores)), class_ids]
+    keep = confidences >= conf
+    if not keep.any():
+        return np.empty(0, np.int32), np.empty(0, np.float32), np.empty((0, 4), np.float32)
+
+    predictions, class_ids, confidences = predictions[keep], class_ids[keep], confidences[keep]
+    cx, cy, w, h = predictions[:, 0], predictions[:, 1], predictions[:, 2], predictions[:, 3]
+    boxes = np.stack([cx - w / 2, cy - h / 2, cx + w / 2, cy + h / 2], axis=1)
+
+    # Class-aware NMS in a single call by shifting each class into its own region
+    offsets = (class_ids * NMS_MAX_WH)[:, None].astype(np.float32)
+    shifted = boxes + offsets
+    rects = np.stack([shifted[:, 0], shifted[:, 1], w, h], axis=1)
+    indices = np.asarray(cv2.dnn.NMSBoxes(rects.tolist(), confidences.tolist(), conf, iou), dtype=np.int64).reshape(-1)
+    return class_ids[indices], confidences[indices].astype(np.float32), boxes[indices].astype(np.float32)
+
+
+class OnnxBackend(DetectorBackend):
+    name = 'onnx'
+
+    def __init__(self, weights, imgsz=640, conf=0.5, iou=0.7, threads=4, precision='fp32'):
+        super().__init__(weights, imgsz, conf, iou)
+        import onnxruntime as ort
+        self.precision = precision
+        self.path = export_model(weights, 'onnx', precision, imgsz)
+        options = ort.SessionOptions()
+        options.intra_op_num_threads = threads
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = ort.InferenceSession(self.path, options, providers=['CPUExecutionProvider'])
+        self.input_name = self.session.get_inputs()[0].name
+        self.threads = threads
+
+    def predict(self, canvases):
+        output = self.session.run(None, {self.input_name: to_blob(canvases)})[0]
+        return [decode_yolo_output(image_output, self.conf, self.iou) for image_output in output]
+
+    def describe(self):
+        return f"{self.name} {self.precision} x{self.threads} threads ({self.path}, {self.imgsz}px)"
+
+
+class OpenVinoBackend(DetectorBackend):
+    name = 'openvino'
+
+    def __init__(self, weights, imgsz=640, conf=0.5, iou=0.7, threads=4, precision='fp32'):
+        super().__init__(weights, imgsz, conf, iou)
+        import openvino as ov
+        self.precision = precision
+        self.path = export_model(weights, 'openvino', precision, imgsz)
+        config = {'INFERENCE_NUM_THREADS': threads}
+        if precision == 'fp16':
+            config['INFERENCE_PRECISION_HINT'] = 'f16'
+        self.compiled = ov.Core().compile_model(self.path, 'CPU', config)
+        self.threads = threads
+
+    def predict(self, canvases):
+        output = self.compiled(to_blob(canvases))[0]
+        return [decode_yolo_output(image_output, self.conf, self.iou) for image_output in output]
+
+    def describe(self):
+        return f"{self.name} {self.precision} x{self.threads} threads ({self.path}, {self.imgsz}px)"
+
+
+BACKENDS = {
+    'torch': TorchBackend,
+    'onnx': OnnxBackend,
+    'openvino': OpenVinoBackend,
+}
+
+
+def create_detector(backend, weights, imgsz=640, conf=0.5, iou=0.7, threads=4, precision='fp32'):
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown detector backend '{backend}'. Use one of {list(BACKENDS)}.")
+    if backend == 'torch':
+        return TorchBackend(weights, imgsz, conf, iou)
+    return BACKENDS[backend](weights, imgsz, conf, iou, threads=threads, precision=precision)
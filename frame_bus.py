@@ -0,0 +1,251 @@
+import argparse
+import logging
+import multiprocessing
+import os
+import time
+from multiprocessing import resource_tracker, shared_memory
+
+import cv2
+import numpy as np
+
+from frame_grabber import CapturedFrame
+from replay_capture import ReplayCapture
+
+BUS_NAME = 'robogpt_frames'
+BUS_SLOTS = 4  # A zero-copy frame stays valid for about this many frame periods
+BUS_MAGIC = 0x524F424F  # Marks a fully initialised bus
+HEADER_FIELDS = 8  # magic, height, width, channels, slots, latest sequence, writer pid, spare
+POLL_INTERVAL = 0.002
+ATTACH_TIMEOUT = 10.0
+
+
+def _attach(name):
+    """Open an existing segment without letting this process's resource tracker unlink it on exit."""
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:  # Python < 3.13
+        shm = shared_memory.SharedMemory(name=name)
+        resource_tracker.unregister(shm._name, 'shared_memory')
+        return shm
+
+
+class FrameBus:
+    """Ring of camera frames in shared memory, written by one capture process and read by any number of others.
+
+    Every slot carries the sequence number of the frame in it; the writer zeroes it while copying a
+    frame in, so a reader can tell whether a frame it is looking at has been overwritten since.
+    """
+
+    def __init__(self, shm, owner=False):
+        self.shm = shm
+        self.owner = owner
+        self._header = np.ndarray((HEADER_FIELDS,), dtype=np.int64, buffer=shm.buf)
+        _, height, width, channels, slots = (int(value) for value in self._header[:5])
+        self.shape = (height, width, channels)
+        self.slots = slots
+        offset = self._header.nbytes
+        self._sequences = np.ndarray((slots,), dtype=np.int64, buffer=shm.buf, offset=offset)
+        offset += self._sequences.nbytes
+        self._timestamps = np.ndarray((slots,), dtype=np.float64, buffer=shm.buf, offset=offset)
+        offset += self._timestamps.nbytes
+        self._frames = np.ndarray((slots, *self.shape), dtype=np.uint8, buffer=shm.buf, offset=offset)
+
+    @classmethod
+    def create(cls, shape, name=BUS_NAME, slots=BUS_SLOTS):
+        """Create the bus for frames of `shape` (height, width, channels), replacing a stale one of the same name."""
+        size = (HEADER_FIELDS + 2 * slots) * 8 + slots * int(np.prod(shape))
+        try:
+            shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+        except FileExistsError:
+            stale = _attach(name)
+            stale.close()
+            stale.unlink()
+            shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+        header = np.ndarray((HEADER_FIELDS,), dtype=np.int64, buffer=shm.buf)
+        header[:] = (0, *shape, slots, 0, os.getpid(), 0)
+        bus = cls(shm, owner=True)
+        bus._sequences[:] = 0
+        header[0] = BUS_MAGIC
+        return bus
+
+    @classmethod
+    def attach(cls, name=BUS_NAME, timeout=0.0):
+        """Attach to a running bus, waiting up to `timeout` seconds for it to appear. Returns None if it never does."""
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                shm = _attach(name)
+                if np.ndarray((1,), dtype=np.int64, buffer=shm.buf)[0] == BUS_MAGIC:
+                    return cls(shm)
+                shm.close()
+            except FileNotFoundError:
+                pass
+            if time.monotonic() >= deadline:
+                return None
+            time.sleep(0.05)
+
+    @property
+    def latest_id(self):
+        return int(self._header[5])
+
+    def publish(self, image, timestamp=None):
+        """Copy a frame into the next slot and return its sequence number."""
+        sequence = self.latest_id + 1
+        slot = sequence % self.slots
+        self._sequences[slot] = 0
+        self._frames[slot] = image
+        self._timestamps[slot] = time.monotonic() if timestamp is None else timestamp
+        self._sequences[slot] = sequence
+        self._header[5] = sequence
+        return sequence
+
+    def read(self, timeout=1.0, after_id=None, after_time=None, copy=False):
+        """Return (ok, CapturedFrame) for the newest frame, like FrameGrabber.read().
+
+        Without `copy` the image is a read-only view into shared memory: nothing is copied, but the
+        writer reuses the slot `slots` frames later, so check valid() before trusting what was read.
+        """
+        deadline = time.monotonic() + timeout
+        while True:
+            sequence = self.latest_id
+            slot = sequence % self.slots
+            if sequence and self._sequences[slot] == sequence \
+                    and (after_id is None or sequence > after_id) \
+                    and (after_time is None or self._timestamps[slot] >= after_time):
+                timestamp = float(self._timestamps[slot])
+                image = self._frames[slot]
+                if copy:
+                    image = image.copy()
+                else:
+                    image = image.view()
+                    image.flags.writeable = False
+                if self._sequences[slot] == sequence:
+                    return True, CapturedFrame(sequence, timestamp, image)
+                continue
+            if time.monotonic() >= deadline:
+                return False, None
+            time.sleep(POLL_INTERVAL)
+
+    def valid(self, frame):
+        """Whether a frame returned by read() is still in its slot, i.e. a zero-copy view of it was not overwritten."""
+        return self._sequences[frame.frame_id % self.slots] == frame.frame_id
+
+    def close(self):
+        # Views handed out by read() must be gone before the mapping can close
+        self._header = self._sequences = self._timestamps = self._frames = None
+        try:
+            self.shm.close()
+        except BufferError:
+            logging.debug("Frame bus views still in use; the mapping closes with the process.")
+        if self.owner:
+            self.shm.unlink()
+
+
+class BusCapture:
+    """cv2.VideoCapture stand-in that reads the frame bus, so FrameGrabber and open_camera() work unchanged.
+
+    read() blocks for the next frame and returns a private copy, since the pipeline draws on its frames.
+    """
+
+    def __init__(self, name=BUS_NAME, timeout=ATTACH_TIMEOUT):
+        self.bus = FrameBus.attach(name, timeout=timeout)
+        self._last_id = None
+
+    def isOpened(self):
+        return self.bus is not None
+
+    def set(self, prop, value):
+        # Resolution and buffering belong to the capture process
+        return False
+
+    def read(self):
+        if self.bus is None:
+            return False, None
+        ret, captured = self.bus.read(after_id=self._last_id, copy=True)
+        if not ret:
+            return False, None
+        self._last_id = captured.frame_id
+        return True, captured.image
+
+    def release(self):
+        if self.bus is not None:
+            self.bus.close()
+            self.bus = None
+
+
+def run_capture(source, name=BUS_NAME, slots=BUS_SLOTS, size=None, stop_event=None):
+    """Capture loop of the publishing process: the only place the camera is opened."""
+    if isinstance(source, int) or str(source).isdigit():
+        cap = cv2.VideoCapture(int(source))
+        if size is not None:
+            cap.set(cv2.CAP_PROP_FRAME_WIDTH, size[0])
+            cap.set(cv2.CAP_PROP_FRAME_HEIGHT, size[1])
+        cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+    else:
+        cap = ReplayCapture(source, size=size)
+    if not cap.isOpened():
+        logging.error(f"Frame bus capture could not open '{source}'.")
+        return
+
+    bus = None
+    try:
+        while stop_event is None or not stop_event.is_set():
+            ret, image = cap.read()
+            timestamp = time.monotonic()
+            if not ret:
+                time.sleep(0.01)
+                continue
+            if bus is None:
+                bus = FrameBus.create(image.shape, name=name, slots=slots)
+                logging.info(f"Frame bus '{name}' publishing {image.shape[1]}x{image.shape[0]} frames in {slots} slots.")
+            elif image.shape != bus.shape:
+                logging.warning(f"Dropping a {image.shape} frame; the bus carries {bus.shape}.")
+                continue
+            bus.publish(image, timestamp)
+    finally:
+        cap.release()
+        if bus is not None:
+            bus.close()
+
+
+def start_capture_process(source, name=BUS_NAME, slots=BUS_SLOTS, size=None):
+    """Start run_capture() in its own process; returns (process, stop_event) once the first frame is on the bus."""
+    stop_event = multiprocessing.Event()
+    process = multiprocessing.Process(target=run_capture, args=(source, name, slots, size, stop_event),
+                                      name='frame-bus-capture', daemon=True)
+    process.start()
+    bus = FrameBus.attach(name, timeout=ATTACH_TIMEOUT)
+    if bus is None or not process.is_alive():
+        logging.error(f"Frame bus capture for '{source}' did not start.")
+    if bus is not None:
+        bus.read(timeout=ATTACH_TIMEOUT)
+        bus.close()
+    return process, stop_event
+
+
+def stop_capture_process(process, stop_event, timeout=2.0):
+    stop_event.set()
+    process.join(timeout)
+    if process.is_alive():
+        process.terminate()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Publish camera frames to the shared-memory frame bus.")
+    parser.add_argument('--source', default='0', help="Camera index, video file or image directory.")
+    parser.add_argument('--name', default=BUS_NAME)
+    parser.add_argument('--slots', type=int, default=BUS_SLOTS)
+    parser.add_argument('--width', type=int)
+    parser.add_argument('--height', type=int)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    size = (args.width, args.height) if args.width and args.height else None
+    try:
+        run_capture(args.source, args.name, args.slots, size)
+    except KeyboardInterrupt:
+        logging.info("Frame bus stopped.")
+
+
+if __name__ == "__main__":
+    main()
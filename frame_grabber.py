@@ -0,0 +1,65 @@
+import logging
+import threading
+import time
+from collections import namedtuple
+
+import cv2
+
+# timestamp is time.monotonic() taken right after the driver returned the frame
+CapturedFrame = namedtuple('CapturedFrame', ['frame_id', 'timestamp', 'image'])
+
+
+class FrameGrabber:
+    """Reads a capture device on a background thread and keeps only the newest frame."""
+
+    def __init__(self, capture):
+        self.capture = capture
+        # Keep the driver queue short; the thread drains whatever is left
+        self.capture.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+        self._latest = None
+        self._frame_ids = 0
+        self._condition = threading.Condition()
+        self._running = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='frame-grabber', daemon=True)
+
+    def isOpened(self):
+        return self.capture.isOpened()
+
+    def start(self):
+        self._running.set()
+        self._thread.start()
+        return self
+
+    def read(self, timeout=1.0, after_id=None, after_time=None):
+        """Return (ok, CapturedFrame) for the newest frame newer than `after_id` and captured after `after_time`."""
+        deadline = time.monotonic() + timeout
+        with self._condition:
+            while True:
+                latest = self._latest
+                if latest is not None \
+                        and (after_id is None or latest.frame_id > after_id) \
+                        and (after_time is None or latest.timestamp >= after_time):
+                    return True, latest
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or not self._running.is_set():
+                    return False, None
+                self._condition.wait(remaining)
+
+    def release(self):
+        self._running.clear()
+        if self._thread.is_alive():
+            self._thread.join(timeout=2)
+        self.capture.release()
+
+    def _run(self):
+        while self._running.is_set():
+            ret, image = self.capture.read()
+            timestamp = time.monotonic()
+            if not ret:
+                logging.debug("Frame grab failed.")
+                time.sleep(0.01)
+                continue
+            self._frame_ids += 1
+            with self._condition:
+                self._latest = CapturedFrame(self._frame_ids, timestamp, image)
+                self._condition.notify_all()
@@ -0,0 +1,49 @@
+import cv2
+import numpy as np
+
+PAD_VALUE = 114  # Same grey the YOLO training pipeline pads with
+
+
+class Letterbox:
+    """Downscale frames into one preallocated square canvas and map detections back to frame pixels."""
+
+    def __init__(self, size=640, pad_value=PAD_VALUE):
+        self.size = size
+        self.pad_value = pad_value
+        self.canvas = np.full((size, size, 3), pad_value, dtype=np.uint8)
+        self.scale = 1.0
+        self.pad_x = 0
+        self.pad_y = 0
+        self._source_shape = None
+        self._target = None
+
+    def __call__(self, frame):
+        """Return the canvas holding `frame` resized with its aspect ratio kept. The canvas is reused."""
+        if frame.shape[:2] != self._source_shape:
+            self._configure(frame.shape[:2])
+        resized = cv2.resize(frame, (self._target.shape[1], self._target.shape[0]),
+                             dst=self._target, interpolation=cv2.INTER_AREA)
+        if resized is not self._target:
+            # Some OpenCV builds cannot write into a strided view and return a new array instead
+            self._target[...] = resized
+        return self.canvas
+
+    def to_frame(self, boxes):
+        """Map an (N, 4) array of canvas [x1, y1, x2, y2] boxes to the coordinates of the source frame."""
+        boxes = np.asarray(boxes, dtype=np.float32).reshape(-1, 4)
+        height, width = self._source_shape
+        mapped = (boxes - np.array([self.pad_x, self.pad_y, self.pad_x, self.pad_y], dtype=np.float32)) / self.scale
+        np.clip(mapped[:, 0::2], 0, width, out=mapped[:, 0::2])
+        np.clip(mapped[:, 1::2], 0, height, out=mapped[:, 1::2])
+        return mapped
+
+    def _configure(self, shape):
+        height, width = shape
+        self.scale = self.size / max(height, width)
+        new_width = max(1, int(round(width * self.scale)))
+        new_height = max(1, int(round(height * self.scale)))
+        self.pad_x = (self.size - new_width) // 2
+        self.pad_y = (self.size - new_height) // 2
+        self.canvas.fill(self.pad_value)
+        self._target = self.canvas[self.pad_y:self.pad_y + new_height, self.pad_x:self.pad_x + new_width]
+        self._source_shape = (height, width)
@@ -0,0 +1,132 @@
+import hashlib
+import json
+import logging
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+
+from metrics import metrics
+
+CACHE_PATH = 'llm_cache.sqlite'
+MEMORY_ENTRIES = 256
+DISK_ENTRIES = 5000  # Least recently used rows are deleted beyond this
+TTL_S = 7 * 24 * 3600
+
+
+def normalise_prompt(text):
+    """Lowercase, collapse whitespace and drop trailing punctuation, so trivially different prompts share a key."""
+    return re.sub(r'\s+', ' ', text.strip().lower()).rstrip('.!?')
+
+
+def cache_key(model, messages, **params):
+    """Stable key for a chat request: model, parameters and the messages with normalised content."""
+    normalised = [{'role': message['role'],
+                   'content': normalise_prompt(message['content']) if isinstance(message['content'], str)
+                   else message['content']}
+                  for message in messages]
+    payload = json.dumps({'model': model, 'messages': normalised, 'params': params}, sort_keys=True)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+class LLMCache:
+    """Two-level cache for LLM completions: an in-memory LRU in front of a SQLite table.
+
+    Entries expire after `ttl_s`; both levels evict their least recently used entries when full.
+    get_or_compute() also collapses concurrent identical requests, so only one reaches the API.
+    """
+
+    def __init__(self, path=CACHE_PATH, memory_entries=MEMORY_ENTRIES, disk_entries=DISK_ENTRIES, ttl_s=TTL_S):
+        self.memory_entries = memory_entries
+        self.disk_entries = disk_entries
+        self.ttl_s = ttl_s
+        self._memory = OrderedDict()  # key -> (created_at, value)
+        self._in_flight = {}
+        self._lock = threading.Lock()
+        self._db = None
+        if path:
+            try:
+                self._db = sqlite3.connect(path, check_same_thread=False)
+                self._db.execute("CREATE TABLE IF NOT EXISTS completions "
+                                 "(key TEXT PRIMARY KEY, value TEXT, created_at REAL, used_at REAL)")
+                self._db.commit()
+            except sqlite3.Error as e:
+                logging.warning(f"LLM cache at {path} could not be opened; caching in memory only: {e}")
+                self._db = None
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None and now - entry[0] <= self.ttl_s:
+                self._memory.move_to_end(key)
+                return entry[1]
+            self._memory.pop(key, None)
+            if self._db is None:
+                return None
+            row = self._db.execute("SELECT value, created_at FROM completions WHERE key = ?", (key,)).fetchone()
+            if row is None or now - row[1] > self.ttl_s:
+                return None
+            self._db.execute("UPDATE completions SET used_at = ? WHERE key = ?", (now, key))
+            self._db.commit()
+            value = json.loads(row[0])
+            self._remember(key, row[1], value)
+            return value
+
+    def put(self, key, value):
+        now = time.time()
+        with self._lock:
+            self._remember(key, now, value)
+            if self._db is None:
+                return
+            self._db.execute("INSERT OR REPLACE INTO completions VALUES (?, ?, ?, ?)",
+                             (key, json.dumps(value), now, now))
+            self._db.execute("DELETE FROM completions WHERE created_at < ?", (now - self.ttl_s,))
+            self._db.execute("DELETE FROM completions WHERE key NOT IN "
+                             "(SELECT key FROM completions ORDER BY used_at DESC LIMIT ?)", (self.disk_entries,))
+            self._db.commit()
+
+    def get_or_compute(self, key, compute):
+        """Cached value for `key`, or the result of compute(); identical concurrent calls share one compute()."""
+        value = self.get(key)
+        if value is not None:
+            metrics.increment('llm_cache_hits')
+            return value
+
+        with self._lock:
+            future = self._in_flight.get(key)
+            owner = future is None
+            if owner:
+                future = self._in_flight[key] = Future()
+        if not owner:
+            metrics.increment('llm_requests_deduplicated')
+            return future.result()
+
+        metrics.increment('llm_cache_misses')
+        try:
+            value = compute()
+            if value is not None:
+                self.put(key, value)
+            future.set_result(value)
+            return value
+        except Exception as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                del self._in_flight[key]
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+            if self._db is not None:
+                self._db.execute("DELETE FROM completions")
+                self._db.commit()
+
+    def _remember(self, key, created_at, value):
+        self._memory[key] = (created_at, value)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
@@ -0,0 +1,126 @@
+import argparse
+import json
+import logging
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from llm_cache import normalise_prompt
+
+DEFAULT_REPLY = "Moving forward.\nBEGIN COMMANDS\nforward 500\nEND COMMANDS"
+
+
+class StubState:
+    """Canned replies keyed on the normalised last user message, plus a request counter.
+
+    `delay_s` is the time to the first token and `token_delay_s` the time per token after it; a
+    non-streamed reply is only sent once all of its tokens would have been generated.
+    """
+
+    def __init__(self, replies=None, default_reply=DEFAULT_REPLY, delay_s=0.0, token_delay_s=0.0):
+        self.replies = {normalise_prompt(prompt): reply for prompt, reply in (replies or {}).items()}
+        self.default_reply = default_reply
+        self.delay_s = delay_s
+        self.token_delay_s = token_delay_s
+        self.requests = 0
+        self.lock = threading.Lock()
+
+    def reply_for(self, messages):
+        user_messages = [message['content'] for message in messages
+                         if message['role'] == 'user' and isinstance(message['content'], str)]
+        prompt = normalise_prompt(user_messages[-1]) if user_messages else ''
+        return self.replies.get(prompt, self.default_reply)
+
+
+def make_handler(state):
+
+    class StubHandler(BaseHTTPRequestHandler):
+
+        def do_POST(self):
+            if not self.path.rstrip('/').endswith('/chat/completions'):
+                self.send_error(404)
+                return
+            request = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+            with state.lock:
+                state.requests += 1
+            time.sleep(state.delay_s)
+            reply = state.reply_for(request.get('messages', []))
+            tokens = re.findall(r'\s*\S+', reply) or ['']
+            if request.get('stream'):
+                self._stream(request, tokens)
+                return
+            time.sleep(state.token_delay_s * len(tokens))
+            body = json.dumps({
+                'id': f'stub-{state.requests}',
+                'object': 'chat.completion',
+                'created': int(time.time()),
+                'model': request.get('model'),
+                'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': reply}, 'finish_reason': 'stop'}],
+            }).encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _stream(self, request, tokens):
+            """Send the reply as server-sent events, one token per chunk, like the streaming API."""
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/event-stream')
+            self.send_header('Cache-Control', 'no-cache')
+            self.end_headers()
+            for index, token in enumerate(tokens):
+                if index:
+                    time.sleep(state.token_delay_s)
+                chunk = {
+                    'object': 'chat.completion.chunk',
+                    'model': request.get('model'),
+                    'choices': [{'index': 0, 'delta': {'content': token}, 'finish_reason': None}],
+                }
+                self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode())
+                self.wfile.flush()
+            done = {'object': 'chat.completion.chunk', 'choices': [{'index': 0, 'delta': {}, 'finish_reason': 'stop'}]}
+            self.wfile.write(f"data: {json.dumps(done)}\n\ndata: [DONE]\n\n".encode())
+            self.wfile.flush()
+
+        def log_message(self, format, *args):
+            pass
+
+    return StubHandler
+
+
+def serve(port=8089, host='localhost', **state_options):
+    """Start the stub on a background thread; returns (server, state)."""
+    state = StubState(**state_options)
+    server = ThreadingHTTPServer((host, port), make_handler(state))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='llm-stub', daemon=True).start()
+    return server, state
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local stand-in for the OpenAI chat completions API.")
+    parser.add_argument('--port', type=int, default=8089)
+    parser.add_argument('--replies', help="JSON file mapping user prompts to reply texts.")
+    parser.add_argument('--delay', type=float, default=1.0, help="Seconds before the first token of each reply.")
+    parser.add_argument('--token-delay', type=float, default=0.05, help="Seconds per token after the first.")
+    args = parser.parse_args()
+
+    replies = None
+    if args.replies:
+        with open(args.replies) as f:
+            replies = json.load(f)
+    server, state = serve(args.port, replies=replies, delay_s=args.delay, token_delay_s=args.token_delay)
+    logging.basicConfig(level=logging.INFO)
+    logging.info(f"LLM stub listening; set OPENAI_API_BASE=http://localhost:{args.port}/v1")
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        server.shutdown()
+        logging.info(f"Served {state.requests} request(s).")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,164 @@
+import bisect
+import functools
+import json
+import logging
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import cv2
+
+RING_SIZE = 1024  # Recent samples kept per stage for percentiles
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)  # Seconds
+OVERLAY_REFRESH = 0.5  # Seconds between overlay text updates
+
+
+class StageStats:
+    """Latency of one stage: a ring buffer of recent samples plus a cumulative histogram."""
+
+    def __init__(self, ring_size=RING_SIZE):
+        self.ring = [0.0] * ring_size
+        self.index = 0
+        self.count = 0
+        self.total = 0.0
+        self.buckets = [0] * (len(BUCKETS) + 1)
+
+    def observe(self, seconds):
+        self.ring[self.index] = seconds
+        self.index = (self.index + 1) % len(self.ring)
+        self.count += 1
+        self.total += seconds
+        self.buckets[bisect.bisect_left(BUCKETS, seconds)] += 1
+
+    def recent(self):
+        return self.ring[:min(self.count, len(self.ring))]
+
+    def summary(self):
+        recent = sorted(self.recent())
+        summary = {'count': self.count, 'sum': round(self.total, 6)}
+        if recent:
+            for q in (50, 95, 99):
+                summary[f'p{q}_ms'] = round(recent[min(len(recent) - 1, len(recent) * q // 100)] * 1000, 3)
+        return summary
+
+
+class Metrics:
+    """Thread-safe stage timings and counters. Recording is a lock, a list store and a bisect; all
+    aggregation happens when a snapshot is taken."""
+
+    def __init__(self):
+        self.stages = {}
+        self.counters = {}
+        self._lock = threading.Lock()
+        self._overlay_lines = []
+        self._overlay_at = 0.0
+
+    def observe(self, stage, seconds):
+        with self._lock:
+            stats = self.stages.get(stage)
+            if stats is None:
+                stats = self.stages[stage] = StageStats()
+            stats.observe(seconds)
+
+    def increment(self, counter, amount=1):
+        with self._lock:
+            self.counters[counter] = self.counters.get(counter, 0) + amount
+
+    def timed(self, stage):
+        """Decorator recording the duration of every call under `stage`."""
+        def decorator(function):
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                started = time.perf_counter()
+                try:
+                    return function(*args, **kwargs)
+                finally:
+                    self.observe(stage, time.perf_counter() - started)
+            return wrapper
+        return decorator
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'stages': {stage: stats.summary() for stage, stats in self.stages.items()},
+                'counters': dict(self.counters),
+            }
+
+    def prometheus_text(self):
+        lines = []
+        with self._lock:
+            for stage, stats in self.stages.items():
+                name = f"robogpt_{stage}_seconds"
+                lines.append(f"# TYPE {name} histogram")
+                cumulative = 0
+                for bound, count in zip(BUCKETS, stats.buckets):
+                    cumulative += count
+                    lines.append(f'{name}_bucket{{le="{bound}"}} {cumulative}')
+                lines.append(f'{name}_bucket{{le="+Inf"}} {stats.count}')
+                lines.append(f"{name}_sum {stats.total}")
+                lines.append(f"{name}_count {stats.count}")
+            for counter, value in self.counters.items():
+                lines.append(f"# TYPE robogpt_{counter}_total counter")
+                lines.append(f"robogpt_{counter}_total {value}")
+        return "\n".join(lines) + "\n"
+
+    def draw_overlay(self, frame, origin=(10, 30)):
+        """Write p50/p95 per stage onto the frame; the text is only recomputed every OVERLAY_REFRESH seconds."""
+        now = time.monotonic()
+        if now - self._overlay_at >= OVERLAY_REFRESH:
+            self._overlay_at = now
+            self._overlay_lines = [
+                f"{stage}: p50 {summary['p50_ms']:.1f}ms p95 {summary['p95_ms']:.1f}ms"
+                for stage, summary in self.snapshot()['stages'].items() if 'p50_ms' in summary
+            ]
+        x, y = origin
+        for line in self._overlay_lines:
+            cv2.putText(frame, line, (x, y), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 255, 255), 1)
+            y += 20
+        return frame
+
+    def reset(self):
+        with self._lock:
+            self.stages.clear()
+            self.counters.clear()
+
+
+metrics = Metrics()
+
+_server = None
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        if self.path == '/metrics':
+            body, content_type = metrics.prometheus_text(), 'text/plain; version=0.0.4'
+        elif self.path == '/metrics.json':
+            body, content_type = json.dumps(metrics.snapshot()), 'application/json'
+        else:
+            self.send_error(404)
+            return
+        payload = body.encode()
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        pass  # Scrapes would otherwise be logged on every request
+
+
+def serve(port, host='localhost'):
+    """Expose /metrics (Prometheus text) and /metrics.json on a background thread. Safe to call twice."""
+    global _server
+    if _server is not None or not port:
+        return _server
+    try:
+        _server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    except OSError as e:
+        logging.warning(f"Metrics endpoint could not start on {host}:{port}: {e}")
+        return None
+    threading.Thread(target=_server.serve_forever, name='metrics-http', daemon=True).start()
+    logging.info(f"Metrics available at http://{host}:{port}/metrics")
+    return _server
@@ -0,0 +1,150 @@
+import argparse
+import json
+import logging
+import os
+import time
+
+import numpy as np
+
+CALIBRATION_DIR = 'calibration'
+MIN_SAMPLES = 5
+
+# The original step table, as (distance, forward pulse) pairs. It was indexed with 0.65 x the remaining
+# distance, so the distances are scaled back up to what each pulse was expected to cover.
+LEGACY_ADJUSTMENT = 0.65
+LEGACY_TABLE = [
+    (2.5, 100), (3, 150), (6, 200), (10, 450), (12, 500), (14, 600), (16, 700), (20, 800),
+    (22, 900), (24, 1000), (27, 1100), (30, 1200), (33, 1300), (36, 1400), (37, 1500), (40, 1600),
+    (42, 1700), (44, 1800), (46, 1900), (55, 2000), (65, 2800), (75, 3300), (85, 3800),
+]
+
+
+def isotonic(values, weights=None):
+    """Least-squares non-decreasing fit of `values` (pool adjacent violators)."""
+    values = np.asarray(values, dtype=float)
+    weights = np.ones_like(values) if weights is None else np.asarray(weights, dtype=float)
+    means, block_weights, sizes = [], [], []
+    for value, weight in zip(values, weights):
+        means.append(value)
+        block_weights.append(weight)
+        sizes.append(1)
+        while len(means) > 1 and means[-2] > means[-1]:
+            weight = block_weights[-2] + block_weights[-1]
+            mean = (means[-2] * block_weights[-2] + means[-1] * block_weights[-1]) / weight
+            size = sizes[-2] + sizes[-1]
+            del means[-1], block_weights[-1], sizes[-1]
+            means[-1], block_weights[-1], sizes[-1] = mean, weight, size
+    return np.repeat(means, sizes)
+
+
+class MotionModel:
+    """Monotone piecewise-linear map from distance to cover (cm) to forward pulse length (ms)."""
+
+    def __init__(self, distances_cm, durations_ms, robot_id=None, samples=0):
+        order = np.argsort(distances_cm)
+        self.distances_cm = np.asarray(distances_cm, dtype=float)[order]
+        self.durations_ms = np.maximum.accumulate(np.asarray(durations_ms, dtype=float)[order])
+        self.robot_id = robot_id
+        self.samples = samples
+
+    def duration_for(self, distance_cm):
+        """Pulse length for one distance (int) or an array of distances; clamps beyond the calibrated range."""
+        durations = np.interp(distance_cm, self.distances_cm, self.durations_ms)
+        return int(round(float(durations))) if np.ndim(durations) == 0 else np.rint(durations).astype(int)
+
+    def distance_for(self, duration_ms):
+        return np.interp(duration_ms, self.durations_ms, self.distances_cm)
+
+    @classmethod
+    def legacy(cls):
+        distances, durations = zip(*LEGACY_TABLE)
+        return cls(np.asarray(distances) / LEGACY_ADJUSTMENT, durations, robot_id='legacy')
+
+    @classmethod
+    def fit(cls, durations_ms, travelled_cm, robot_id=None):
+        """Fit from logged moves: isotonic regression of distance travelled on pulse length, then inverted."""
+        order = np.argsort(durations_ms)
+        durations = np.asarray(durations_ms, dtype=float)[order]
+        travelled = isotonic(np.asarray(travelled_cm, dtype=float)[order])
+
+        # Inverting needs strictly increasing distances; a flat run of the fit keeps its mean pulse
+        distances, inverse = np.unique(travelled, return_inverse=True)
+        mean_durations = np.bincount(inverse, weights=durations) / np.bincount(inverse)
+        return cls(distances, mean_durations, robot_id=robot_id, samples=len(durations))
+
+    def to_dict(self):
+        return {
+            'robot_id': self.robot_id,
+            'samples': self.samples,
+            'fitted_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'distances_cm': [round(float(d), 3) for d in self.distances_cm],
+            'durations_ms': [round(float(d), 1) for d in self.durations_ms],
+        }
+
+    def save(self, path):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        with open(path, 'w') as f:
+            json.dump(self.to_dict(), f, indent=2)
+
+    @classmethod
+    def load(cls, path):
+        with open(path) as f:
+            data = json.load(f)
+        return cls(data['distances_cm'], data['durations_ms'], data.get('robot_id'), data.get('samples', 0))
+
+
+def calibration_path(robot_id):
+    return os.path.join(CALIBRATION_DIR, f"{robot_id}.json")
+
+
+def moves_path(robot_id):
+    return os.path.join(CALIBRATION_DIR, f"{robot_id}_moves.jsonl")
+
+
+def record_move(robot_id, duration_ms, travelled_cm, **context):
+    """Append one completed forward move to the robot's calibration log."""
+    os.makedirs(CALIBRATION_DIR, exist_ok=True)
+    with open(moves_path(robot_id), 'a') as f:
+        f.write(json.dumps({'duration_ms': duration_ms, 'travelled_cm': round(travelled_cm, 2), **context}) + "\n")
+
+
+def load_model(robot_id):
+    """The robot's calibrated model, or the legacy step table until it has been calibrated."""
+    path = calibration_path(robot_id)
+    if os.path.exists(path):
+        model = MotionModel.load(path)
+        logging.info(f"Loaded motion model for '{robot_id}' ({model.samples} samples).")
+        return model
+    logging.info(f"No motion calibration for '{robot_id}'; using the legacy step table.")
+    return MotionModel.legacy()
+
+
+def fit_from_log(robot_id):
+    moves = []
+    if os.path.exists(moves_path(robot_id)):
+        with open(moves_path(robot_id)) as f:
+            moves = [json.loads(line) for line in f if line.strip()]
+    moves = [move for move in moves if move['travelled_cm'] > 0]
+    if len(moves) < MIN_SAMPLES:
+        raise ValueError(f"Need at least {MIN_SAMPLES} logged moves for '{robot_id}', found {len(moves)}.")
+    model = MotionModel.fit([move['duration_ms'] for move in moves], [move['travelled_cm'] for move in moves],
+                            robot_id=robot_id)
+    model.save(calibration_path(robot_id))
+    return model
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fit or inspect the forward motion calibration of a robot.")
+    parser.add_argument('command', choices=['fit', 'show'])
+    parser.add_argument('--robot', default=os.getenv('ROBOGPT_ROBOT_ID', 'robot'))
+    args = parser.parse_args()
+
+    model = fit_from_log(args.robot) if args.command == 'fit' else load_model(args.robot)
+    for distance, duration in zip(model.distances_cm, model.durations_ms):
+        print(f"{distance:7.1f}cm -> {duration:7.0f}ms")
+    if args.command == 'fit':
+        print(f"Saved {calibration_path(args.robot)} from {model.samples} moves.")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,15 +1,32 @@
 
+import time
+_import_started = time.perf_counter()
+
 import warnings
-import torch
+import threading
 import cv2
 import numpy as np
-import time
 import logging
-from ultralytics import YOLO
 import serial
+from range_sensor import RangeSensor, RangeSensorError
+from serial_channel import CommandError, open_channel
+from concurrent.futures import Future
+from frame_grabber import FrameGrabber
+from frame_bus import BusCapture, start_capture_process, stop_capture_process
+from replay_capture import ReplayCapture
+from target_tracker import TargetTracker
+from letterbox import Letterbox
+from detections import empty_detections, to_dicts, to_structured
+from detector_backends import create_detector
+from metrics import metrics, serve as serve_metrics
+from viewer import FrameViewer
+from alignment_controller import create_controller
+from motion_model import load_model as load_motion_model, record_move
+from action_engine import ActionEngine, load_sequences
+from scene_planner import ScenePlan, bearing_of
 import sys
-import subprocess
-import os  # To handle file paths# To handle JSON files
+import os  # To handle file paths
+import json  # To handle JSON files
 
 nc = 5
 ###['bottle', 'box', 'cup', 'horn', 'small_bottle']
@@ -21,19 +38,75 @@ TARGET_CLASS_IDS = list(range(nc))
 
 
 CONFIDENCE_THRESHOLD = 0.5
+NMS_IOU_THRESHOLD = 0.7
 
-SERIAL_PORT = '/dev/cu.usbserial-1130'
+# --- Detector Settings ---
+MODEL_WEIGHTS = 'best.pt'
+DETECTOR_BACKEND = 'torch'  # 'torch', 'onnx' or 'openvino'; the last two are exported once and cached next to the weights
+DETECTOR_THREADS = 4  # CPU threads for the onnx and openvino backends
+DETECTOR_PRECISION = 'fp32'  # 'fp32', 'fp16' or 'int8' for the onnx and openvino backends
+
+SERIAL_PORT = os.getenv('ROBOGPT_SERIAL_PORT', '/dev/cu.usbserial-1130')
 SERIAL_BAUDRATE = 9600
+SERIAL_STARTUP_DELAY = 2.0  # Seconds the Arduino needs to reset after the port is opened
+RESOURCE_RETRY_DELAY = 5.0  # Seconds before a failed serial open or model load is tried again
+
+# Camera index, or a video file / image directory to replay instead of the live camera
+CAMERA_SOURCE = os.getenv('ROBOGPT_CAMERA', '0')
+# Shared-memory bus the camera is read through; a capture process is started for CAMERA_SOURCE unless one is
+# already publishing under this name. Empty opens the camera directly in this process, except in the
+# pipeline service, which always uses a bus (frame_bus.BUS_NAME by default).
+FRAME_BUS = os.getenv('ROBOGPT_FRAME_BUS', '')
 
 # --- Frame Settings ---
 FRAME_WIDTH = 1920
 FRAME_HEIGHT = 1080
 
+# --- Inference Settings ---
+INFERENCE_SIZE = 640  # Square detector input; frames are letterboxed down and boxes mapped back to frame pixels
+MIN_INFERENCE_PIXELS = 2  # Alignment never demands more precision than this many detector pixels
+
 # --- Alignment Settings ---
 VERTICAL_LINE_OFFSET = 0
-MIN_PIXEL_DISTANCE = 8
+MIN_PIXEL_DISTANCE = 8  # At FRAME_WIDTH; scaled to the actual frame width
 MOVEMENT_INTERVAL = 0.1
-MOVEMENT_DURATION = 55
+MOVEMENT_DURATION = 55  # Pulse length of the 'fixed' controller
+
+# --- Alignment Controller Settings ---
+ALIGNMENT_CONTROLLER = os.getenv('ROBOGPT_ALIGNMENT_CONTROLLER', 'proportional')  # 'fixed', 'proportional', 'pid' or 'scheduled'
+# Gains are ms of turn pulse per pixel of error at FRAME_WIDTH (ki per px*s, kd per px/s). offset_ms covers the
+# motor spin-up before the base moves. Tuned in the simulator; re-check with `benchmark.py --suites alignment`.
+# Classes without an entry use 'default'; a class entry only needs the keys it changes.
+ALIGNMENT_GAINS = {
+    'default': {
+        'pulse_ms': MOVEMENT_DURATION,
+        'kp': 1.0, 'ki': 0.2, 'kd': 0.05, 'integral_limit': 500.0,
+        'schedule': [(0, 0.8), (200, 1.0), (800, 1.2)],
+        'pwm_schedule': None,
+        'offset_ms': 35, 'max_ms': 400,
+    },
+    'small_bottle': {'kp': 0.8, 'max_ms': 250},  # Narrow target: trade speed for less overshoot
+}
+CONTROL_CLOCK = time.monotonic  # Time source for the controllers' integral and derivative terms
+
+# --- Tracking Settings ---
+TRACKING_ENABLED = True
+TRACKER_TYPE = 'KCF'
+REDETECT_INTERVAL = 10  # Frames between detector runs while the target is tracked
+ROI_MARGIN = 0.5  # Fraction of the box size added on each side for ROI re-detection
+
+# --- Telemetry Settings ---
+FRAME_LOGGING = os.getenv('ROBOGPT_FRAME_LOGGING', '1') == '1'  # Per-frame and per-command INFO lines
+METRICS_PORT = int(os.getenv('ROBOGPT_METRICS_PORT', '9108'))  # localhost /metrics endpoint; 0 disables it
+METRICS_OVERLAY = True  # Stage latencies in the OpenCV window
+
+# --- Display Settings ---
+# 'window' draws on the full frame and shows it inline, 'viewer' renders a downsized copy on a background
+# thread and shows it from the pick loop, 'mjpeg' streams that copy to localhost, 'none' runs headless
+DISPLAY_MODE = os.getenv('ROBOGPT_DISPLAY', 'window')
+VIEWER_SCALE = 0.5
+VIEWER_MAX_FPS = 10
+MJPEG_PORT = int(os.getenv('ROBOGPT_MJPEG_PORT', '8081'))
 
 # --- Arrow Drawing Settings ---
 ARROW_LENGTH = 200
@@ -47,6 +120,54 @@ PERCENTAGE = 0.8
 MOVEMENT_DURATION_MS = 150
 STEPS_PER_ALIGNMENT = 1
 
+# --- Approach Settings ---
+ROBOT_ID = os.getenv('ROBOGPT_ROBOT_ID', 'robot')  # Selects calibration/<ROBOT_ID>.json
+CALIBRATION_LOGGING = True  # Append completed forward moves to calibration/<ROBOT_ID>_moves.jsonl
+MIN_FORWARD_MS = 100
+MAX_FORWARD_MS = 3800
+# Fraction of the remaining distance each forward move aims to cover; the range sensor stops the move early anyway
+APPROACH_FRACTIONS = {
+    'default': 1.0,
+    'small_bottle': 0.7,
+    'horn': 0.9,
+}
+
+# --- Combined Approach Settings ---
+APPROACH_MODE = os.getenv('ROBOGPT_APPROACH_MODE', 'combined')  # 'combined' steers while driving; 'stepwise' alternates turns and forward moves
+APPROACH_PWM = 180  # Wheel PWM while the target is centred
+STEERING_GAIN = 0.25  # Wheel PWM difference per px of error (at FRAME_WIDTH)
+MAX_STEERING_PWM = 70
+STEERING_INTERVAL = 0.1  # Seconds (of CONTROL_CLOCK) between steering updates
+DRIVE_SEGMENT_MS = 400  # A drive command stops on its own after this long unless a newer one replaces it
+TARGET_LOST_FRAMES = 5  # Consecutive frames without the target before the approach stops and re-aligns
+
+# --- Grasp Settings ---
+# Per-class grasp steps; re-read before every grasp. Found next to this module, whatever the working directory.
+GRASP_SEQUENCES_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'grasp_sequences.json')
+
+# --- Planning Settings ---
+PLAN_PICK_ORDER = True  # Detect every target once and order multi-object jobs by estimated travel time
+CAMERA_HFOV_DEG = 70.0
+TURN_RATE_DEG_S = 30.0  # Base turn rate at the firmware's default turn PWM
+TURN_PWM = 200  # The firmware's default turn PWM (arduino.cpp); the turn rate scales with the PWM
+FORWARD_SPEED_CM_S = 30.0
+PRE_TURN_MIN_DEG = 25.0  # Known targets further off-centre than this are turned towards before aligning
+# Real object heights, for distance estimates from the box size
+OBJECT_HEIGHTS_CM = {
+    'bottle': 22.0,
+    'box': 15.0,
+    'cup': 10.0,
+    'horn': 12.0,
+    'small_bottle': 12.0,
+}
+
+# --- Search Settings ---
+SEARCH_AFTER_FRAMES = 3  # Consecutive fresh frames without the target before scanning for it
+SEARCH_STEP_DEG = 40.0  # Turn per scan pulse; less than CAMERA_HFOV_DEG so consecutive views overlap
+SEARCH_MEMORY_S = 10.0  # How long the last seen bearing decides which way the scan turns
+SEARCH_TIMEOUT_S = 30.0  # Seconds of CONTROL_CLOCK before a search gives up, even short of a full turn
+SEARCH_DEFAULT_DIRECTION = 'right'
+
 # --- Distance Threshold ---
 DISTANCE_THRESHOLD_DEFAULT = 80
 
@@ -67,144 +188,230 @@ logging.basicConfig(
         logging.StreamHandler()
     ]
 )
-logging.info(f"Using device: {device}")
-
-try:
-    model = YOLO('best.pt')
-    logging.info("YOLOv9m model successfully loaded.")
-except Exception as e:
-    logging.error(f"Failed to load YOLOv9m model: {e}")
-    model = None
-
-try:
-    arduino = serial.Serial(
-        port=SERIAL_PORT,
-        baudrate=SERIAL_BAUDRATE,
-        timeout=1
-    )
-    logging.info("Serial connection to Arduino established.")
-    time.sleep(2)
-except serial.SerialException as e:
-    logging.error(f"Failed to connect to Arduino: {e}")
-    arduino = None
-
-
-def send_command(command, duration):
+# Reused resize buffers, one per position in a detector batch
+letterboxes = [Letterbox(INFERENCE_SIZE)]
+# Held for a whole detector call: the letterboxes keep per-frame scale and padding until boxes are mapped back,
+# so a vision query on the UI thread must not run in between the pick loop's resize and its box mapping
+detector_lock = threading.Lock()
+
+# Seconds spent on each startup step (import, model, serial, camera)
+STARTUP_TIMINGS = {}
+
+# Model and serial handles are created on first use, not at import time
+_resources = {}
+# One lock per resource so a slow model load never holds up opening the serial port
+_resource_locks = {name: threading.Lock() for name in ('model', 'serial', 'range_sensor', 'motion_model')}
+# Earliest time.monotonic() a resource that failed to open is tried again
+_resource_retry_at = {}
+
+# (process, stop event) of the frame bus capture process, if this process started it
+bus_capture = None
+
+
+def _get_resource(name, create, timed=True, retry_delay=RESOURCE_RETRY_DELAY):
+    """The cached resource, created on first use. A failed create (None) is not cached; it is tried again
+    on the first call after `retry_delay` seconds, and calls before that return None at once."""
+    with _resource_locks[name]:
+        if name in _resources:
+            return _resources[name]
+        if time.monotonic() < _resource_retry_at.get(name, 0.0):
+            return None
+        started = time.perf_counter()
+        resource = create()
+        if resource is None:
+            _resource_retry_at[name] = time.monotonic() + retry_delay
+            return None
+        _resources[name] = resource
+        _resource_retry_at.pop(name, None)
+        if timed:
+            STARTUP_TIMINGS[name] = time.perf_counter() - started
+        return resource
+
+
+def _load_model():
+    try:
+        model = create_detector(DETECTOR_BACKEND, MODEL_WEIGHTS, imgsz=INFERENCE_SIZE, conf=CONFIDENCE_THRESHOLD,
+                                iou=NMS_IOU_THRESHOLD, threads=DETECTOR_THREADS, precision=DETECTOR_PRECISION)
+        logging.info(f"YOLOv9m model successfully loaded: {model.describe()}")
+        return model
+    except Exception as e:
+        logging.error(f"Failed to load YOLOv9m model: {e}")
+        return None
+
+
+def _open_arduino():
+    try:
+        arduino = open_channel(SERIAL_PORT, SERIAL_BAUDRATE, startup_delay=SERIAL_STARTUP_DELAY)
+        logging.info("Serial connection to Arduino established.")
+        return arduino
+    except serial.SerialException as e:
+        logging.error(f"Failed to connect to Arduino: {e}")
+        return None
+
+
+def get_model():
+    return _get_resource('model', _load_model)
+
 
+def get_arduino():
+    return _get_resource('serial', _open_arduino)
+
+
+def get_motion_model():
+    return _get_resource('motion_model', lambda: load_motion_model(ROBOT_ID), timed=False)
+
+
+def get_range_sensor():
+    # Range readings share the pipeline's serial channel instead of opening the port again
+    arduino = get_arduino()
+    return _get_resource('range_sensor', lambda: RangeSensor(arduino) if arduino else None, timed=False,
+                         retry_delay=0.0)
+
+
+def close_resources(release_model=False):
+    with _resource_locks['serial'], _resource_locks['range_sensor']:
+        arduino = _resources.pop('serial', None)
+        _resources.pop('range_sensor', None)
+    with _resource_locks['motion_model']:
+        _resources.pop('motion_model', None)  # Reloaded on next use, so a new calibration is picked up
+    if release_model:
+        with _resource_locks['model']:
+            _resources.pop('model', None)
     if arduino and arduino.is_open:
-        try:
-            command_str = f"{command} {duration}\n"
-            arduino.write(command_str.encode())
-            logging.info(f"Sent command: '{command}' for {duration}ms")
-            time.sleep(0.1)  # Brief pause to ensure command is sent
-        except serial.SerialException as e:
-            logging.error(f"Error sending command '{command}': {e}")
-    else:
-        logging.warning("Arduino serial connection is not open.")
+        arduino.close()
+        logging.info("Serial connection to Arduino closed.")
+
+
+def log_startup_report():
+    steps = ', '.join(f"{name} {seconds * 1000:.0f}ms" for name, seconds in STARTUP_TIMINGS.items())
+    logging.info(f"Startup timing: {steps}")
+
+
+@metrics.timed('send_command')
+def send_command(command, duration, wait=False, pwm=None, wheels=None):
+    """Queue a command on the Arduino channel and return a Future that resolves when the move is done."""
+    arduino = get_arduino()
+    if arduino and arduino.is_open:
+        sent_at = time.perf_counter()
+        future = arduino.send(command, duration, pwm=pwm, wheels=wheels)
+        future.add_done_callback(lambda _: metrics.observe('command_done', time.perf_counter() - sent_at))
+        metrics.increment('commands_sent')
+        if FRAME_LOGGING:
+            logging.info(f"Sent command: '{command}' for {duration}ms" + (f" at PWM {pwm}" if pwm is not None else "")
+                         + (f" with wheels {wheels}" if wheels is not None else ""))
+        if wait:
+            wait_for_command(future)
+        return future
+    logging.warning("Arduino serial connection is not open.")
+    future = Future()
+    future.set_result(None)
+    return future
+
+
+def wait_for_command(future):
+    """Block until the firmware reports the command as done. Returns False if it failed or was lost."""
+    try:
+        future.result()
+        return True
+    except CommandError as e:
+        metrics.increment('command_errors')
+        logging.error(f"Command '{future.command}' failed: {e}")
+        return False
 
 
 def move_forward(duration_ms):
 
-    send_command("forward", duration_ms)
+    return send_command("forward", duration_ms)
 
 def stop_movement():
-    send_command("stop", 0)
+    arduino = get_arduino()
+    if arduino and arduino.is_open:
+        # Stop jumps ahead of any queued moves
+        return arduino.send("stop", 0, urgent=True)
+    return send_command("stop", 0)
 
 
-def move_base(direction, duration_ms):
+def move_base(direction, duration_ms, pwm=None):
 
     if direction.lower() in ['left', 'right']:
-        send_command(direction.lower(), duration_ms)
+        return send_command(direction.lower(), duration_ms, pwm=pwm)
     else:
         logging.error(f"Invalid direction: {direction}. Use 'left' or 'right'.")
 
 
-def catch_claw_command(selected_object):
+def drive(left_pwm, right_pwm, duration_ms):
+    """Run the left and right wheels at signed PWM duties (negative reverses), e.g. to steer while moving."""
+    return send_command("drive", duration_ms, wheels=(int(left_pwm), int(right_pwm)))
 
-    if selected_object.lower() == "cup":
-        send_command("right", 250)
-        time.sleep(0.6)
-        send_command("down", 1250)
-        logging.info("Since it is a cup, moving down for 1300ms")
-        time.sleep(1.7)
-        logging.info("Moving down completed")
-        send_command("catch", 2500)
-        time.sleep(2.5)
-        send_command("catch", 3500)
-        logging.info("Catching claw for 3500ms.")
-        time.sleep(3.5)
-        logging.info("Claw catch completed.")
-        send_command("up", 2500)
-        logging.info("Moving cup up for 200ms")
-        time.sleep(2.5)
-    elif selected_object.lower() == "horn":
-        send_command("down", 750)
-        logging.info("Putting object down for 600ms")
-        time.sleep(1)
-        send_command("catch", 2000)
-        time.sleep(2)
-        send_command("catch", 3000)
-        time.sleep(3)
-        send_command("catch", 1000)
-        time.sleep(1)
-        send_command("up", 2300)
-        time.sleep(2.3)
-    elif selected_object.lower() == "box":
-        send_command("down", 1200)
-        logging.info("Putting object down for 1200ms")
-        time.sleep(1.2)
-        send_command("release", 2500)
-        time.sleep(2.5)
-    elif selected_object.lower() == "small_bottle":
-        send_command("catch", 3000)
-        time.sleep(3)
-        send_command("catch", 3000)
-        logging.info("Catching claw for 3000ms.")
-        time.sleep(3)
-        send_command("catch", 1000)
-        time.sleep(1)
-        logging.info("Claw catch completed.")
-        send_command("up", 3000)
-        time.sleep(3)
-    elif selected_object.lower() == "bottle":
-        send_command("catch", 2000)
-        time.sleep(2)
-        send_command("catch", 3000)
-        logging.info("Catching claw for 3000ms.")
-        time.sleep(3)
-        logging.info("Claw catch completed.")
-        send_command("up", 2000)
-        time.sleep(2)
-    else:
-        logging.error(f"No catch command defined for '{selected_object}'.")
 
-def detect_objects(frame, model):
+def load_grasp_sequences():
+    """Read GRASP_SEQUENCES_FILE; raises PickAborted if it is missing or invalid, so no pick silently skips its grasp."""
+    try:
+        return load_sequences(GRASP_SEQUENCES_FILE)
+    except (OSError, ValueError, KeyError) as e:
+        raise PickAborted(f"Could not load grasp sequences from {GRASP_SEQUENCES_FILE}: {e}")
+
 
+@metrics.timed('catch_claw_command')
+def catch_claw_command(selected_object):
+    """Run the grasp sequence for the object's class from GRASP_SEQUENCES_FILE; returns the step timings.
+
+    Raises PickAborted if a step failed, after the steps that did not depend on it have finished.
+    """
+    steps = load_grasp_sequences().get(selected_object.lower())
+    if steps is None:
+        raise PickAborted(f"No grasp sequence defined for '{selected_object}' in {GRASP_SEQUENCES_FILE}.")
+
+    timings = ActionEngine(send_command).run(steps, cancelled=abort_requested.is_set)
+    for timing in timings:
+        if timing.started_s is None:
+            logging.info(f"Grasp step '{timing.step_id}' ({timing.command} {timing.duration_ms}ms): not run")
+        else:
+            logging.info(f"Grasp step '{timing.step_id}' ({timing.command} {timing.duration_ms}ms): "
+                         f"{timing.started_s:.2f}s -> {timing.finished_s:.2f}s" + ("" if timing.ok else " failed"))
+    sequential_s = sum(step.duration for step in steps) / 1000.0
+    total_s = max((timing.finished_s for timing in timings if timing.finished_s is not None), default=0.0)
+    logging.info(f"Grasp sequence for '{selected_object}' took {total_s:.2f}s "
+                 f"({sequential_s:.2f}s of motion).")
+    failed = [timing.step_id for timing in timings if not timing.ok]
+    if failed:
+        raise PickAborted(f"Grasp sequence for '{selected_object}' failed; steps {failed} failed or did not run.")
+    return timings
+
+def detect_objects_batch(frames, model):
+    """Run one model call over several frames and return a DETECTION_DTYPE array per frame."""
     if model is None:
         logging.error("YOLOv9m model is not loaded.")
+        return [empty_detections() for _ in frames]
+    if not frames:
         return []
 
-    # Run inference with the specified confidence threshold
-    results = model(frame, conf=CONFIDENCE_THRESHOLD)
-
-    # Extract the detections (boxes, confidences, and class IDs)
-    detections = results[0].boxes  # YOLO format stores results in 'boxes'
-
-    detected_objects = []
-    for detection in detections:
-        class_id = int(detection.cls[0])  # Assuming 'cls' is class id
-        if class_id in TARGET_CLASS_IDS:
-            box = detection.xyxy[0].cpu().numpy()  # [x1, y1, x2, y2]
-            conf = detection.conf[0].cpu().numpy()
-            detected_objects.append({
-                'class_id': class_id,
-                'class_name': CLASS_NAMES[class_id],
-                'box': box,
-                'confidence': conf
-            })
+    with detector_lock:
+        # Each frame gets its own preallocated letterbox canvas so the whole batch can be passed at once
+        while len(letterboxes) < len(frames):
+            letterboxes.append(Letterbox(INFERENCE_SIZE))
+        inputs = [letterboxes[i](frame) for i, frame in enumerate(frames)]
+
+        # Run inference with the configured backend; every backend returns canvas-pixel boxes
+        outputs = model.predict(inputs)
+
+        batch = []
+        for (class_ids, confidences, boxes), frame_letterbox in zip(outputs, letterboxes):
+            keep = np.isin(class_ids, TARGET_CLASS_IDS)
+            batch.append(to_structured(class_ids[keep], confidences[keep], frame_letterbox.to_frame(boxes[keep])))
+        return batch
+
+
+@metrics.timed('detect_objects')
+def detect_objects(frame, model):
+
+    detections = detect_objects_batch([frame], model)[0]
+    detected_objects = to_dicts(detections, CLASS_NAMES)
 
     # Log the number of detected objects
-    logging.info(f"Detected {len(detected_objects)} object(s) in the frame.")
+    metrics.increment('detections', len(detected_objects))
+    if FRAME_LOGGING:
+        logging.info(f"Detected {len(detected_objects)} object(s) in the frame.")
 
     return detected_objects
 
@@ -225,9 +432,16 @@ def calculate_distances(box, frame_width, frame_height):
     return float(horizontal_distance), float(vertical_distance)
 
 
-def decide_direction(horizontal_distance):
+def alignment_threshold(frame_width, frame_height):
+    # MIN_PIXEL_DISTANCE is tuned for FRAME_WIDTH; below one or two detector pixels the error is just noise
+    scaled = MIN_PIXEL_DISTANCE * frame_width / FRAME_WIDTH
+    detector_pixel = max(frame_width, frame_height) / INFERENCE_SIZE
+    return max(scaled, MIN_INFERENCE_PIXELS * detector_pixel)
+
+
+def decide_direction(horizontal_distance, threshold=MIN_PIXEL_DISTANCE):
 
-    if abs(horizontal_distance) < MIN_PIXEL_DISTANCE:
+    if abs(horizontal_distance) < threshold:
         return 'straight'
     elif horizontal_distance > 0:
         return 'right'
@@ -235,16 +449,50 @@ def decide_direction(horizontal_distance):
         return 'left'
 
 
-def align_robot(direction, distance):
+def remember_target_bearing(bearing_deg, turned_deg=0.0):
+    """Record where the target was last seen (degrees, positive right), or shift the memory by a commanded turn."""
+    global last_seen_bearing, last_seen_at
+    if bearing_deg is not None:
+        last_seen_bearing, last_seen_at = bearing_deg, CONTROL_CLOCK()
+    elif last_seen_bearing is not None:
+        last_seen_bearing -= turned_deg
+
+
+def create_alignment_controller(class_name=None, kind=None):
+    gains = {**ALIGNMENT_GAINS['default'], **ALIGNMENT_GAINS.get((class_name or '').lower(), {})}
+    return create_controller(kind or ALIGNMENT_CONTROLLER, gains)
 
-    global last_movement_time, original_distance, required_distance, STEPS_PER_ALIGNMENT  # Added STEPS_PER_ALIGNMENT
+
+@metrics.timed('align_robot')
+def align_robot(direction, distance, captured_at=None, frame_width=FRAME_WIDTH):
+
+    global last_movement_time, last_motion_done_at, original_distance, required_distance, STEPS_PER_ALIGNMENT, alignment_controller  # Added STEPS_PER_ALIGNMENT
 
     current_time = time.time()
+    if alignment_controller is None:
+        alignment_controller = create_alignment_controller()
 
     if current_time - last_movement_time >= MOVEMENT_INTERVAL:
         if direction in ['left', 'right']:
-            move_base(direction, MOVEMENT_DURATION)  # Move for specified duration
-            logging.info(f"Aligning {direction}: {distance:.2f}px from center.")
+            # The controller sizes the pulse from the error; gains are defined at FRAME_WIDTH
+            pulse_ms, pwm = alignment_controller.update(distance * FRAME_WIDTH / frame_width, CONTROL_CLOCK())
+            if pulse_ms == 0:
+                return
+            direction = 'right' if pulse_ms > 0 else 'left'
+            future = move_base(direction, abs(pulse_ms), pwm)
+            turn_rate = TURN_RATE_DEG_S * (pwm / TURN_PWM if pwm is not None else 1.0)
+            remember_target_bearing(None, turned_deg=pulse_ms / 1000.0 * turn_rate)
+            if captured_at is not None:
+                latency = time.monotonic() - captured_at
+                metrics.observe('capture_to_command', latency)
+                if FRAME_LOGGING:
+                    logging.info(f"Aligning {direction} for {abs(pulse_ms)}ms: {distance:.2f}px from center "
+                                 f"({latency * 1000:.1f}ms from capture to command).")
+            elif FRAME_LOGGING:
+                logging.info(f"Aligning {direction} for {abs(pulse_ms)}ms: {distance:.2f}px from center.")
+            # Wait for the pulse to finish so the next frame is taken after the turn
+            wait_for_command(future)
+            last_motion_done_at = time.monotonic()
             last_movement_time = current_time
 
             # Record original distance on first alignment
@@ -254,150 +502,181 @@ def align_robot(direction, distance):
                 logging.info(f"Original distance recorded: {original_distance:.2f}px")
                 logging.info(f"Required distance to move forward: {required_distance:.2f}px")
         elif direction == 'straight':
-            logging.info("Aligned straight. No movement needed.")
+            if FRAME_LOGGING:
+                logging.info("Aligned straight. No movement needed.")
+            alignment_controller.reset()
             stop_movement()
 
 
-def draw_direction_arrow(frame, direction):
+def draw_direction_arrow(frame, direction, scale=1.0):
 
     # Calculate the center of the frame
-    frame_center_x = int(FRAME_WIDTH / 2 + VERTICAL_LINE_OFFSET)
-    frame_center_y = int(FRAME_HEIGHT / 2)
+    frame_center_x = int(frame.shape[1] / 2 + VERTICAL_LINE_OFFSET * scale)
+    frame_center_y = int(frame.shape[0] / 2)
+    arrow_length = int(ARROW_LENGTH * scale)
+    arrow_y = frame_center_y - int(ARROW_POSITION_OFFSET_Y * scale)
 
     # Define the starting point of the arrow (above the x-axis)
-    start_point = (frame_center_x, frame_center_y - ARROW_POSITION_OFFSET_Y)
+    start_point = (frame_center_x, arrow_y)
 
     if direction == 'left':
-        end_point = (frame_center_x - ARROW_LENGTH, frame_center_y - ARROW_POSITION_OFFSET_Y)
+        end_point = (frame_center_x - arrow_length, arrow_y)
         color = ARROW_COLOR_LEFT
     elif direction == 'right':
-        end_point = (frame_center_x + ARROW_LENGTH, frame_center_y - ARROW_POSITION_OFFSET_Y)
+        end_point = (frame_center_x + arrow_length, arrow_y)
         color = ARROW_COLOR_RIGHT
     else:
         return
 
-    cv2.arrowedLine(frame, start_point, end_point, color, ARROW_THICKNESS, tipLength=0.3)
+    cv2.arrowedLine(frame, start_point, end_point, color, max(1, int(ARROW_THICKNESS * scale)), tipLength=0.3)
 
 
-def process_frame(frame, model, selected_object=None):
+def annotate_frame(frame, detected_objects, scale=1.0):
+    """Draw process_frame's results onto `frame`, which may be a copy resized by `scale`."""
+    frame_height, frame_width = frame.shape[:2]
 
-    global original_distance, required_distance
-    # Detect objects in the frame
-    detected_objects = detect_objects(frame, model)
+    # Draw the bounding box and confidence of each object
+    for obj in detected_objects:
+        box = obj['box']
+        top_left = (int(box[0] * scale), int(box[1] * scale))
+        bottom_right = (int(box[2] * scale), int(box[3] * scale))
+        cv2.rectangle(frame, top_left, bottom_right, (0, 255, 0), 2)
+        cv2.putText(frame, f"{obj['class_name']}: {obj['confidence']:.2f}", (top_left[0], top_left[1] - 10),
+                    cv2.FONT_HERSHEY_SIMPLEX, 0.9 * scale, (36, 255, 12), 2)  # Label text
 
-    # Initialize dictionary to store movement directions
-    movement_directions = {}  # Dictionary to store movement directions per class
+    # Draw center lines
+    frame_center_x = int(frame_width / 2 + VERTICAL_LINE_OFFSET * scale)
+    frame_center_y = int(frame_height / 2)
+    cv2.line(frame, (frame_center_x, 0), (frame_center_x, frame_height), (255, 0, 0), 2)  # Vertical center line
+    cv2.line(frame, (0, frame_center_y), (frame_width, frame_center_y), (255, 0, 0), 2)  # Horizontal center line
+
+    # Display horizontal and vertical distances for each detected object
+    line_height = max(12, int(30 * scale))
+    y_offset = frame_height - 2 * line_height
+    for obj in detected_objects:
+        class_name = obj['class_name']
+        cv2.putText(frame, f"{class_name} Horizontal: {obj['horizontal_distance']:.2f}px", (10, y_offset),
+                    cv2.FONT_HERSHEY_SIMPLEX, 0.6 * max(scale, 0.5), (255, 255, 255), 2)
+        y_offset += line_height
+        cv2.putText(frame, f"{class_name} Vertical: {obj['vertical_distance']:.2f}px", (10, y_offset),
+                    cv2.FONT_HERSHEY_SIMPLEX, 0.6 * max(scale, 0.5), (255, 255, 255), 2)
+        y_offset += line_height
+
+    # Draw directional arrows for each movement direction
+    for direction in {obj['direction'] for obj in detected_objects}:
+        if direction in ['left', 'right']:
+            draw_direction_arrow(frame, direction, scale)
+
+    return frame
+
+
+def render_view(frame, detected_objects, scale=1.0):
+    """FrameViewer callback: annotations plus the metrics overlay."""
+    annotate_frame(frame, detected_objects, scale)
+    if METRICS_OVERLAY:
+        metrics.draw_overlay(frame)
+    return frame
+
+
+@metrics.timed('process_frame')
+def process_frame(captured, model, selected_object=None, annotate=True, align=True):
+    """Detect, align towards the selected object, and (unless `annotate` is False) draw the results.
+
+    With `align` False no commands are sent, for callers that steer the robot themselves.
+    """
+
+    global original_distance, required_distance, target_missing
+    metrics.increment('frames')
+    frame = captured.image
+    frame_height, frame_width = frame.shape[:2]
+    threshold = alignment_threshold(frame_width, frame_height)
+    # Detect objects in the frame, or follow the already found target with the tracker
+    if selected_object and target_tracker is not None:
+        detected_objects = target_tracker.update(frame)
+    else:
+        detected_objects = detect_objects(frame, model)
 
     # Initialize list to store only selected objects
     selected_detected_objects = []
 
     # Process each detected object
     for obj in detected_objects:
-        class_id = obj['class_id']
         class_name = obj['class_name']
         box = obj['box']
-        confidence = obj['confidence']
 
         # If a selected_object is specified, ignore others
         if selected_object and class_name.lower() != selected_object.lower():
             continue
 
-        top_left = (int(box[0]), int(box[1]))
-        bottom_right = (int(box[2]), int(box[3]))
-
         # Calculate horizontal and vertical distances
-        horizontal_distance, vertical_distance = calculate_distances(box, FRAME_WIDTH, FRAME_HEIGHT)
+        horizontal_distance, vertical_distance = calculate_distances(box, frame_width, frame_height)
 
         # Store distances in the object dictionary
         obj['horizontal_distance'] = horizontal_distance
         obj['vertical_distance'] = vertical_distance
-
-        # Draw the bounding box and confidence on the frame
-        frame = cv2.rectangle(frame, top_left, bottom_right, (0, 255, 0), 2)
-        cv2.putText(frame, f"{class_name}: {confidence:.2f}", (top_left[0], top_left[1] - 10),
-                    cv2.FONT_HERSHEY_SIMPLEX, 0.9, (36, 255, 12), 2)  # Label text
+        obj['alignment_threshold'] = threshold
+        if selected_object:
+            remember_target_bearing(bearing_of((box[0] + box[2]) / 2, frame_width, CAMERA_HFOV_DEG))
 
         # Decide alignment direction based on horizontal distance
-        direction = decide_direction(horizontal_distance)
+        direction = decide_direction(horizontal_distance, threshold)
 
         # Align the robot to center the object
-        align_robot(direction, horizontal_distance)
-        movement_directions[class_name] = direction  # Capture the direction for arrow drawing
+        if align:
+            align_robot(direction, horizontal_distance, captured_at=captured.timestamp, frame_width=frame_width)
+        obj['direction'] = direction  # Capture the direction for arrow drawing
 
         # Check if the required alignment is reached
-        if original_distance is not None and abs(horizontal_distance) <= MIN_PIXEL_DISTANCE:
+        if original_distance is not None and abs(horizontal_distance) <= threshold:
             logging.info(
-                f"Reached required alignment for {class_name}: {abs(horizontal_distance):.2f}px <= {MIN_PIXEL_DISTANCE}px")
+                f"Reached required alignment for {class_name}: {abs(horizontal_distance):.2f}px <= {threshold:.1f}px")
 
         # Append to selected_detected_objects
         selected_detected_objects.append(obj)
 
-    # Handle case when no selected object is detected
+    # Handle case when no selected object is detected; the base is only stopped when the target disappears
     if selected_object:
         if not selected_detected_objects:
             logging.warning(f"Selected object '{selected_object}' not detected in the frame.")
-            stop_movement()
+            if align and not target_missing:
+                stop_movement()
+        target_missing = not selected_detected_objects
     else:
         if len(detected_objects) == 0:
             # No objects detected; stop any ongoing movement
-            stop_movement()
+            if align:
+                stop_movement()
             logging.warning("No target objects detected in the frame.")
 
-    # Draw center lines
-    frame_center_x = int(FRAME_WIDTH / 2 + VERTICAL_LINE_OFFSET)
-    frame_center_y = int(FRAME_HEIGHT / 2)
-    cv2.line(frame, (frame_center_x, 0), (frame_center_x, FRAME_HEIGHT), (255, 0, 0), 2)  # Vertical center line
-    cv2.line(frame, (0, frame_center_y), (FRAME_WIDTH, frame_center_y), (255, 0, 0), 2)  # Horizontal center line
-
-    # Display horizontal and vertical distances for each detected object
-    y_offset = FRAME_HEIGHT - 60
-    for obj in selected_detected_objects:
-        class_name = obj['class_name']
-        horizontal_distance = obj['horizontal_distance']
-        vertical_distance = obj['vertical_distance']
-        cv2.putText(frame, f"{class_name} Horizontal: {horizontal_distance:.2f}px", (10, y_offset),
-                    cv2.FONT_HERSHEY_SIMPLEX, 0.6, (255, 255, 255), 2)
-        y_offset += 30
-        cv2.putText(frame, f"{class_name} Vertical: {vertical_distance:.2f}px", (10, y_offset),
-                    cv2.FONT_HERSHEY_SIMPLEX, 0.6, (255, 255, 255), 2)
-        y_offset += 30
-
-    # Draw directional arrows for each movement direction
-    for class_name, direction in movement_directions.items():
-        if direction in ['left', 'right']:
-            draw_direction_arrow(frame, direction)
+    # Headless runs skip all drawing; a FrameViewer annotates its own downsized copy instead
+    if annotate:
+        annotate_frame(frame, selected_detected_objects)
 
     return frame, selected_detected_objects
 
 
+@metrics.timed('get_distance')
 def get_distance():
+    range_sensor = get_range_sensor()
+    if range_sensor is None:
+        raise PickAborted("Arduino serial connection is not open. Cannot measure distance.")
     try:
-        # Run distance.py and capture the output
-        result = subprocess.run(['python', 'distance.py'], capture_output=True, text=True, check=True)
-        output = result.stdout.strip()
-        logging.info(f"Distance Measurement Output: '{output}'")
-
-        if output.lower() == 'error':
-            logging.error("Distance measurement error.")
-            sys.exit(1)
-        elif output.lower() == 'out of range':
-            logging.warning("Distance out of range.")
-            return float('inf')  # Represent out of range as infinity
-        else:
-            distance_mm = float(output)
-            distance_cm = distance_mm / 10.0  # Convert mm to cm
-            logging.info(f"Measured Distance: {distance_cm}cm (Converted from {distance_mm}mm)")  # <-- Modified
-            return distance_cm  # <-- Modified
-    except subprocess.CalledProcessError:
-        logging.error("Failed to run distance.py.")
-        sys.exit(1)
-    except ValueError:
-        logging.error("Invalid distance value received.")
-        sys.exit(1)
+        distance_mm = range_sensor.read_mm()
+    except RangeSensorError as e:
+        raise PickAborted(f"Distance measurement error: {e}")
+
+    if distance_mm == float('inf'):
+        logging.warning("Distance out of range.")
+        return float('inf')  # Represent out of range as infinity
+
+    distance_cm = distance_mm / 10.0  # Convert mm to cm
+    if FRAME_LOGGING:
+        logging.info(f"Measured Distance: {distance_cm}cm (Converted from {distance_mm}mm)")
+    return distance_cm
 
 
 def move_forward_and_check_distance():
-    global step_count, state, previous_distance, DISTANCE_THRESHOLD, STEPS_PER_ALIGNMENT, selected_object  # <-- Added 'selected_object'
+    global step_count, state, previous_distance, last_motion_done_at, DISTANCE_THRESHOLD, STEPS_PER_ALIGNMENT, selected_object  # <-- Added 'selected_object'
 
     # Get current distance in cm
     current_distance_cm = get_distance()
@@ -416,80 +695,31 @@ def move_forward_and_check_distance():
         state = STATE_CATCHING_CLAW
         return  # Exit the function to proceed to catching
 
-    # Determine threshold_cm and adjustment_factor based on the selected object
-    if selected_object.lower() == "small_bottle":
-        threshold_cm = 15.0  # Threshold for small_bottle
-        adjustment_factor = 0.45
-        logging.info(f"Selected object is 'small_bottle'. Using threshold {threshold_cm}cm and adjustment factor {adjustment_factor}.")
-    if selected_object.lower() == "horn":
-        threshold_cm = 15.0  # Threshold for small_bottle
-        adjustment_factor = 0.6
-        logging.info(f"Selected object is 'horn'. Using threshold {threshold_cm}cm and adjustment factor {adjustment_factor}.")
-    else:
-        threshold_cm = 10.0  # Threshold for other objects
-        adjustment_factor = 0.65
-        logging.info(f"Selected object is '{selected_object}'. Using threshold {threshold_cm}cm and adjustment factor {adjustment_factor}.")
-
-    move_duration_ms = 200  # Default duration for distance_diff_cm <= 5cm
-
-    if distance_diff_cm > 1.3*threshold_cm:
-        # Multiply the distance_diff_cm by the adjustment factor
-        adjusted_distance_diff_cm = distance_diff_cm * adjustment_factor
-        logging.info(f"Adjusted distance difference: {adjusted_distance_diff_cm}cm ({distance_diff_cm}cm * {adjustment_factor})")
-
-        movement_mapping = [
-            (2.5, 100),
-            (3, 150),
-            (6, 200),
-            (10, 450),
-            (12, 500),
-            (14, 600),
-            (16, 700),
-            (20, 800),
-            (22, 900),
-            (24, 1000),
-            (27, 1100),
-            (30, 1200),
-            (33, 1300),
-            (36, 1400),
-            (37, 1500),
-            (40, 1600),
-            (42, 1700),
-            (44, 1800),
-            (46, 1900),
-            (55, 2000),
-            (65, 2800),
-            (75, 3300),
-            (85, 3800),
-        ]
-
-        for distance_cm, duration_ms in movement_mapping:
-            if adjusted_distance_diff_cm <= distance_cm:
-                move_duration_ms = duration_ms
-                logging.info(f"Mapping adjusted distance {adjusted_distance_diff_cm}cm to duration {move_duration_ms}ms.")
-                break
-        else:
-            # If adjusted_distance_diff_cm exceeds all mappings, use the maximum duration
-            move_duration_ms = movement_mapping[-1][1]
-            logging.info(f"Adjusted distance {adjusted_distance_diff_cm}cm exceeds all mappings. Using maximum duration {move_duration_ms}ms.")
-
-    elif 5.0 < distance_diff_cm <= threshold_cm:
-        # Set movement duration to 300ms for distance_diff_cm between 5cm and threshold_cm
-        move_duration_ms = 250
-        logging.info(f"Distance difference {distance_diff_cm}cm > 5cm and <= {threshold_cm}cm. Using movement duration {move_duration_ms}ms.")
-
-    else:  # distance_diff_cm <= 5.0
-        # Set movement duration to 200ms for distance_diff_cm <= 5cm
-        move_duration_ms = 150
-        logging.info(f"Distance difference {distance_diff_cm}cm <= 5cm. Using movement duration {move_duration_ms}ms.")
+    # One lookup in the robot's calibrated motion model; the per-class fraction leaves a margin short of the target
+    fraction = APPROACH_FRACTIONS.get(selected_object.lower(), APPROACH_FRACTIONS['default'])
+    move_duration_ms = int(np.clip(get_motion_model().duration_for(distance_diff_cm * fraction),
+                                   MIN_FORWARD_MS, MAX_FORWARD_MS))
 
     logging.info(f"Distance difference: {distance_diff_cm}cm => Moving forward for {move_duration_ms}ms.")
 
-    # Move forward with the decided duration
-    move_forward(move_duration_ms)
+    # Move forward with the decided duration, polling the range sensor while the wheels turn
+    forward = move_forward(move_duration_ms)
+    while not forward.done():
+        moving_distance_cm = get_distance()
+        if moving_distance_cm <= DISTANCE_THRESHOLD / 10.0:
+            logging.info(
+                f"Distance {moving_distance_cm}cm reached the threshold {DISTANCE_THRESHOLD / 10.0}cm mid-move. Stopping.")
+            wait_for_command(stop_movement())
+            state = STATE_CATCHING_CLAW
+            return
+    wait_for_command(forward)
+    last_motion_done_at = time.monotonic()
     logging.info(f"Moved forward for {move_duration_ms}ms.")
-    # Brief pause to allow movement to complete
-    time.sleep(move_duration_ms / 1000.0)
+    if CALIBRATION_LOGGING and np.isfinite(current_distance_cm):
+        # Only moves that ran their full length say how far a pulse of this length goes
+        moved_to_cm = get_distance()
+        if np.isfinite(moved_to_cm):
+            record_move(ROBOT_ID, move_duration_ms, current_distance_cm - moved_to_cm, object=selected_object)
     step_count += 1
     logging.info(f"Completed step {step_count} of {STEPS_PER_ALIGNMENT}.")
 
@@ -504,34 +734,209 @@ def move_forward_and_check_distance():
     previous_distance = current_distance_cm
 
 
+class DistanceWatch:
+    """Streams range readings on a background thread while the base drives, and stops it at the threshold.
+
+    The pick loop sends its drive commands under `lock` after checking `reached`, so no drive can be
+    queued behind the stop.
+    """
 
+    def __init__(self, threshold_cm):
+        self.threshold_cm = threshold_cm
+        self.latest_cm = float('inf')
+        self.error = None
+        self.reached = threading.Event()
+        self.lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='distance-watch', daemon=True)
 
+    def start(self):
+        self._thread.start()
+        return self
 
+    def stop(self):
+        self._stopped.set()
+        self._thread.join(timeout=2)
 
-def terminate_program():
+    def _run(self):
+        range_sensor = get_range_sensor()
+        if range_sensor is None:
+            self.error = "Arduino serial connection is not open. Cannot measure distance."
+            return
+        try:
+            for reading in range_sensor.stream():
+                self.latest_cm = reading.distance_mm / 10.0
+                if self.latest_cm <= self.threshold_cm:
+                    with self.lock:
+                        wait_for_command(stop_movement())
+                        self.reached.set()
+                    logging.info(f"Distance {self.latest_cm}cm reached the threshold {self.threshold_cm}cm. Stopped.")
+                    return
+                if self._stopped.is_set():
+                    return
+        except RangeSensorError as e:
+            self.error = str(e)
+            stop_movement()
+
+
+def approach_target(grabber, model, display=False, viewer=None, window_name=None):
+    """Drive at the target while steering from every new frame, until the range sensor reaches the threshold.
+
+    Returns the next state: catching once the threshold is reached, aligning if the target is lost.
+    """
+    global last_motion_done_at
+
+    watch = DistanceWatch(DISTANCE_THRESHOLD / 10.0).start()
+    last_frame_id = None
+    last_steered_at = None
+    missed_frames = 0
+    try:
+        while not watch.reached.is_set():
+            check_abort()
+            if watch.error:
+                raise PickAborted(f"Distance measurement error: {watch.error}")
+            ret, captured = grabber.read(timeout=0.2, after_id=last_frame_id)
+            if not ret:
+                continue
+            last_frame_id = captured.frame_id
+
+            annotated_frame, detected_objects = process_frame(captured, model, selected_object=selected_object,
+                                                              annotate=display, align=False)
+            show_frame(annotated_frame, detected_objects, display, viewer, window_name)
+
+            if not detected_objects:
+                missed_frames += 1
+                if missed_frames >= TARGET_LOST_FRAMES:
+                    logging.warning(f"Lost '{selected_object}' while approaching. Stopping to re-align.")
+                    with watch.lock:
+                        wait_for_command(stop_movement())
+                    alignment_controller.reset()
+                    last_motion_done_at = time.monotonic()
+                    return STATE_ALIGNING
+                continue
+            missed_frames = 0
+
+            now = CONTROL_CLOCK()
+            if last_steered_at is not None and now - last_steered_at < STEERING_INTERVAL:
+                continue
+            last_steered_at = now
+
+            # A target right of centre speeds up the left wheel, which turns the robot right
+            frame_width = captured.image.shape[1]
+            error_px = detected_objects[0]['horizontal_distance'] * FRAME_WIDTH / frame_width
+            steering = float(np.clip(STEERING_GAIN * error_px, -MAX_STEERING_PWM, MAX_STEERING_PWM))
+            with watch.lock:
+                if watch.reached.is_set():
+                    break
+                drive(APPROACH_PWM + steering, APPROACH_PWM - steering, DRIVE_SEGMENT_MS)
+    finally:
+        watch.stop()
+
+    last_motion_done_at = time.monotonic()
+    metrics.increment('combined_approaches')
+    return STATE_CATCHING_CLAW
+
+
+def search_for_target(grabber, model, display=False, viewer=None, window_name=None):
+    """Scan for the selected object with turn pulses, first towards the side it was last seen on.
+
+    Returns STATE_ALIGNING once the target is in view. Raises TargetNotFound after a full turn or
+    SEARCH_TIMEOUT_S, with a report of the search.
+    """
+    global last_motion_done_at
+
+    started = CONTROL_CLOCK()
+    remembered = last_seen_bearing is not None and started - last_seen_at <= SEARCH_MEMORY_S
+    direction = ('right' if last_seen_bearing > 0 else 'left') if remembered else SEARCH_DEFAULT_DIRECTION
+    pulse_ms = int(SEARCH_STEP_DEG / TURN_RATE_DEG_S * 1000)
+    logging.info(f"Searching for '{selected_object}', turning {direction}"
+                 + (f" (last seen at {last_seen_bearing:.0f} deg)." if remembered else "."))
+    metrics.increment('searches')
+
+    turned_deg = 0.0
+    while True:
+        check_abort()
+        ret, captured = grabber.read(after_time=last_motion_done_at)
+        if ret:
+            found = [obj for obj in detect_objects(captured.image, model)
+                     if obj['class_name'].lower() == selected_object.lower()]
+            if display:
+                annotate_frame(captured.image, found)
+            show_frame(captured.image, found, display, viewer, window_name)
+            if found:
+                logging.info(f"Found '{selected_object}' after turning {turned_deg:.0f} deg "
+                             f"in {CONTROL_CLOCK() - started:.1f}s.")
+                if target_tracker is not None:
+                    target_tracker.reset()
+                return STATE_ALIGNING
+
+        elapsed = CONTROL_CLOCK() - started
+        if turned_deg >= 360.0 or elapsed >= SEARCH_TIMEOUT_S:
+            metrics.increment('searches_failed')
+            report = {
+                'target': selected_object,
+                'turned_deg': turned_deg,
+                'direction': direction,
+                'elapsed_s': round(elapsed, 2),
+                'last_seen_bearing_deg': round(last_seen_bearing, 1) if remembered else None,
+            }
+            raise TargetNotFound(f"'{selected_object}' not found after turning {turned_deg:.0f} deg "
+                                 f"in {elapsed:.1f}s.", report)
+
+        wait_for_command(move_base(direction, pulse_ms))
+        last_motion_done_at = time.monotonic()
+        turned_deg += SEARCH_STEP_DEG
+
+
+def terminate_program(exit_code=0):
     # Release the capture and close windows
-    if 'cap' in globals() and cap:
-        cap.release()
-    cv2.destroyAllWindows()
+    if 'grabber' in globals() and grabber:
+        grabber.release()
+    close_frame_bus()
+    if DISPLAY_MODE in ('window', 'viewer'):
+        cv2.destroyAllWindows()
     logging.info("Video capture released and all windows closed.")
 
     # Close serial connection if open
-    if arduino and arduino.is_open:
-        arduino.close()
-        logging.info("Serial connection to Arduino closed.")
+    close_resources()
 
     # Exit the program
     logging.info("Program terminated successfully.")
-    sys.exit(0)
+    sys.exit(exit_code)
 
 
 def catch_claw(selected_object):
 
     catch_claw_command(selected_object)
 
+class PickAborted(Exception):
+    pass
+
+
+def request_abort():
+    """Stop the robot and make the running pick raise PickAborted at its next check; safe from any thread."""
+    abort_requested.set()
+    stop_movement()
+
+
+def check_abort():
+    if abort_requested.is_set():
+        raise PickAborted("Job cancelled.")
+
+
+class TargetNotFound(PickAborted):
+    """A search gave up; `report` says which way, how far and how long it looked."""
+
+    def __init__(self, message, report):
+        super().__init__(message)
+        self.report = report
+
+
 # Define possible states
 STATE_ALIGNING = 'aligning'
 STATE_MOVING_FORWARD = 'moving_forward'
+STATE_APPROACHING = 'approaching'  # Driving and steering at once (APPROACH_MODE 'combined')
+STATE_SEARCHING = 'searching'  # Scanning for a target that is out of view
 STATE_CATCHING_CLAW = 'catching_claw'
 
 # Initialize state
@@ -539,15 +944,30 @@ state = STATE_ALIGNING
 
 # Initialize movement timing variables
 last_movement_time = 0  # Timestamp of the last movement command
+last_motion_done_at = 0.0  # time.monotonic() when the last move finished; older frames are stale
 original_distance = None  # Original horizontal distance at first detection
 required_distance = 0.0  # 80% of original distance
 
 # Initialize step counter
 step_count = 0
 
+# Detect-then-track helper for the current target (created per object)
+target_tracker = None
+
+# Turns pixel error into pulse lengths for the current target (created per object)
+alignment_controller = None
+
 # Initialize previous_distance
 previous_distance = None
 
+# Bearing (degrees, positive right) and CONTROL_CLOCK time the current target was last seen at
+last_seen_bearing = None
+last_seen_at = 0.0
+target_missing = False  # The selected object was absent from the last processed frame
+
+# Set by request_abort(); cleared by whoever starts the next job
+abort_requested = threading.Event()
+
 def read_selected_objects_from_file(filename='selected_objects.txt'):
     try:
         with open(filename, 'r') as f:
@@ -564,134 +984,318 @@ def read_selected_objects_from_file(filename='selected_objects.txt'):
         logging.error(f"Error reading selected objects from file: {e}")
         sys.exit(1)
 
-def main():
-    global cap, state, step_count, previous_distance, selected_object, DISTANCE_THRESHOLD, original_distance, required_distance, STEPS_PER_ALIGNMENT
+def create_capture(source):
+    # Anything with read() (a replay or simulated camera) is used as is
+    if hasattr(source, 'read'):
+        return source
+    if isinstance(source, int) or str(source).isdigit():
+        cap = cv2.VideoCapture(int(source))
+        cap.set(cv2.CAP_PROP_FRAME_WIDTH, FRAME_WIDTH)
+        cap.set(cv2.CAP_PROP_FRAME_HEIGHT, FRAME_HEIGHT)
+        return cap
+    return ReplayCapture(source, size=(FRAME_WIDTH, FRAME_HEIGHT))
+
+
+def open_frame_bus(name=None):
+    """Reader on the frame bus (default FRAME_BUS), first starting the capture process if nothing publishes to it."""
+    global bus_capture
+    name = name or FRAME_BUS
+    cap = BusCapture(name, timeout=0)
+    if not cap.isOpened():
+        bus_capture = start_capture_process(CAMERA_SOURCE, name, size=(FRAME_WIDTH, FRAME_HEIGHT))
+        cap = BusCapture(name)
+    return cap
+
+
+def close_frame_bus():
+    global bus_capture
+    if bus_capture is not None:
+        stop_capture_process(*bus_capture)
+        bus_capture = None
+
+
+def open_camera(source=None, max_retries=5, retry_delay=1):
+    """Open the camera with retries and return a started FrameGrabber, or None if it never opens."""
+    started = time.perf_counter()
+    if source is None and FRAME_BUS:
+        source = open_frame_bus()
+    source = CAMERA_SOURCE if source is None else source
+    cap = create_capture(source)
+
+    for attempt in range(1, max_retries + 1):
+        if cap.isOpened():
+            logging.info(f"Camera successfully initialized on attempt {attempt}.")
+            break
+        else:
+            logging.warning(
+                f"Camera initialization failed on attempt {attempt}. Retrying in {retry_delay} second(s)...")
+            time.sleep(retry_delay)
+            cap.release()
+            cap = create_capture(source)
+    else:
+        logging.error(f"Failed to initialize camera after {max_retries} attempts.")
+        return None
 
-    selected_objects = read_selected_objects_from_file()
+    if not cap.isOpened():
+        logging.error("Error: Could not open video stream or file")
+        return None
 
-    if not selected_objects:
-        logging.error("No objects to pick. Exiting program.")
-        terminate_program()
+    STARTUP_TIMINGS['camera'] = time.perf_counter() - started
+    # Capture on a background thread so alignment always sees the newest frame
+    return FrameGrabber(cap).start()
 
-    logging.info(f"Proceeding with selected objects: {selected_objects}")
 
-    for idx, selected_object in enumerate(selected_objects, start=1):
-        logging.info(f"\n=== Starting Process for Object {idx}: '{selected_object}' ===")
+def configure_for_object(selected_object):
+    global DISTANCE_THRESHOLD, STEPS_PER_ALIGNMENT
 
-        selected_object_lower = selected_object.lower()
+    selected_object_lower = selected_object.lower()
 
-        if selected_object_lower in DISTANCE_THRESHOLDS:
-            if selected_object_lower == "box":  # <-- Modified for case-insensitivity
-                STEPS_PER_ALIGNMENT = 2  # Set to 2 for 'box'
-                logging.info(f"STEPS_PER_ALIGNMENT set to {STEPS_PER_ALIGNMENT} for '{selected_object}'.")
-            else:
-                STEPS_PER_ALIGNMENT = 1  # Ensure it's set to 1 for other objects
-            DISTANCE_THRESHOLD = DISTANCE_THRESHOLDS[selected_object_lower]
-            logging.info(f"DISTANCE_THRESHOLD set to {DISTANCE_THRESHOLD}mm for '{selected_object}'.")
+    if selected_object_lower in DISTANCE_THRESHOLDS:
+        if selected_object_lower == "box":  # <-- Modified for case-insensitivity
+            STEPS_PER_ALIGNMENT = 2  # Set to 2 for 'box'
+            logging.info(f"STEPS_PER_ALIGNMENT set to {STEPS_PER_ALIGNMENT} for '{selected_object}'.")
         else:
-            DISTANCE_THRESHOLD = DISTANCE_THRESHOLD_DEFAULT
             STEPS_PER_ALIGNMENT = 1  # Ensure it's set to 1 for other objects
-            logging.warning(
-                f"No distance threshold defined for '{selected_object}'. Using default {DISTANCE_THRESHOLD}mm and STEPS_PER_ALIGNMENT={STEPS_PER_ALIGNMENT}.")
+        DISTANCE_THRESHOLD = DISTANCE_THRESHOLDS[selected_object_lower]
+        logging.info(f"DISTANCE_THRESHOLD set to {DISTANCE_THRESHOLD}mm for '{selected_object}'.")
+    else:
+        DISTANCE_THRESHOLD = DISTANCE_THRESHOLD_DEFAULT
+        STEPS_PER_ALIGNMENT = 1  # Ensure it's set to 1 for other objects
+        logging.warning(
+            f"No distance threshold defined for '{selected_object}'. Using default {DISTANCE_THRESHOLD}mm and STEPS_PER_ALIGNMENT={STEPS_PER_ALIGNMENT}.")
+
+
+def create_viewer(mode=None):
+    """Started FrameViewer for the 'viewer' and 'mjpeg' display modes, otherwise None."""
+    mode = DISPLAY_MODE if mode is None else mode
+    if mode not in ('viewer', 'mjpeg'):
+        return None
+    return FrameViewer(render_view, scale=VIEWER_SCALE, max_fps=VIEWER_MAX_FPS,
+                       window_name='YOLOv9m Object Detection and Alignment' if mode == 'viewer' else None,
+                       mjpeg_port=MJPEG_PORT if mode == 'mjpeg' else None).start()
+
+
+def show_frame(annotated_frame, detected_objects, display, viewer, window_name):
+    """Hand the frame to the viewer or show it inline; raises PickAborted when 'q' is pressed."""
+    if viewer is not None:
+        viewer.submit(annotated_frame, detected_objects)
+        viewer.pump()
+        if viewer.quit_requested.is_set():
+            raise PickAborted("Exiting program as 'q' was pressed.")
+
+    if display:
+        if METRICS_OVERLAY:
+            metrics.draw_overlay(annotated_frame)
+        # Display the annotated frame
+        cv2.imshow(window_name, annotated_frame)
+
+        # Check if 'q' is pressed to exit
+        if cv2.waitKey(1) & 0xFF == ord('q'):
+            raise PickAborted("Exiting program as 'q' was pressed.")
+
+
+def pick_object(target, grabber, display=True, retry_delay=1, viewer=None, expected_bearing_deg=None):
+    """Run the align / approach / catch state machine for one object on an already open camera.
+
+    With a viewer, frames are handed to it unannotated; with neither a viewer nor `display` the loop is
+    fully headless. `expected_bearing_deg` seeds the search direction if the target is not in view.
+    """
+    global state, step_count, previous_distance, selected_object, original_distance, required_distance, target_tracker, alignment_controller, last_seen_bearing, target_missing
+
+    selected_object = target
+    selected_object_lower = selected_object.lower()
+    configure_for_object(selected_object)
+    model = get_model()
+
+    if TRACKING_ENABLED:
+        target_tracker = TargetTracker(lambda image: detect_objects(image, model), selected_object,
+                                       redetect_interval=REDETECT_INTERVAL, roi_margin=ROI_MARGIN,
+                                       tracker_type=TRACKER_TYPE)
+    else:
+        target_tracker = None
+    alignment_controller = create_alignment_controller(selected_object)
+
+    # Reset state variables for the new object
+    state = STATE_ALIGNING
+    step_count = 0
+    previous_distance = None
+    original_distance = None
+    required_distance = 0.0
+    last_frame_id = None
+    missed_frames = 0
+    last_seen_bearing = None
+    target_missing = False
+    if expected_bearing_deg is not None:
+        remember_target_bearing(expected_bearing_deg)
+
+    window_name = f'YOLOv9m Object Detection and Alignment - {selected_object}'
+    display = display and viewer is None
+    logging.info(f"Starting video capture for '{selected_object}'."
+                 + (" Press 'q' to exit." if display or (viewer and viewer.window_name) else ""))
+
+    # Main loop for the current object
+    while True:
+        check_abort()
+        if state == STATE_ALIGNING:
+            # Only frames captured after the last move finished show where the robot is now
+            ret, captured = grabber.read(after_id=last_frame_id, after_time=last_motion_done_at)
+
+            if not ret:
+                logging.warning("Frame capture failed. Retrying...")
+                time.sleep(retry_delay)
+                continue
+            last_frame_id = captured.frame_id
+
+            # Process the frame for alignment and additional classes
+            annotated_frame, detected_objects = process_frame(captured, model, selected_object=selected_object,
+                                                              annotate=display)
+            show_frame(annotated_frame, detected_objects, display, viewer, window_name)
+
+            missed_frames = 0 if detected_objects else missed_frames + 1
+            if missed_frames >= SEARCH_AFTER_FRAMES:
+                state = STATE_SEARCHING
+                missed_frames = 0
+                continue
+
+            # Check if alignment is reached for the selected object
+            alignment_achieved = False
+            for obj in detected_objects:
+                if obj['class_name'].lower() == selected_object_lower:
+                    horizontal_distance = obj['horizontal_distance']
+                    if original_distance is not None:
+                        if abs(horizontal_distance) <= obj['alignment_threshold']:
+                            logging.info(
+                                f"Alignment achieved for {selected_object}: {abs(horizontal_distance):.2f}px <= {obj['alignment_threshold']:.1f}px")
+                            alignment_achieved = True
+                            break
+                    else:
+                        logging.info("Initial alignment not yet recorded.")
+
+            if alignment_achieved:
+                # Transition to the approach: steering while driving, or separate forward moves
+                state = STATE_APPROACHING if APPROACH_MODE == 'combined' else STATE_MOVING_FORWARD
+                step_count = 0  # Reset step counter
+                previous_distance = None  # Reset previous distance
+
+        elif state == STATE_MOVING_FORWARD:
+            # Move forward and check distance
+            move_forward_and_check_distance()
+
+        elif state == STATE_APPROACHING:
+            state = approach_target(grabber, model, display=display, viewer=viewer, window_name=window_name)
+
+        elif state == STATE_SEARCHING:
+            state = search_for_target(grabber, model, display=display, viewer=viewer, window_name=window_name)
+
+        elif state == STATE_CATCHING_CLAW:
+            # Send command to catch the claw
+            if target_tracker is not None:
+                logging.info(f"Detector usage for '{selected_object}': {target_tracker.stats}")
+            catch_claw(selected_object)
+            check_abort()
+            metrics.increment('picks_completed')
+            break
 
-        cap = cv2.VideoCapture(0)
-        cap.set(cv2.CAP_PROP_FRAME_WIDTH, FRAME_WIDTH)
-        cap.set(cv2.CAP_PROP_FRAME_HEIGHT, FRAME_HEIGHT)
+        else:
+            raise PickAborted(f"Unknown state: {state}.")
+
+    if display:
+        cv2.destroyWindow(window_name)
+
+
+def placement_classes():
+    """Classes whose grasp sequence releases the held object, i.e. where objects are put down."""
+    return {name for name, steps in load_grasp_sequences().items() if any(step.command == 'release' for step in steps)}
+
+
+def plan_picks(selected_objects, grabber):
+    """Detect every target in one frame and order the job by estimated travel time.
+
+    Returns (ordered targets, ScenePlan), or the request unchanged and None when there is nothing to plan.
+    """
+    if not PLAN_PICK_ORDER or len(selected_objects) < 2:
+        return list(selected_objects), None
+    ret, captured = grabber.read(after_time=last_motion_done_at)
+    if not ret:
+        logging.warning("No frame for planning; picking in the requested order.")
+        return list(selected_objects), None
+
+    plan = ScenePlan.from_detections(detect_objects(captured.image, get_model()), captured.image.shape[1],
+                                     CAMERA_HFOV_DEG, OBJECT_HEIGHTS_CM)
+    for target in plan.targets:
+        bearing, distance = plan.relative(target)
+        logging.info(f"Scene: '{target.class_name}' at {bearing:.0f} deg, ~{distance:.0f}cm.")
+    stop_distances = {name: threshold / 10.0 for name, threshold in DISTANCE_THRESHOLDS.items()}
+    ordered = plan.order(selected_objects, placement_classes(), TURN_RATE_DEG_S, FORWARD_SPEED_CM_S, stop_distances)
+    if ordered != list(selected_objects):
+        logging.info(f"Planned pick order: {ordered} (requested {list(selected_objects)}).")
+    return ordered, plan
+
+
+def pick_from_plan(target, plan, grabber, display=True, viewer=None):
+    """pick_object() that first turns towards the target's known bearing, then updates the scene plan."""
+    global last_motion_done_at
+
+    known = plan.locate(target) if plan is not None else None
+    bearing = None
+    if known is not None:
+        bearing, distance = plan.relative(known)
+        logging.info(f"'{target}' expected at {bearing:.0f} deg, ~{distance:.0f}cm from the scene plan.")
+        if abs(bearing) > PRE_TURN_MIN_DEG:
+            wait_for_command(move_base('right' if bearing > 0 else 'left',
+                                       int(abs(bearing) / TURN_RATE_DEG_S * 1000)))
+            last_motion_done_at = time.monotonic()
+            bearing = 0.0
+
+    pick_object(target, grabber, display=display, viewer=viewer, expected_bearing_deg=bearing)
+    if known is not None:
+        plan.arrived(known, DISTANCE_THRESHOLDS.get(target.lower(), DISTANCE_THRESHOLD_DEFAULT) / 10.0,
+                     picked=target.lower() not in placement_classes())
+
+
+def pick_objects(selected_objects, grabber, display=True, viewer=None):
+    selected_objects, plan = plan_picks(selected_objects, grabber)
+    for idx, target in enumerate(selected_objects, start=1):
+        logging.info(f"\n=== Starting Process for Object {idx}: '{target}' ===")
+        pick_from_plan(target, plan, grabber, display=display, viewer=viewer)
+        logging.info(f"Completed pickup for '{target}'. Proceeding to the next object.")
 
-        max_retries = 5  # Maximum number of camera initialization attempts
-        retry_delay = 1  # Seconds to wait between camera retries
 
-        for attempt in range(1, max_retries + 1):
-            if cap.isOpened():
-                logging.info(f"Camera successfully initialized on attempt {attempt}.")
-                break
-            else:
-                logging.warning(
-                    f"Camera initialization failed on attempt {attempt}. Retrying in {retry_delay} second(s)...")
-                time.sleep(retry_delay)
-                cap.release()
-                cap = cv2.VideoCapture(0)
-                cap.set(cv2.CAP_PROP_FRAME_WIDTH, FRAME_WIDTH)
-                cap.set(cv2.CAP_PROP_FRAME_HEIGHT, FRAME_HEIGHT)
-        else:
-            logging.error(f"Failed to initialize camera after {max_retries} attempts. Exiting program.")
-            terminate_program()
+def main():
+    global grabber
 
-        if not cap.isOpened():
-            logging.error("Error: Could not open video stream or file")
-            terminate_program()
+    selected_objects = read_selected_objects_from_file()
 
-        logging.info(f"Starting video capture for '{selected_object}'. Press 'q' to exit.")
+    if not selected_objects:
+        logging.error("No objects to pick. Exiting program.")
+        terminate_program()
+
+    logging.info(f"Proceeding with selected objects: {selected_objects}")
+
+    get_model()
+    get_arduino()
+
+    # The camera stays open for the whole job instead of being reopened per object
+    grabber = open_camera()
+    if grabber is None:
+        logging.error("Exiting program.")
+        terminate_program(1)
+
+    log_startup_report()
+    serve_metrics(METRICS_PORT)
+    viewer = create_viewer()
+
+    try:
+        pick_objects(selected_objects, grabber, display=DISPLAY_MODE == 'window', viewer=viewer)
+    except PickAborted as e:
+        logging.error(str(e))
+        terminate_program(1)
+    finally:
+        if viewer is not None:
+            viewer.close()
 
-        # Reset state variables for the new object
-        state = STATE_ALIGNING
-        step_count = 0
-        previous_distance = None
-        original_distance = None
-        required_distance = 0.0
-
-        # Main loop for the current object
-        while True:
-            if state == STATE_ALIGNING:
-                ret, frame = cap.read()
-
-                if not ret:
-                    logging.warning("Frame capture failed. Retrying...")
-                    time.sleep(retry_delay)
-                    continue
-
-                # Process the frame for alignment and additional classes
-                annotated_frame, detected_objects = process_frame(frame, model, selected_object=selected_object)
-
-                # Display the annotated frame
-                cv2.imshow(f'YOLOv9m Object Detection and Alignment - {selected_object}', annotated_frame)
-
-                # Check if 'q' is pressed to exit
-                if cv2.waitKey(1) & 0xFF == ord('q'):
-                    logging.info("Exiting program as 'q' was pressed.")
-                    terminate_program()
-
-                # Check if alignment is reached for the selected object
-                alignment_achieved = False
-                for obj in detected_objects:
-                    if obj['class_name'].lower() == selected_object_lower:
-                        horizontal_distance = obj['horizontal_distance']
-                        if original_distance is not None:
-                            if abs(horizontal_distance) <= MIN_PIXEL_DISTANCE:
-                                logging.info(
-                                    f"Alignment achieved for {selected_object}: {abs(horizontal_distance):.2f}px <= {MIN_PIXEL_DISTANCE}px")
-                                alignment_achieved = True
-                                break
-                        else:
-                            logging.info("Initial alignment not yet recorded.")
-
-                if alignment_achieved:
-                    # Transition to moving forward state
-                    state = STATE_MOVING_FORWARD
-                    step_count = 0  # Reset step counter
-                    previous_distance = None  # Reset previous distance
-
-            elif state == STATE_MOVING_FORWARD:
-                # Move forward and check distance
-                move_forward_and_check_distance()
-
-            elif state == STATE_CATCHING_CLAW:
-                # Send command to catch the claw
-                catch_claw(selected_object)
-                # After catching the claw, break to proceed to the next object
-                logging.info(f"Completed pickup for '{selected_object}'. Proceeding to the next object.")
-                break
-
-            else:
-                logging.error(f"Unknown state: {state}. Terminating program.")
-                terminate_program()
-
-        # Release the capture and close windows for the current object
-        if cap:
-            cap.release()
-        cv2.destroyAllWindows()
-        logging.info(f"Released camera and closed windows for '{selected_object}'.")
 
+STARTUP_TIMINGS['import'] = time.perf_counter() - _import_started
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,416 @@
+import itertools
+import logging
+import os
+import queue
+import secrets
+import threading
+import time
+from collections import OrderedDict, deque
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Client, Listener
+
+import pipeline
+from frame_bus import BUS_NAME
+from metrics import metrics, serve as serve_metrics
+
+SERVICE_ADDRESS = ('localhost', 6001)
+# The service always reads the camera through the frame bus, so the Streamlit vision path shares it
+SERVICE_FRAME_BUS = pipeline.FRAME_BUS or BUS_NAME
+# Shared secret for service connections: ROBOGPT_SERVICE_AUTHKEY, else a random key the service writes
+# to this owner-only file on first start
+SERVICE_KEY_FILE = os.path.expanduser(os.getenv('ROBOGPT_SERVICE_KEY_FILE', '~/.robogpt_service_key'))
+JOB_LOG_LINES = 500  # Log lines kept per job
+JOB_HISTORY = 50  # Finished jobs kept for status queries
+
+
+class PipelineService:
+    """Keeps the camera, detector and serial channel open and runs pick jobs against them."""
+
+    def __init__(self):
+        self.grabber = None
+        self.viewer = None
+        self._job_lock = threading.Lock()
+        self._camera_lock = threading.Lock()
+        self._started = False
+
+    @property
+    def channel(self):
+        return pipeline.get_arduino()
+
+    def start(self):
+        if not self._started:
+            # Load everything up front so the first job does not pay for it
+            pipeline.get_model()
+            pipeline.get_arduino()
+            if self.open_camera() is None:
+                raise RuntimeError("Camera could not be opened.")
+            pipeline.log_startup_report()
+            serve_metrics(pipeline.METRICS_PORT)
+            # Jobs run headless unless ROBOGPT_DISPLAY asks for the background viewer or MJPEG stream. Jobs run
+            # off the main thread, where an OpenCV window is not safe, so the viewer streams MJPEG instead.
+            mode = pipeline.DISPLAY_MODE
+            if mode == 'viewer':
+                logging.warning("Pick jobs cannot drive an OpenCV window; streaming the view as MJPEG instead.")
+                mode = 'mjpeg'
+            self.viewer = pipeline.create_viewer(mode)
+            self._started = True
+        return self
+
+    def open_camera(self):
+        """Start the capture process and its frame bus on first use; returns the grabber, or None if the camera failed."""
+        with self._camera_lock:
+            if self.grabber is None:
+                self.grabber = pipeline.open_camera(pipeline.open_frame_bus(SERVICE_FRAME_BUS))
+            return self.grabber
+
+    def warm_up(self):
+        """Load the model on a background thread so the first pick job does not wait for it."""
+        threading.Thread(target=pipeline.get_model, name='model-warm-up', daemon=True).start()
+
+    def pick(self, selected_objects, display=False, on_progress=None, reset_abort=True):
+        """Pick the objects in order. Jobs are serialised; the camera and model stay open between them.
+
+        `on_progress(index, total, target)` is called before each object. An abort left over from an
+        earlier cancel or stop is cleared first, unless `reset_abort` is False: the JobRunner clears
+        it itself when the job starts, so a cancel that races with the start is not lost.
+        """
+        with self._job_lock:
+            if reset_abort:
+                pipeline.abort_requested.clear()
+            self.start()
+            picked = []
+            try:
+                selected_objects, plan = pipeline.plan_picks(selected_objects, self.grabber)
+                for idx, target in enumerate(selected_objects, start=1):
+                    if on_progress is not None:
+                        on_progress(idx, len(selected_objects), target)
+                    logging.info(f"=== Starting Process for Object {idx}: '{target}' ===")
+                    pipeline.pick_from_plan(target, plan, self.grabber, display=display, viewer=self.viewer)
+                    picked.append(target)
+            except pipeline.PickAborted as e:
+                logging.error(f"Pick job aborted: {e}")
+                result = {'status': 'failed', 'picked': picked, 'error': str(e)}
+                if isinstance(e, pipeline.TargetNotFound):
+                    result['search'] = e.report
+                return result
+            return {'status': 'ok', 'picked': picked}
+
+    def send_command(self, command, duration):
+        return pipeline.wait_for_command(pipeline.send_command(command, duration))
+
+    def close(self):
+        if self.viewer is not None:
+            self.viewer.close()
+            self.viewer = None
+        if self.grabber is not None:
+            self.grabber.release()
+            self.grabber = None
+        pipeline.close_frame_bus()
+        pipeline.close_resources()
+        self._started = False
+
+
+class Job:
+    """One robot job: a pick list or a list of (command, duration) pairs, plus its status and log."""
+
+    def __init__(self, job_id, kind, payload):
+        self.job_id = job_id
+        self.kind = kind
+        self.payload = payload
+        self.status = 'queued'  # queued, running, done, failed or cancelled
+        self.result = None
+        self.progress = {}
+        self.logs = deque(maxlen=JOB_LOG_LINES)
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.cancel_requested = threading.Event()
+        # A streaming command job keeps waiting for appended commands until it is closed
+        self.open = bool(payload.pop('streaming', False))
+        self.changed = threading.Condition()
+
+    def snapshot(self):
+        progress = dict(self.progress)
+        if self.status == 'running' and self.kind == 'pick':
+            progress['state'] = pipeline.state
+        return {
+            'job_id': self.job_id,
+            'kind': self.kind,
+            'payload': {key: list(value) if isinstance(value, list) else value for key, value in self.payload.items()},
+            'status': self.status,
+            'progress': progress,
+            'result': self.result,
+            'logs': list(self.logs),
+            'created_at': self.created_at,
+            'started_at': self.started_at,
+            'finished_at': self.finished_at,
+        }
+
+
+class _JobLogHandler(logging.Handler):
+    """Copies log records emitted on the job worker thread into the running job's log."""
+
+    def __init__(self, runner):
+        super().__init__()
+        self.runner = runner
+        self.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s', '%H:%M:%S'))
+
+    def emit(self, record):
+        job = self.runner.current
+        if job is not None and record.thread == self.runner.thread_id:
+            job.logs.append(self.format(record))
+
+
+class JobRunner:
+    """Runs robot jobs one at a time on a background thread, so callers such as the Streamlit app
+    never block on the robot. Jobs get ids, and their progress and log can be polled while they run.
+    """
+
+    def __init__(self, service):
+        self.service = service
+        self.current = None
+        self.thread_id = None
+        self._jobs = OrderedDict()
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self._queue = queue.Queue()
+        self._log_handler = _JobLogHandler(self)
+        logging.getLogger().addHandler(self._log_handler)
+        thread = threading.Thread(target=self._run, name='robot-jobs', daemon=True)
+        thread.start()
+        self.thread_id = thread.ident
+
+    def submit(self, kind, **payload):
+        """Queue a 'pick' (objects=[...]) or 'commands' (commands=[(command, duration), ...]) job; returns its id.
+
+        A 'commands' job submitted with streaming=True takes more commands through append() until close().
+        """
+        if kind not in ('pick', 'commands'):
+            raise ValueError(f"Unknown job kind '{kind}'.")
+        if kind == 'commands':
+            payload['commands'] = list(payload.get('commands', []))
+        with self._lock:
+            job = Job(next(self._ids), kind, payload)
+            self._jobs[job.job_id] = job
+            while len(self._jobs) > JOB_HISTORY and next(iter(self._jobs.values())).finished_at is not None:
+                self._jobs.popitem(last=False)
+        self._queue.put(job)
+        return job.job_id
+
+    def get(self, job_id):
+        job = self._jobs.get(job_id)
+        return job.snapshot() if job is not None else None
+
+    def jobs(self):
+        with self._lock:
+            return [job.snapshot() for job in self._jobs.values()]
+
+    def append(self, job_id, commands):
+        """Add (command, duration) pairs to an open streaming job. Returns False once it is closed or finished."""
+        job = self._jobs.get(job_id)
+        if job is None:
+            return False
+        with job.changed:
+            if not job.open or job.finished_at is not None or job.cancel_requested.is_set():
+                return False
+            job.payload['commands'].extend(commands)
+            job.changed.notify_all()
+        return True
+
+    def close(self, job_id):
+        """Tell a streaming job that no more commands are coming; it finishes after the queued ones."""
+        job = self._jobs.get(job_id)
+        if job is not None:
+            with job.changed:
+                job.open = False
+                job.changed.notify_all()
+
+    def cancel(self, job_id):
+        """Cancel a queued job, or stop the robot and abort a running one. Returns False if it already finished."""
+        job = self._jobs.get(job_id)
+        if job is None or job.finished_at is not None:
+            return False
+        # Checked under the lock that _run() holds while it starts a job, so a job is either skipped or aborted
+        with self._lock:
+            job.cancel_requested.set()
+            running = job is self.current
+        if running:
+            pipeline.request_abort()
+        with job.changed:
+            job.changed.notify_all()
+        return True
+
+    def cancel_all(self):
+        return [job_id for job_id in list(self._jobs) if self.cancel(job_id)]
+
+    def _run(self):
+        while True:
+            job = self._queue.get()
+            with self._lock:
+                if job.cancel_requested.is_set():
+                    job.status, job.finished_at = 'cancelled', time.time()
+                    continue
+                pipeline.abort_requested.clear()
+                job.status, job.started_at = 'running', time.time()
+                self.current = job
+            try:
+                job.result = self._execute(job)
+                if job.cancel_requested.is_set():
+                    job.status = 'cancelled'
+                else:
+                    job.status = 'done' if job.result.get('status') == 'ok' else 'failed'
+            except Exception as e:
+                logging.error(f"Job {job.job_id} failed: {e}")
+                job.result, job.status = {'status': 'error', 'error': str(e)}, 'failed'
+            finally:
+                self.current = None
+                job.finished_at = time.time()
+
+    def _execute(self, job):
+        if job.kind == 'pick':
+            def on_progress(index, total, target):
+                job.progress = {'index': index, 'total': total, 'object': target}
+            return self.service.pick(job.payload['objects'], on_progress=on_progress, reset_abort=False)
+
+        completed = []
+        commands = job.payload['commands']
+        index = 0
+        while True:
+            with job.changed:
+                while index >= len(commands) and job.open and not job.cancel_requested.is_set():
+                    job.changed.wait()
+                if job.cancel_requested.is_set() or index >= len(commands):
+                    break
+                command, duration = commands[index]
+                index += 1
+                job.progress = {'index': index, 'total': len(commands), 'command': f"{command} {duration}"}
+            logging.info(f"Sending '{command} {duration}'.")
+            if not self.service.send_command(command, duration):
+                return {'status': 'failed', 'completed': completed, 'error': f"'{command} {duration}' failed."}
+            completed.append(f"{command} {duration}")
+        return {'status': 'ok', 'completed': completed}
+
+
+_service = None
+_service_lock = threading.Lock()
+_job_runner = None
+
+
+def get_service():
+    """Process-wide service instance, created on first use."""
+    global _service
+    with _service_lock:
+        if _service is None:
+            _service = PipelineService()
+        return _service
+
+
+def get_job_runner():
+    """Process-wide job runner for the shared service, created on first use."""
+    global _job_runner
+    service = get_service()
+    with _service_lock:
+        if _job_runner is None:
+            _job_runner = JobRunner(service)
+        return _job_runner
+
+
+def handle_request(service, request):
+    op = request.get('op')
+    if op == 'pick':
+        return service.pick(request['objects'])
+    if op == 'command':
+        ok = service.send_command(request['command'], request.get('duration', 0))
+        return {'status': 'ok' if ok else 'failed'}
+    if op == 'submit':
+        payload = {key: value for key, value in request.items() if key not in ('op', 'kind')}
+        return {'status': 'ok', 'job_id': get_job_runner().submit(request['kind'], **payload)}
+    if op == 'append':
+        ok = get_job_runner().append(request['job_id'], request['commands'])
+        return {'status': 'ok' if ok else 'failed'}
+    if op == 'close':
+        get_job_runner().close(request['job_id'])
+        return {'status': 'ok'}
+    if op == 'job':
+        job = get_job_runner().get(request['job_id'])
+        return {'status': 'ok', 'job': job} if job else {'status': 'error', 'error': "Unknown job."}
+    if op == 'cancel':
+        return {'status': 'ok' if get_job_runner().cancel(request['job_id']) else 'failed'}
+    if op == 'ping':
+        return {'status': 'ok'}
+    if op == 'metrics':
+        return {'status': 'ok', 'metrics': metrics.snapshot()}
+    return {'status': 'error', 'error': f"Unknown op '{op}'."}
+
+
+def _serve_connection(service, conn):
+    with conn:
+        while True:
+            try:
+                request = conn.recv()
+            except EOFError:
+                return
+            try:
+                conn.send(handle_request(service, request))
+            except Exception as e:
+                logging.error(f"Request {request} failed: {e}")
+                conn.send({'status': 'error', 'error': str(e)})
+
+
+def service_authkey(create=False):
+    """The service's connection key. Without one (and without `create`) this raises instead of
+    falling back to a default, since connections carry pickled requests that drive the robot."""
+    key = os.getenv('ROBOGPT_SERVICE_AUTHKEY')
+    if key:
+        return key.encode()
+    try:
+        with open(SERVICE_KEY_FILE, 'rb') as f:
+            key = f.read().strip()
+    except FileNotFoundError:
+        if not create:
+            raise RuntimeError(f"No service key: set ROBOGPT_SERVICE_AUTHKEY or start the service "
+                               f"once to create {SERVICE_KEY_FILE}.")
+        key = secrets.token_hex(32).encode()
+        fd = os.open(SERVICE_KEY_FILE, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+        with os.fdopen(fd, 'wb') as f:
+            f.write(key)
+        logging.info(f"Created service key {SERVICE_KEY_FILE}.")
+    if not key:
+        raise RuntimeError(f"Service key file {SERVICE_KEY_FILE} is empty.")
+    return key
+
+
+def serve(service, address=SERVICE_ADDRESS, authkey=None):
+    """Accept pick jobs and commands from local processes. Each client gets its own thread so that
+    commands such as 'stop' are handled while a pick job runs."""
+    authkey = authkey or service_authkey(create=True)
+    with Listener(address, authkey=authkey) as listener:
+        logging.info(f"Pipeline service listening on {address[0]}:{address[1]}.")
+        while True:
+            try:
+                conn = listener.accept()
+            except (AuthenticationError, EOFError, OSError) as e:
+                logging.warning(f"Rejected a service connection: {e}")
+                continue
+            threading.Thread(target=_serve_connection, args=(service, conn), daemon=True).start()
+
+
+def request(payload, address=SERVICE_ADDRESS, authkey=None):
+    """Send one request to a running service and return its reply."""
+    with Client(address, authkey=authkey or service_authkey()) as conn:
+        conn.send(payload)
+        return conn.recv()
+
+
+def main():
+    service = get_service().start()
+    try:
+        serve(service)
+    except KeyboardInterrupt:
+        logging.info("Pipeline service stopped.")
+    finally:
+        service.close()
+
+
+if __name__ == "__main__":
+    main()
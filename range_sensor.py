@@ -0,0 +1,61 @@
+import logging
+import time
+from collections import namedtuple
+
+from serial_channel import CommandError, CommandTimeout
+
+RANGE_PREFIX = "Distance (mm):"
+OUT_OF_RANGE_REPLY = "Distance: Out of range"
+
+RangeReading = namedtuple('RangeReading', ['timestamp', 'distance_mm'])
+
+
+class RangeSensorError(Exception):
+    pass
+
+
+def parse_range_reply(line):
+    """Return the distance in mm for a firmware range reply, inf when out of range, None if not a range reply."""
+    if line.startswith(RANGE_PREFIX):
+        return float(line[len(RANGE_PREFIX):].strip())
+    if line.startswith(OUT_OF_RANGE_REPLY):
+        return float('inf')
+    return None
+
+
+class RangeSensor:
+    """Long-lived VL53L0X client that shares the pipeline's serial channel."""
+
+    def __init__(self, channel, max_attempts=3):
+        self.channel = channel
+        self.max_attempts = max_attempts
+
+    def read_mm(self):
+        """Request a single measurement and return it in millimetres (inf when out of range)."""
+        for attempt in range(1, self.max_attempts + 1):
+            future = self.channel.send("distance")
+            try:
+                payload = future.result()
+            except CommandTimeout as e:
+                logging.warning(f"Range request timed out on attempt {attempt}/{self.max_attempts}: {e}")
+                continue
+            except CommandError as e:
+                raise RangeSensorError(str(e))
+            distance_mm = parse_range_reply(payload)
+            if distance_mm is not None:
+                return distance_mm
+            logging.warning(f"Unexpected range reply '{payload}' on attempt {attempt}/{self.max_attempts}.")
+        raise RangeSensorError(f"No valid range reply after {self.max_attempts} attempts.")
+
+    def read_cm(self):
+        return self.read_mm() / 10.0
+
+    def stream(self, interval=0.0, max_readings=None):
+        """Yield timestamped readings back to back, sleeping `interval` seconds between requests."""
+        count = 0
+        while max_readings is None or count < max_readings:
+            distance_mm = self.read_mm()
+            yield RangeReading(time.time(), distance_mm)
+            count += 1
+            if interval > 0:
+                time.sleep(interval)
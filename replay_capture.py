@@ -0,0 +1,89 @@
+import glob
+import logging
+import os
+import time
+
+import cv2
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp')
+
+
+class ReplayCapture:
+    """Stands in for cv2.VideoCapture(0) with a recorded video file or a directory of images.
+
+    Frames are paced at `fps` (None replays as fast as they are read) and the recording loops
+    unless `loop` is False, in which case read() returns (False, None) at the end.
+    """
+
+    def __init__(self, source, fps=30.0, loop=True, size=None):
+        self.source = source
+        self.fps = fps
+        self.loop = loop
+        self.size = size
+        self._video = None
+        self._images = []
+        self._index = 0
+        self._next_frame_at = 0.0
+
+        if os.path.isdir(source):
+            self._images = sorted(path for path in glob.glob(os.path.join(source, '*'))
+                                  if path.lower().endswith(IMAGE_EXTENSIONS))
+            if not self._images:
+                logging.error(f"No images found in '{source}'.")
+        else:
+            self._video = cv2.VideoCapture(source)
+            if self.fps is not None and self._video.isOpened():
+                self.fps = self._video.get(cv2.CAP_PROP_FPS) or fps
+
+    def __len__(self):
+        if self._video is not None:
+            return int(self._video.get(cv2.CAP_PROP_FRAME_COUNT))
+        return len(self._images)
+
+    def isOpened(self):
+        if self._video is not None:
+            return self._video.isOpened()
+        return bool(self._images)
+
+    def set(self, prop, value):
+        # Resolution and buffer size come from the recording
+        return False
+
+    def read(self):
+        self._pace()
+        frame = self._read_video() if self._video is not None else self._read_image()
+        if frame is None:
+            return False, None
+        if self.size is not None and (frame.shape[1], frame.shape[0]) != self.size:
+            frame = cv2.resize(frame, self.size)
+        return True, frame
+
+    def release(self):
+        if self._video is not None:
+            self._video.release()
+
+    def _pace(self):
+        if not self.fps:
+            return
+        now = time.monotonic()
+        if now < self._next_frame_at:
+            time.sleep(self._next_frame_at - now)
+        self._next_frame_at = max(now, self._next_frame_at) + 1.0 / self.fps
+
+    def _read_video(self):
+        ret, frame = self._video.read()
+        if not ret and self.loop:
+            self._video.set(cv2.CAP_PROP_POS_FRAMES, 0)
+            ret, frame = self._video.read()
+        return frame if ret else None
+
+    def _read_image(self):
+        if not self._images:
+            return None
+        if self._index >= len(self._images):
+            if not self.loop:
+                return None
+            self._index = 0
+        frame = cv2.imread(self._images[self._index])
+        self._index += 1
+        return frame
@@ -0,0 +1,119 @@
+import itertools
+import math
+from collections import namedtuple
+
+MAX_EXHAUSTIVE_UNITS = 6  # Longer jobs are ordered greedily instead of trying every permutation
+
+# Position in cm in the frame of the robot's pose at scan time: +y is the scan heading, +x its right
+SceneTarget = namedtuple('SceneTarget', ['class_name', 'x', 'y', 'confidence'])
+
+
+def wrap_degrees(angle):
+    return (angle + 180.0) % 360.0 - 180.0
+
+
+def bearing_of(center_x, frame_width, hfov_deg):
+    """Bearing in degrees (positive right) of an image column, for a pinhole camera."""
+    focal = (frame_width / 2) / math.tan(math.radians(hfov_deg) / 2)
+    return math.degrees(math.atan2(center_x - frame_width / 2, focal))
+
+
+def estimate_distance(box, frame_width, hfov_deg, height_cm):
+    """Distance in cm from the box height in pixels and the object's real height."""
+    focal = (frame_width / 2) / math.tan(math.radians(hfov_deg) / 2)
+    return focal * height_cm / max(box[3] - box[1], 1.0)
+
+
+class ScenePlan:
+    """Map of every detected target plus a dead-reckoned robot pose, used to order picks.
+
+    The pose is (x, y, heading in degrees, positive to the right) in the scan frame. It is not
+    measured: after each pick the robot is assumed to stand in front of the target it went to,
+    facing it, which is where the closed-loop approach leaves it.
+    """
+
+    def __init__(self, targets):
+        self.targets = list(targets)
+        self.pose = (0.0, 0.0, 0.0)
+
+    @classmethod
+    def from_detections(cls, detected_objects, frame_width, hfov_deg, heights_cm, default_height_cm=10.0):
+        targets = []
+        for obj in detected_objects:
+            box = obj['box']
+            bearing = math.radians(bearing_of((box[0] + box[2]) / 2, frame_width, hfov_deg))
+            distance = estimate_distance(box, frame_width, hfov_deg,
+                                         heights_cm.get(obj['class_name'].lower(), default_height_cm))
+            targets.append(SceneTarget(obj['class_name'].lower(), distance * math.sin(bearing),
+                                       distance * math.cos(bearing), float(obj.get('confidence', 1.0))))
+        return cls(targets)
+
+    def relative(self, target, pose=None):
+        """(bearing in degrees, distance in cm) of a target as seen from `pose` (default: the current pose)."""
+        x, y, heading = self.pose if pose is None else pose
+        dx, dy = target.x - x, target.y - y
+        return wrap_degrees(math.degrees(math.atan2(dx, dy)) - heading), math.hypot(dx, dy)
+
+    def locate(self, class_name, exclude=()):
+        """The nearest known target of a class from the current pose, or None if it was never seen."""
+        candidates = [target for target in self.targets
+                      if target.class_name == class_name.lower() and target not in exclude]
+        if not candidates:
+            return None
+        return min(candidates, key=lambda target: self.relative(target)[1])
+
+    def arrived(self, target, stop_distance_cm, picked=True):
+        """Move the pose to `stop_distance_cm` in front of the target, facing it; a picked target leaves the map."""
+        bearing, distance = self.relative(target)
+        heading = wrap_degrees(self.pose[2] + bearing)
+        travel = max(distance - stop_distance_cm, 0.0)
+        self.pose = (self.pose[0] + travel * math.sin(math.radians(heading)),
+                     self.pose[1] + travel * math.cos(math.radians(heading)), heading)
+        if picked and target in self.targets:
+            self.targets.remove(target)
+
+    def order(self, selected_objects, placement_classes=(), turn_rate_deg_s=30.0, speed_cm_s=30.0,
+              stop_distances_cm=None):
+        """Reorder a job so the robot turns and travels as little as possible.
+
+        A pick and the placements that follow it in the request stay together as one unit, in order.
+        Units with a target that is not on the map keep their requested order at the end.
+        """
+        stop_distances_cm = stop_distances_cm or {}
+        units = []
+        for name in selected_objects:
+            if units and name.lower() in placement_classes:
+                units[-1].append(name)
+            else:
+                units.append([name])
+        known = [unit for unit in units if all(self.locate(name) is not None for name in unit)]
+        unknown = [unit for unit in units if unit not in known]
+
+        def cost(sequence):
+            pose, claimed, seconds = self.pose, [], 0.0
+            for unit in sequence:
+                for name in unit:
+                    candidates = [target for target in self.targets
+                                  if target.class_name == name.lower() and target not in claimed]
+                    if not candidates:
+                        continue
+                    target = min(candidates, key=lambda target: self.relative(target, pose)[1])
+                    bearing, distance = self.relative(target, pose)
+                    travel = max(distance - stop_distances_cm.get(name.lower(), 0.0), 0.0)
+                    seconds += abs(bearing) / turn_rate_deg_s + travel / speed_cm_s
+                    heading = wrap_degrees(pose[2] + bearing)
+                    pose = (pose[0] + travel * math.sin(math.radians(heading)),
+                            pose[1] + travel * math.cos(math.radians(heading)), heading)
+                    if name.lower() not in placement_classes:
+                        claimed.append(target)
+            return seconds
+
+        if len(known) <= MAX_EXHAUSTIVE_UNITS:
+            best = min(itertools.permutations(known), key=cost, default=())
+        else:
+            best, remaining = [], list(known)
+            while remaining:
+                unit = min(remaining, key=lambda unit: cost(best + [unit]))
+                best.append(unit)
+                remaining.remove(unit)
+        return [name for unit in list(best) + unknown for name in unit]
@@ -0,0 +1,202 @@
+import itertools
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+import serial
+
+# Protocol (see arduino.cpp): the host sends "@<seq> <action> [<duration> [<params>...]]", the firmware
+# answers "ACK <seq>" when it accepts the line, then "DONE <seq> [<payload>]" once the
+# action has finished or "ERR <seq> <message>" if it was rejected. The firmware runs base,
+# claw and arm motions concurrently; a new command on a busy actuator (or "stop") ends the
+# running one early with "DONE <seq> stopped".
+ACK_REPLY = "ACK"
+DONE_REPLY = "DONE"
+ERROR_REPLY = "ERR"
+
+PRIORITY_URGENT = 0
+PRIORITY_NORMAL = 1
+
+
+class CommandError(Exception):
+    pass
+
+
+class CommandTimeout(CommandError):
+    pass
+
+
+class _PendingCommand:
+
+    def __init__(self, seq, action, duration, future, params=()):
+        self.seq = seq
+        self.action = action
+        self.duration = duration
+        self.params = params
+        self.future = future
+        self.acked = threading.Event()
+        self.deadline = None
+
+    @property
+    def line(self):
+        if self.duration is None:
+            return f"@{self.seq} {self.action}\n"
+        fields = ' '.join(str(field) for field in (self.duration, *self.params))
+        return f"@{self.seq} {self.action} {fields}\n"
+
+
+class SerialChannel:
+    """Background reader/writer over one serial connection with acknowledged, sequence-numbered commands."""
+
+    def __init__(self, connection, ack_timeout=0.5, max_retries=3, done_timeout=1.0):
+        self.connection = connection
+        self.ack_timeout = ack_timeout
+        self.max_retries = max_retries
+        self.done_timeout = done_timeout
+
+        self._queue = queue.PriorityQueue()
+        self._order = itertools.count()
+        self._seq = itertools.count(1)
+        self._pending = {}
+        self._pending_lock = threading.Lock()
+        self._listeners = []
+        self._running = threading.Event()
+        self._reader = threading.Thread(target=self._read_loop, name='serial-reader', daemon=True)
+        self._writer = threading.Thread(target=self._write_loop, name='serial-writer', daemon=True)
+
+    @property
+    def is_open(self):
+        return self._running.is_set() and self.connection.is_open
+
+    def start(self):
+        self._running.set()
+        self._reader.start()
+        self._writer.start()
+        return self
+
+    def close(self, close_connection=True):
+        self._running.clear()
+        self._queue.put((PRIORITY_URGENT, next(self._order), None))
+        for thread in (self._reader, self._writer):
+            if thread.is_alive():
+                thread.join(timeout=2)
+        with self._pending_lock:
+            pending = list(self._pending.values())
+            self._pending.clear()
+        for command in pending:
+            if not command.future.done():
+                command.future.set_exception(CommandError("Serial channel closed."))
+        if close_connection and self.connection.is_open:
+            self.connection.close()
+
+    def send(self, action, duration=None, urgent=False, pwm=None, wheels=None):
+        """Queue a command and return a Future that resolves with the firmware's DONE payload.
+
+        `pwm` (0-255) overrides the firmware's default speed for turns; `wheels` is the signed
+        (left, right) PWM pair of a 'drive' command.
+        """
+        params = tuple(wheels) if wheels is not None else (() if pwm is None else (pwm,))
+        future = Future()
+        command = _PendingCommand(next(self._seq), action, duration, future, params)
+        future.seq = command.seq
+        future.command = action if duration is None else f"{action} {duration}"
+        priority = PRIORITY_URGENT if urgent else PRIORITY_NORMAL
+        self._queue.put((priority, next(self._order), command))
+        return future
+
+    def add_listener(self, callback):
+        """Register a callback for serial lines that are not part of the command protocol."""
+        self._listeners.append(callback)
+
+    def _write_loop(self):
+        while self._running.is_set():
+            _, _, command = self._queue.get()
+            if command is None:
+                break
+            with self._pending_lock:
+                self._pending[command.seq] = command
+            self._transmit(command)
+
+    def _transmit(self, command):
+        for attempt in range(1, self.max_retries + 1):
+            try:
+                self.connection.write(command.line.encode())
+                self.connection.flush()
+            except serial.SerialException as e:
+                self._fail(command, CommandError(f"Error sending '{command.future.command}': {e}"))
+                return
+            if command.acked.wait(self.ack_timeout):
+                return
+            logging.warning(f"No ACK for '{command.future.command}' (seq {command.seq}), "
+                            f"attempt {attempt}/{self.max_retries}.")
+        self._fail(command, CommandTimeout(f"Command '{command.future.command}' was never acknowledged."))
+
+    def _read_loop(self):
+        while self._running.is_set():
+            try:
+                line = self.connection.readline().decode('utf-8', errors='ignore').strip()
+            except serial.SerialException as e:
+                logging.error(f"Serial read failed: {e}")
+                break
+            if line:
+                self._handle_line(line)
+            self._expire_overdue()
+
+    def _handle_line(self, line):
+        kind, _, rest = line.partition(' ')
+        if kind in (ACK_REPLY, DONE_REPLY, ERROR_REPLY):
+            seq_text, _, payload = rest.partition(' ')
+            try:
+                seq = int(seq_text)
+            except ValueError:
+                seq = None
+            with self._pending_lock:
+                command = self._pending.get(seq)
+            if command is not None:
+                self._handle_reply(kind, command, payload.strip())
+                return
+        for callback in self._listeners:
+            callback(line)
+        logging.debug(f"Arduino: {line}")
+
+    def _handle_reply(self, kind, command, payload):
+        now = time.monotonic()
+        if kind == ACK_REPLY:
+            if not command.acked.is_set():
+                command.deadline = now + (command.duration or 0) / 1000.0 + self.done_timeout
+                command.acked.set()
+        elif kind == DONE_REPLY:
+            command.acked.set()
+            self._finish(command, payload)
+        else:
+            command.acked.set()
+            self._fail(command, CommandError(f"Arduino rejected '{command.future.command}': {payload}"))
+
+    def _expire_overdue(self):
+        now = time.monotonic()
+        with self._pending_lock:
+            overdue = [c for c in self._pending.values() if c.deadline is not None and now > c.deadline]
+        for command in overdue:
+            self._fail(command, CommandTimeout(f"No completion reported for '{command.future.command}'."))
+
+    def _finish(self, command, payload):
+        with self._pending_lock:
+            self._pending.pop(command.seq, None)
+        if not command.future.done():
+            command.future.set_result(payload)
+
+    def _fail(self, command, error):
+        with self._pending_lock:
+            self._pending.pop(command.seq, None)
+        if not command.future.done():
+            command.future.set_exception(error)
+
+
+def open_channel(port, baudrate, startup_delay=2.0, **kwargs):
+    """Open the serial port, wait for the Arduino to reset and start a channel on it."""
+    connection = serial.Serial(port=port, baudrate=baudrate, timeout=0.1)
+    time.sleep(startup_delay)
+    connection.reset_input_buffer()
+    return SerialChannel(connection, **kwargs).start()
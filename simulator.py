@@ -0,0 +1,530 @@
+import argparse
+import json
+import logging
+import math
+import os
+import threading
+import time
+import tty
+
+import cv2
+import numpy as np
+
+import detector_backends
+import pipeline
+from replay_capture import ReplayCapture
+
+# --- Robot Kinematics (at the PWM values arduino.cpp uses) ---
+FORWARD_SPEED_CM_S = 30.0
+TURN_RATE_DEG_S = 30.0  # At the firmware's default TURN_PWM
+TURN_PWM = 200
+MOTOR_SPINUP_S = 0.035  # The wheels do not move for this long after a pulse starts
+FORWARD_PWM = 180  # Mean wheel PWM of 'forward' (160 right, 200 left)
+# Effective track width for 'drive': skid-steering makes it much wider than the chassis, so it is
+# chosen so that wheels at +/-TURN_PWM turn in place at TURN_RATE_DEG_S
+DRIVE_TRACK_CM = 2 * FORWARD_SPEED_CM_S * TURN_PWM / FORWARD_PWM / math.radians(TURN_RATE_DEG_S)
+
+# --- Camera Model ---
+CAMERA_HFOV_DEG = 70.0
+CAMERA_HEIGHT_CM = 12.0  # Lens height above the floor
+
+# --- VL53L0X Model ---
+RANGE_HALF_ANGLE_DEG = 12.5
+RANGE_MAX_MM = 2000
+GRASP_DISTANCE_CM = 20.0  # A 'catch' only picks up a target this close in front of the claw
+
+# BGR colours the simulated camera paints targets with and the 'sim' detector looks for
+MARKER_COLORS = {
+    'bottle': (0, 0, 255),
+    'box': (255, 0, 0),
+    'cup': (0, 255, 0),
+    'horn': (0, 255, 255),
+    'small_bottle': (255, 0, 255),
+}
+MARKER_TOLERANCE = 40
+MIN_MARKER_AREA = 16
+
+# Target footprint width and height in cm
+TARGET_SIZES = {
+    'bottle': (7.0, 22.0),
+    'box': (25.0, 15.0),
+    'cup': (8.0, 10.0),
+    'horn': (15.0, 12.0),
+    'small_bottle': (5.0, 12.0),
+}
+
+# Pipeline settings run_simulation overrides and restores afterwards
+SIMULATED_SETTINGS = ('SERIAL_PORT', 'SERIAL_STARTUP_DELAY', 'DETECTOR_BACKEND', 'MOVEMENT_INTERVAL', 'CONTROL_CLOCK',
+                      'ROBOT_ID', 'process_frame')
+SIM_ROBOT_ID = 'simulator'  # Keeps simulated moves out of the real robot's motion calibration
+DEFAULT_TIMEOUT_S = 600.0  # Simulated seconds before a pick that never converges is aborted
+
+DEFAULT_SCENE = [
+    {'class_name': 'bottle', 'bearing_deg': 20, 'distance_cm': 120},
+    {'class_name': 'box', 'bearing_deg': -35, 'distance_cm': 150},
+    {'class_name': 'cup', 'bearing_deg': 45, 'distance_cm': 90},
+]
+
+
+class SimClock:
+    """Simulated seconds since start; runs `time_scale` times faster than the wall clock."""
+
+    def __init__(self, time_scale=1.0):
+        self.time_scale = time_scale
+        self._started = time.monotonic()
+
+    def now(self):
+        return (time.monotonic() - self._started) * self.time_scale
+
+
+class SimTarget:
+
+    def __init__(self, class_name, x, y):
+        self.class_name = class_name
+        self.x = x
+        self.y = y
+        self.width, self.height = TARGET_SIZES.get(class_name, (10.0, 10.0))
+
+
+class WorldModel:
+    """Planar robot pose plus target positions, in cm. Heading 0 faces +y; positive headings turn right."""
+
+    def __init__(self, targets, clock):
+        self.targets = list(targets)
+        self.clock = clock
+        self.x = 0.0
+        self.y = 0.0
+        self.heading = 0.0
+        self.held = None
+        self._speed = 0.0
+        self._turn_rate = 0.0
+        self._motion_from = 0.0
+        self._motion_until = 0.0
+        self._updated_at = clock.now()
+        self._lock = threading.RLock()
+
+    @classmethod
+    def from_scene(cls, scene, clock):
+        targets = []
+        for entry in scene:
+            bearing = math.radians(entry['bearing_deg'])
+            targets.append(SimTarget(entry['class_name'],
+                                     entry['distance_cm'] * math.sin(bearing),
+                                     entry['distance_cm'] * math.cos(bearing)))
+        return cls(targets, clock)
+
+    def set_base_motion(self, speed, turn_rate, duration_s):
+        with self._lock:
+            self._advance()
+            self._speed = speed
+            self._turn_rate = turn_rate
+            self._motion_from = self.clock.now() + MOTOR_SPINUP_S
+            self._motion_until = self.clock.now() + duration_s
+
+    def stop_base(self):
+        with self._lock:
+            self._advance()
+            self._speed = 0.0
+            self._turn_rate = 0.0
+
+    def pose(self):
+        with self._lock:
+            self._advance()
+            return self.x, self.y, self.heading
+
+    def relative(self, target):
+        """(forward, lateral) offset of a target from the robot; lateral is positive to the right."""
+        dx = target.x - self.x
+        dy = target.y - self.y
+        forward = dx * math.sin(self.heading) + dy * math.cos(self.heading)
+        lateral = dx * math.cos(self.heading) - dy * math.sin(self.heading)
+        return forward, lateral
+
+    def project(self, width, height):
+        """Image-space [x1, y1, x2, y2] boxes of the targets the camera can see."""
+        focal = (width / 2) / math.tan(math.radians(CAMERA_HFOV_DEG) / 2)
+        boxes = []
+        with self._lock:
+            self._advance()
+            for target in self.targets:
+                forward, lateral = self.relative(target)
+                if forward <= 1.0:
+                    continue
+                center_x = width / 2 + focal * lateral / forward
+                half_width = focal * target.width / forward / 2
+                bottom = height / 2 + focal * CAMERA_HEIGHT_CM / forward
+                top = bottom - focal * target.height / forward
+                if center_x + half_width < 0 or center_x - half_width > width:
+                    continue
+                boxes.append((target.class_name, (center_x - half_width, top, center_x + half_width, bottom)))
+        return boxes
+
+    def range_mm(self):
+        """Distance the VL53L0X would report, or None when nothing is inside its cone and range."""
+        with self._lock:
+            target, distance_cm = self._target_in_front()
+        if target is None or distance_cm * 10 > RANGE_MAX_MM:
+            return None
+        return max(0, int(distance_cm * 10))
+
+    def grasp(self):
+        with self._lock:
+            target, distance_cm = self._target_in_front()
+            if self.held is None and target is not None and distance_cm <= GRASP_DISTANCE_CM:
+                self.targets.remove(target)
+                self.held = target
+                logging.info(f"[sim] Grasped '{target.class_name}'.")
+
+    def release(self):
+        with self._lock:
+            if self.held is not None:
+                logging.info(f"[sim] Released '{self.held.class_name}'.")
+                self.held = None
+
+    def _target_in_front(self):
+        self._advance()
+        best, best_distance = None, None
+        for target in self.targets:
+            forward, lateral = self.relative(target)
+            if forward <= 0 or abs(math.degrees(math.atan2(lateral, forward))) > RANGE_HALF_ANGLE_DEG:
+                continue
+            distance = math.hypot(forward, lateral) - target.width / 2
+            if best is None or distance < best_distance:
+                best, best_distance = target, distance
+        return best, best_distance
+
+    def _advance(self):
+        now = self.clock.now()
+        until = min(now, self._motion_until)
+        dt = until - max(self._updated_at, self._motion_from)
+        if dt > 0 and (self._speed or self._turn_rate):
+            if self._turn_rate == 0:
+                self.x += self._speed * dt * math.sin(self.heading)
+                self.y += self._speed * dt * math.cos(self.heading)
+            else:
+                new_heading = self.heading + self._turn_rate * dt
+                radius = self._speed / self._turn_rate
+                self.x += radius * (math.cos(self.heading) - math.cos(new_heading))
+                self.y += radius * (math.sin(new_heading) - math.sin(self.heading))
+                self.heading = new_heading
+        if now >= self._motion_until:
+            self._speed = 0.0
+            self._turn_rate = 0.0
+        self._updated_at = now
+
+
+class VirtualArduino:
+    """Emulates the arduino.cpp protocol on a pseudo-terminal so the real serial code path can talk to it."""
+
+    ACTUATORS = {
+        'forward': 'base', 'backward': 'base', 'left': 'base', 'right': 'base', 'drive': 'base',
+        'catch': 'claw', 'release': 'claw',
+        'up': 'arm', 'down': 'arm',
+    }
+
+    def __init__(self, world, clock):
+        self.world = world
+        self.clock = clock
+        self._master, self._slave = os.openpty()
+        tty.setraw(self._slave)
+        self.port = os.ttyname(self._slave)
+        self.received = []
+        self._active = {}
+        self._last_seq = None
+        self._write_lock = threading.Lock()
+        self._state_lock = threading.Lock()
+        self._running = threading.Event()
+
+    def start(self):
+        self._running.set()
+        threading.Thread(target=self._read_loop, name='virtual-arduino-reader', daemon=True).start()
+        threading.Thread(target=self._schedule_loop, name='virtual-arduino-scheduler', daemon=True).start()
+        self._write("VL53L0X initialized")
+        return self
+
+    def close(self):
+        self._running.clear()
+        for fd in (self._master, self._slave):
+            try:
+                os.close(fd)
+            except OSError:
+                pass
+
+    def _write(self, line):
+        with self._write_lock:
+            try:
+                os.write(self._master, (line + "\n").encode())
+            except OSError:
+                pass
+
+    def _read_loop(self):
+        buffer = b""
+        while self._running.is_set():
+            try:
+                chunk = os.read(self._master, 256)
+            except OSError:
+                return
+            buffer += chunk
+            while b"\n" in buffer:
+                line, buffer = buffer.split(b"\n", 1)
+                line = line.decode('utf-8', errors='ignore').strip()
+                if line:
+                    self._handle(line)
+
+    def _handle(self, command):
+        self.received.append((self.clock.now(), command))
+        seq = None
+        if command.startswith("@"):
+            seq_text, _, command = command.partition(' ')
+            seq = int(seq_text[1:])
+            if seq == self._last_seq:
+                self._write(f"ACK {seq}")
+                return
+            self._last_seq = seq
+            self._write(f"ACK {seq}")
+
+        action, _, duration_text = command.strip().partition(' ')
+        if not duration_text:
+            if action.lower() == "distance":
+                distance_mm = self.world.range_mm()
+                reading = "Distance: Out of range" if distance_mm is None else f"Distance (mm): {distance_mm}"
+                self._reply_done(seq, reading, legacy=reading)
+            else:
+                self._reply_error(seq, "Invalid command format.")
+            return
+
+        fields = [int(field) if field.lstrip('-').isdigit() else 0 for field in duration_text.split()]
+        duration_ms = fields[0]
+        pwm = min(max(fields[1], 0), 255) if len(fields) > 1 else TURN_PWM
+        if action == "drive" and len(fields) < 3:
+            self._reply_error(seq, "drive needs <duration> <left pwm> <right pwm>.")
+        elif action == "drive":
+            self._start(action, duration_ms, seq, wheels=fields[1:3])
+        elif action == "stop":
+            with self._state_lock:
+                for actuator in list(self._active):
+                    self._finish(actuator, "stopped")
+            self._reply_done(seq, "")
+        elif action in self.ACTUATORS:
+            self._start(action, duration_ms, seq, pwm)
+        else:
+            self._reply_error(seq, "Unknown command received.")
+
+    def _start(self, action, duration_ms, seq, pwm=TURN_PWM, wheels=None):
+        actuator = self.ACTUATORS[action]
+        duration_s = duration_ms / 1000.0
+        with self._state_lock:
+            if actuator in self._active:
+                previous_seq, _ = self._active.pop(actuator)
+                self._reply_done(previous_seq, "stopped")
+            self._active[actuator] = (seq, self.clock.now() + duration_s)
+
+        turn_rate = math.radians(TURN_RATE_DEG_S) * pwm / TURN_PWM
+        if action == 'forward':
+            self.world.set_base_motion(FORWARD_SPEED_CM_S, 0.0, duration_s)
+        elif action == 'backward':
+            self.world.set_base_motion(-FORWARD_SPEED_CM_S, 0.0, duration_s)
+        elif action == 'left':
+            self.world.set_base_motion(0.0, -turn_rate, duration_s)
+        elif action == 'right':
+            self.world.set_base_motion(0.0, turn_rate, duration_s)
+        elif action == 'drive':
+            left, right = (FORWARD_SPEED_CM_S * min(max(pwm, -255), 255) / FORWARD_PWM for pwm in wheels)
+            self.world.set_base_motion((left + right) / 2, (left - right) / DRIVE_TRACK_CM, duration_s)
+        elif action == 'catch':
+            self.world.grasp()
+        elif action == 'release':
+            self.world.release()
+
+    def _finish(self, actuator, payload):
+        seq, _ = self._active.pop(actuator)
+        if actuator == 'base':
+            self.world.stop_base()
+        self._reply_done(seq, payload)
+
+    def _schedule_loop(self):
+        while self._running.is_set():
+            now = self.clock.now()
+            with self._state_lock:
+                for actuator, (_, ends_at) in list(self._active.items()):
+                    if now >= ends_at:
+                        self._finish(actuator, "")
+            time.sleep(0.001)
+
+    def _reply_done(self, seq, payload, legacy=None):
+        if seq is None:
+            if legacy:
+                self._write(legacy)
+            return
+        self._write(f"DONE {seq} {payload}".rstrip())
+
+    def _reply_error(self, seq, message):
+        if seq is None:
+            self._write(f"Error: {message}")
+        else:
+            self._write(f"ERR {seq} {message}")
+
+
+class SimulatedCamera:
+    """cv2.VideoCapture stand-in that paints the world's targets as colour markers over a background."""
+
+    def __init__(self, world, size=(1920, 1080), fps=30.0, background=None):
+        self.world = world
+        self.size = size
+        self.fps = fps
+        self.background = background
+        self._blank = np.full((size[1], size[0], 3), 60, dtype=np.uint8)
+        self._next_frame_at = 0.0
+
+    def isOpened(self):
+        return True
+
+    def set(self, prop, value):
+        return False
+
+    def read(self):
+        now = time.monotonic()
+        if now < self._next_frame_at:
+            time.sleep(self._next_frame_at - now)
+        self._next_frame_at = max(now, self._next_frame_at) + 1.0 / self.fps
+
+        frame = None
+        if self.background is not None:
+            ok, frame = self.background.read()
+            if ok and (frame.shape[1], frame.shape[0]) != self.size:
+                frame = cv2.resize(frame, self.size)
+        if frame is None:
+            frame = self._blank.copy()
+
+        for class_name, (x1, y1, x2, y2) in self.world.project(*self.size):
+            color = MARKER_COLORS.get(class_name, (255, 255, 255))
+            cv2.rectangle(frame, (int(x1), int(y1)), (int(x2), int(y2)), color, -1)
+        return True, frame
+
+    def release(self):
+        if self.background is not None:
+            self.background.release()
+
+
+class ColorMarkerBackend(detector_backends.DetectorBackend):
+    """Detector for simulated frames: finds the solid marker colours instead of running a network."""
+
+    name = 'sim'
+
+    def __init__(self, weights=None, imgsz=640, conf=0.5, iou=0.7, threads=None, precision=None):
+        super().__init__(weights, imgsz, conf, iou)
+        self.markers = [(pipeline.CLASS_NAMES.index(name), np.array(color))
+                        for name, color in MARKER_COLORS.items() if name in pipeline.CLASS_NAMES]
+
+    def predict(self, canvases):
+        outputs = []
+        for canvas in canvases:
+            class_ids, boxes = [], []
+            for class_id, color in self.markers:
+                mask = cv2.inRange(canvas, np.clip(color - MARKER_TOLERANCE, 0, 255),
+                                   np.clip(color + MARKER_TOLERANCE, 0, 255))
+                contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+                for contour in contours:
+                    x, y, w, h = cv2.boundingRect(contour)
+                    if w * h >= MIN_MARKER_AREA:
+                        class_ids.append(class_id)
+                        boxes.append((x, y, x + w, y + h))
+            outputs.append((np.array(class_ids, dtype=np.int32),
+                            np.full(len(class_ids), 0.99, dtype=np.float32),
+                            np.array(boxes, dtype=np.float32).reshape(-1, 4)))
+        return outputs
+
+    def describe(self):
+        return f"{self.name} colour markers ({self.imgsz}px)"
+
+
+detector_backends.BACKENDS['sim'] = ColorMarkerBackend
+
+
+def run_simulation(selected_objects, scene=DEFAULT_SCENE, time_scale=10.0, background=None, fps=30.0,
+                   timeout=DEFAULT_TIMEOUT_S):
+    """Run the real pick pipeline against the virtual Arduino and simulated camera."""
+    clock = SimClock(time_scale)
+    world = WorldModel.from_scene(scene, clock)
+    arduino = VirtualArduino(world, clock).start()
+
+    # Point the pipeline at the simulated hardware and compress its wall-clock waits
+    saved = {name: getattr(pipeline, name) for name in SIMULATED_SETTINGS}
+    pipeline.close_resources(release_model=True)
+    pipeline.SERIAL_PORT = arduino.port
+    pipeline.SERIAL_STARTUP_DELAY = 0.0
+    pipeline.DETECTOR_BACKEND = 'sim'
+    pipeline.MOVEMENT_INTERVAL = pipeline.MOVEMENT_INTERVAL / time_scale
+    pipeline.CONTROL_CLOCK = clock.now
+    pipeline.ROBOT_ID = SIM_ROBOT_ID
+
+    process_frame = pipeline.process_frame
+
+    def bounded_process_frame(*args, **kwargs):
+        if clock.now() > timeout:
+            raise pipeline.PickAborted(f"Simulation timed out after {timeout:.0f} simulated seconds.")
+        return process_frame(*args, **kwargs)
+    pipeline.process_frame = bounded_process_frame
+
+    camera = SimulatedCamera(world, size=(pipeline.FRAME_WIDTH, pipeline.FRAME_HEIGHT), fps=fps,
+                             background=ReplayCapture(background) if background else None)
+    grabber = pipeline.open_camera(camera)
+
+    started = time.monotonic()
+    result = {'objects': selected_objects, 'status': 'ok', 'error': None}
+    try:
+        pipeline.pick_objects(selected_objects, grabber, display=False)
+    except pipeline.PickAborted as e:
+        result.update(status='failed', error=str(e))
+        if isinstance(e, pipeline.TargetNotFound):
+            result['search'] = e.report
+    finally:
+        grabber.release()
+        pipeline.close_resources(release_model=True)
+        arduino.close()
+        for name, value in saved.items():
+            setattr(pipeline, name, value)
+
+    result.update(
+        real_seconds=round(time.monotonic() - started, 3),
+        sim_seconds=round(clock.now(), 3),
+        commands=len(arduino.received),
+        remaining_targets=[target.class_name for target in world.targets],
+    )
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the pick pipeline against a simulated robot.")
+    parser.add_argument('objects', nargs='*', default=['bottle'], help="Objects to pick, in order.")
+    parser.add_argument('--scene', help="JSON list of {class_name, bearing_deg, distance_cm} targets.")
+    parser.add_argument('--time-scale', type=float, default=10.0, help="Simulated seconds per wall-clock second.")
+    parser.add_argument('--timeout', type=float, default=DEFAULT_TIMEOUT_S,
+                        help="Simulated seconds before a pick that never converges is aborted.")
+    parser.add_argument('--background', help="Video file or image directory drawn behind the targets.")
+    parser.add_argument('--serve', action='store_true',
+                        help="Only start the virtual Arduino and print its port (set ROBOGPT_SERIAL_PORT to it).")
+    args = parser.parse_args()
+
+    scene = DEFAULT_SCENE
+    if args.scene:
+        with open(args.scene) as f:
+            scene = json.load(f)
+
+    if args.serve:
+        clock = SimClock(args.time_scale)
+        arduino = VirtualArduino(WorldModel.from_scene(scene, clock), clock).start()
+        print(arduino.port, flush=True)
+        try:
+            while True:
+                time.sleep(1)
+        except KeyboardInterrupt:
+            arduino.close()
+        return
+
+    print(json.dumps(run_simulation(args.objects, scene, args.time_scale, args.background,
+                                    timeout=args.timeout), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,24 +1,77 @@
 
 import streamlit as st
 import openai
-import serial
 import time
 import os
-import base64
 import re
 import cv2
-import subprocess
 import sys
 import logging
 import json
 from dotenv import load_dotenv
+from pipeline_service import SERVICE_FRAME_BUS, get_job_runner, get_service
+from llm_cache import LLMCache, cache_key
+from command_stream import CommandExecutor, CommandStreamParser
+from frame_bus import FrameBus
+from vision_image import VisionEncoder, crop_box, vision_settings
+import pipeline
 
-load_dotenv()
-OPENAI_API_KEY = os.getenv('OPENAI_API_KEY') or st.secrets.get("OPENAI_API_KEY")
-if not OPENAI_API_KEY:
+@st.cache_resource
+def load_openai_api_key():
+    """Read the key once per server instead of on every script rerun.
+
+    A missing key raises KeyError, which st.cache_resource does not cache, so the next rerun looks again.
+    """
+    load_dotenv()
+    key = os.getenv('OPENAI_API_KEY') or st.secrets.get("OPENAI_API_KEY")
+    if not key:
+        raise KeyError('OPENAI_API_KEY')
+    return key
+
+
+@st.cache_resource
+def get_llm_cache():
+    """One completion cache per server, so sessions share hits and identical in-flight requests."""
+    return LLMCache()
+
+
+@st.cache_resource
+def get_vision_encoder():
+    """Shared by all sessions, so its resize buffers are allocated once per image size."""
+    return VisionEncoder()
+
+
+@st.cache_resource
+def get_pipeline_service():
+    """One pipeline service per Streamlit server. The model loads in the background so the UI comes up at once."""
+    service = get_service()
+    service.warm_up()
+    return service
+
+
+@st.cache_resource
+def get_robot_jobs():
+    """Background runner for pick and command jobs, shared by all sessions of the server."""
+    get_pipeline_service()
+    return get_job_runner()
+
+
+# Reruns the job panel on its own timer; older Streamlit versions only refresh it on interaction
+fragment = getattr(st, 'fragment', None) or getattr(st, 'experimental_fragment', None) \
+    or (lambda run_every=None: lambda function: function)
+JOB_REFRESH_S = 1.0
+JOB_LOG_TAIL = 15
+VISION_FRAME_MAX_AGE_S = 1.0  # Older bus frames mean the capture process has stopped
+
+
+try:
+    OPENAI_API_KEY = load_openai_api_key()
+except KeyError:
     st.error("OpenAI API key not found. Please set the OPENAI_API_KEY environment variable or add it to Streamlit secrets.")
     st.stop()
 openai.api_key = OPENAI_API_KEY
+# Point at a compatible server, e.g. `python llm_stub.py` for local runs without the API
+openai.api_base = os.getenv('OPENAI_API_BASE', openai.api_base)
 
 arduino_port = '/dev/cu.usbserial-1130'  
 baud_rate = 9600
@@ -51,6 +104,12 @@ for class_name, synonyms in SYNONYMS.items():
     for synonym in synonyms:
         SYNONYM_MAP[synonym.lower()] = class_name
 
+# Every name an object can be called by, longest first so 'mini bottle' is not also read as 'bottle'
+OBJECT_NAMES = {**{name: name for name in CLASS_NAMES},
+                **{name.replace('_', ' '): name for name in CLASS_NAMES}, **SYNONYM_MAP}
+OBJECT_PATTERN = re.compile(
+    r'\b(' + '|'.join(re.escape(name) for name in sorted(OBJECT_NAMES, key=len, reverse=True)) + r')(?:e?s)?\b')
+
 def main():
     st.title("🤖 RoboGPT")
 
@@ -58,15 +117,13 @@ def main():
     if 'conversation_history' not in st.session_state:
         st.session_state.conversation_history = []
 
-    if 'arduino' not in st.session_state:
-        try:
-            # Initialize serial connection
-            st.session_state.arduino = serial.Serial(arduino_port, baud_rate, timeout=1)
-            time.sleep(2)  # Wait for connection to initialize
-            st.success(f"Connected to Arduino on {arduino_port}")
-        except serial.SerialException as e:
-            st.error(f"Error connecting to Arduino: {e}")
-            st.stop()
+    # The resident pipeline service owns the serial port, camera and model for the life of the app
+    if get_pipeline_service().channel is None:
+        st.error(f"Error connecting to Arduino on {arduino_port}")
+        st.stop()
+    if 'arduino_connected' not in st.session_state:
+        st.session_state.arduino_connected = True
+        st.success(f"Connected to Arduino on {arduino_port}")
 
     if 'pick_and_place_active' not in st.session_state:
         st.session_state.pick_and_place_active = False
@@ -77,24 +134,24 @@ def main():
     if user_input:
         st.session_state.conversation_history.append({"role": "user", "content": user_input})
 
+        # Motion commands in streamed replies are already running; only the rest comes back here
         interpreted_commands = interpret_command_with_gpt4(user_input)
 
-        if interpreted_commands:
-            for cmd in interpreted_commands:
-                if cmd == "RUN_PICK_AND_PLACE":
-                    run_pick_and_place()
-                    st.session_state.pick_and_place_active = False
-                else:
-                    try:
-                        command, duration = cmd.split()
-                        send_command_to_arduino(command, int(duration))
-                    except ValueError:
-                        st.error("Error parsing the interpreted command.")
-        else:
-            st.write("No command executed; only conversational reply provided.")
+        for cmd in interpreted_commands:
+            if cmd == "RUN_PICK_AND_PLACE":
+                run_pick_and_place(st.session_state.selected_objects)
+                st.session_state.pick_and_place_active = False
+            else:
+                try:
+                    command, duration = cmd.split()
+                    send_command_to_arduino(command, int(duration))
+                except ValueError:
+                    st.error("Error parsing the interpreted command.")
 
         display_conversation()
 
+    show_jobs()
+
 def display_conversation():
     for message in st.session_state.conversation_history:
         if message['role'] == 'user':
@@ -104,20 +161,50 @@ def display_conversation():
             with st.chat_message("assistant"):
                 st.markdown(message['content'])
 
-def capture_and_resize_image(filename="surroundings.jpg", size=(720, 720), max_retries=5):
-    """Capture an image using the default camera, retrying up to max_retries times if capture fails."""
+def read_frame_bus(prepare, max_age_s=VISION_FRAME_MAX_AGE_S):
+    """prepare(frame) of the newest frame on the service's frame bus, or None if no capture process is publishing."""
+    bus = FrameBus.attach(SERVICE_FRAME_BUS)
+    if bus is None:
+        return None
+    try:
+        for _ in range(3):
+            ret, captured = bus.read(timeout=max_age_s, after_time=time.monotonic() - max_age_s)
+            if not ret:
+                logging.warning("Frame bus has no recent frame; is its capture process running?")
+                return None
+            # prepare() reads straight from shared memory; retry if the slot was reused meanwhile
+            result = prepare(captured.image)
+            if bus.valid(captured):
+                return result
+        return None
+    finally:
+        captured = None
+        bus.close()
+
+def capture_image(prepare, max_retries=5):
+    """Return prepare(frame) for a fresh frame from the service's frame bus, starting its capture process if needed.
+
+    The default camera is only opened here when the service could not open it.
+    """
+    grabber = get_pipeline_service().open_camera()
+    result = read_frame_bus(prepare)
+    if result is not None:
+        return result
+    if grabber is not None:
+        # The bus is gone but the service still holds the camera; never open it a second time
+        ret, captured = grabber.read(after_time=time.monotonic())
+        return prepare(captured.image.copy()) if ret else None
+
     cap = cv2.VideoCapture(0)
     time.sleep(2)  
 
     retry_count = 0
-    success = False
+    result = None
     while retry_count < max_retries:
         ret, frame = cap.read()
         if ret:
-            resized_frame = cv2.resize(frame, size)
-            cv2.imwrite(filename, resized_frame)
-            print(f"Image captured, resized to {size}, and saved as {filename}")
-            success = True
+            result = prepare(frame)
+            print("Image captured")
             break
         else:
             print(f"Retrying to capture image... Attempt {retry_count + 1}")
@@ -125,90 +212,196 @@ def capture_and_resize_image(filename="surroundings.jpg", size=(720, 720), max_r
             time.sleep(0.5)  
 
     cap.release()
-    return filename if success else None
-
-def encode_image(image_path):
-    """Encode an image to a Base64 string."""
-    with open(image_path, "rb") as image_file:
-        return base64.b64encode(image_file.read()).decode("utf-8")
-
-def send_image_to_gpt(user_instruction, image_path):
-    """Send an image to GPT-4 Mini Vision along with the user instruction."""
-    base64_image = encode_image(image_path)
-    response = openai.ChatCompletion.create(
-        model="gpt-4o-mini",
-        messages=[
-            {
-                "role": "system",
-                "content": (
-                    "You are a robotic assistant with vision capabilities. When an image is provided, analyze it based on the user's specific instructions. "
-                    "If the user requests an action based on detecting certain objects (e.g., a bottle or human), interpret the image accordingly. "
-                    "If the requested object is detected, respond by confirming the action and providing the commands within 'BEGIN COMMANDS' and 'END COMMANDS' tags.\n\n"
-                    "The robot supports the following commands:\n"
-                    "- 'forward <duration>': Move the robot forward for a specified duration in milliseconds.\n"
-                    "- 'backward <duration>': Move the robot backward for a specified duration in milliseconds.\n"
-                    "- 'left <duration>': Turn the robot to the left for a specified duration in milliseconds.\n"
-                    "- 'right <duration>': Turn the robot to the right for a specified duration in milliseconds.\n"
-                    "- 'up <duration>': Move the robot's arm up for a specified duration in milliseconds.\n"
-                    "- 'down <duration>': Move the robot's arm down for a specified duration in milliseconds.\n"
-                    "- 'catch <duration>': Close the claw to catch an object.\n"
-                    "- 'release <duration>': Open the claw to release an object.\n\n"
-                    "If the object requested by the user is present in the image, include the appropriate command sequence within 'BEGIN COMMANDS' and 'END COMMANDS'."
-                )
-            },
-            {
-                "role": "user",
-                "content": [
-                    {"type": "text", "text": user_instruction},
-                    {
-                        "type": "image_url",
-                        "image_url": {"url": f"data:image/jpeg;base64,{base64_image}"}
-                    }
-                ]
-            }
-        ]
-    )
+    return result
+
+def capture_vision_image(instruction):
+    """Capture a frame for a vision request and return (base64 JPEG, detail level), or None if capture failed.
+
+    The image is sized for the request, and cropped to the objects it names when the detector finds them.
+    """
+    settings = vision_settings(instruction)
+    encoder = get_vision_encoder()
+    targets = parse_objects_locally(instruction)
+    if not targets:
+        # Encoded straight from the bus frame, without copying it first
+        base64_image = capture_image(lambda frame: encoder.encode(frame, settings))
+    else:
+        frame = capture_image(lambda frame: frame.copy())
+        if frame is None:
+            return None
+        box = crop_box(pipeline.detect_objects(frame, pipeline.get_model()), targets, frame.shape)
+        if box is not None:
+            logging.info(f"Cropping the vision image to {targets} at {box}.")
+        base64_image = encoder.encode(frame, settings, box)
+    if base64_image is None:
+        return None
+    return base64_image, settings.detail
+
+def send_image_to_gpt(user_instruction, base64_image, detail="auto"):
+    """Send a base64 JPEG to GPT-4 Mini Vision along with the user instruction."""
+    messages = [
+        {
+            "role": "system",
+            "content": (
+                "You are a robotic assistant with vision capabilities. When an image is provided, analyze it based on the user's specific instructions. "
+                "If the user requests an action based on detecting certain objects (e.g., a bottle or human), interpret the image accordingly. "
+                "If the requested object is detected, respond by confirming the action and providing the commands within 'BEGIN COMMANDS' and 'END COMMANDS' tags.\n\n"
+                "The robot supports the following commands:\n"
+                "- 'forward <duration>': Move the robot forward for a specified duration in milliseconds.\n"
+                "- 'backward <duration>': Move the robot backward for a specified duration in milliseconds.\n"
+                "- 'left <duration>': Turn the robot to the left for a specified duration in milliseconds.\n"
+                "- 'right <duration>': Turn the robot to the right for a specified duration in milliseconds.\n"
+                "- 'up <duration>': Move the robot's arm up for a specified duration in milliseconds.\n"
+                "- 'down <duration>': Move the robot's arm down for a specified duration in milliseconds.\n"
+                "- 'catch <duration>': Close the claw to catch an object.\n"
+                "- 'release <duration>': Open the claw to release an object.\n\n"
+                "If the object requested by the user is present in the image, include the appropriate command sequence within 'BEGIN COMMANDS' and 'END COMMANDS'."
+            )
+        },
+        {
+            "role": "user",
+            "content": [
+                {"type": "text", "text": user_instruction},
+                {
+                    "type": "image_url",
+                    "image_url": {"url": f"data:image/jpeg;base64,{base64_image}", "detail": detail}
+                }
+            ]
+        }
+    ]
 
-    llm_output = response['choices'][0]['message']['content'].strip()
+    llm_output, remaining_commands, found_commands = stream_reply_and_execute("gpt-4o-mini", messages)
 
     st.session_state.conversation_history.append({"role": "assistant", "content": llm_output})
 
-    if "BEGIN COMMANDS" in llm_output and "END COMMANDS" in llm_output:
-        try:
-            command_block = re.search(r"BEGIN COMMANDS\s+(.*?)\s+END COMMANDS", llm_output, re.DOTALL).group(1)
-            return [line.strip() for line in command_block.splitlines() if line.strip()]
-        except (IndexError, AttributeError):
-            st.error("Error: Could not parse commands from GPT response.")
-            return []
-    else:
+    if not found_commands:
         st.write("No actionable commands detected; description only.")
-        return []
+    return remaining_commands
 
-def send_command_to_arduino(command, duration=500):
-    full_command = f"{command} {duration}\n"
-    st.session_state.arduino.write(full_command.encode())
-    st.write(f"Sent to Arduino: {full_command.strip()}")
-    time.sleep(duration / 900)
+def stream_chat_completion(model, messages, on_text, **params):
+    """Stream a completion, calling on_text(chunk) as text arrives.
 
-def run_pick_and_place():
-    logging.info(f"=== Starting Pick and Place Process ===")
+    A cached reply, or one another session is streaming for an identical request, is replayed as one chunk.
+    """
+    streamed = []
+
+    def stream():
+        streamed.append(True)
+        parts = []
+        for chunk in openai.ChatCompletion.create(model=model, messages=messages, stream=True, **params):
+            text = chunk['choices'][0]['delta'].get('content')
+            if text:
+                parts.append(text)
+                on_text(text)
+        return ''.join(parts).strip()
+
+    llm_output = get_llm_cache().get_or_compute(cache_key(model, messages, **params), stream)
+    if not streamed:
+        on_text(llm_output)
+    return llm_output
+
+
+def stream_reply_and_execute(model, messages, **params):
+    """Render the reply while it streams and start each motion command as soon as its line is complete.
+
+    Returns (reply text, command lines that are not motions such as RUN_PICK_AND_PLACE, whether the
+    reply had a command block).
+    """
+    parser = CommandStreamParser()
+    executor = CommandExecutor(get_robot_jobs(), stop_robot)
+    remaining_commands = []
+    placeholder = st.empty()
 
-    logging.info(f"Running 'pipeline.py' to execute pick and place...")
-    run_script('pipeline.py')
+    def dispatch(lines):
+        remaining_commands.extend(line for line in lines if not executor.submit(line))
 
-    logging.info(f"=== Pick and Place Process Completed ===")
-    st.write("Pick and place operation completed successfully.")
+    def on_text(chunk):
+        dispatch(parser.feed(chunk))
+        placeholder.markdown(parser.text)
 
-def run_script(script_name):
     try:
-        result = subprocess.run(['python', script_name], check=True, capture_output=True, text=True)
-        st.write(f"Script '{script_name}' output:\n{result.stdout}")
-    except subprocess.CalledProcessError as e:
-        st.error(f"Script '{script_name}' exited with an error: {e.stderr}")
-    except FileNotFoundError:
-        st.error(f"Script '{script_name}' not found. Please ensure it exists in the current directory.")
-    except Exception as e:
-        st.error(f"An unexpected error occurred while running '{script_name}': {e}")
+        llm_output = stream_chat_completion(model, messages, on_text, **params)
+        dispatch(parser.close())
+    finally:
+        job_ids = executor.close()
+    for job_id in job_ids:
+        track_job(job_id)
+        st.write(f"Commands queued for Arduino as job {job_id}.")
+    return llm_output, remaining_commands, parser.found_block
+
+
+def send_command_to_arduino(command, duration=500):
+    """Queue the command as a robot job; 'stop' goes out at once and cancels whatever job is running."""
+    if command == "stop":
+        stop_robot(duration)
+        st.write(f"Sent to Arduino: {command} {duration}")
+        return
+    track_job(get_robot_jobs().submit('commands', commands=[(command, duration)]))
+    st.write(f"Queued for Arduino: {command} {duration}")
+
+def stop_robot(duration=0):
+    """Cancel every robot job and send 'stop' ahead of anything queued on the channel.
+
+    `duration` is accepted for the '<command> <duration>' form; the firmware stops at once regardless.
+    """
+    cancel_robot_jobs()
+    # stop_movement() copes with the Arduino being disconnected
+    pipeline.stop_movement()
+
+def run_pick_and_place(selected_objects):
+    logging.info(f"=== Starting Pick and Place Process ===")
+    job_id = get_robot_jobs().submit('pick', objects=list(selected_objects))
+    track_job(job_id)
+    st.write(f"Pick and place job {job_id} started for {', '.join(selected_objects)}. "
+             "You can keep sending commands, e.g. 'stop 0'.")
+
+def track_job(job_id):
+    st.session_state.setdefault('jobs', []).append(job_id)
+
+def cancel_robot_jobs():
+    cancelled = get_robot_jobs().cancel_all()
+    if cancelled:
+        logging.info(f"Cancelled job(s) {cancelled}.")
+    return cancelled
+
+def describe_job(job):
+    if job['kind'] == 'pick':
+        title = f"Pick job {job['job_id']} ({', '.join(job['payload']['objects'])})"
+    else:
+        title = f"Command job {job['job_id']}"
+    progress = job['progress']
+    if job['status'] == 'running' and 'index' in progress:
+        step = progress.get('object') or progress.get('command')
+        title += f": {progress['index']}/{progress['total']} {step}" + (f", {progress['state']}" if 'state' in progress else "")
+    return f"{title} - {job['status']}"
+
+@fragment(run_every=JOB_REFRESH_S)
+def show_jobs():
+    """Live status, log tail and a cancel button for this session's jobs; finished jobs move into the chat."""
+    runner = get_robot_jobs()
+    for job_id in list(st.session_state.get('jobs', [])):
+        job = runner.get(job_id)
+        if job is None:
+            st.session_state.jobs.remove(job_id)
+            continue
+        if job['finished_at'] is not None:
+            result = job['result'] or {}
+            summary = describe_job(job)
+            if result.get('error'):
+                summary += f": {result['error']}"
+            if job['kind'] == 'pick' and job['status'] != 'done':
+                summary += f" (picked: {', '.join(result.get('picked', [])) or 'nothing'})"
+            st.session_state.conversation_history.append({"role": "assistant", "content": summary})
+            st.session_state.jobs.remove(job_id)
+            with st.chat_message("assistant"):
+                st.markdown(summary)
+            continue
+        with st.chat_message("assistant"):
+            st.markdown(describe_job(job))
+            if job['logs']:
+                st.code('\n'.join(job['logs'][-JOB_LOG_TAIL:]))
+            if st.button("Cancel", key=f"cancel-job-{job_id}"):
+                runner.cancel(job_id)
 
 def interpret_command_with_gpt4(user_input):
     """Use GPT-4 Mini to interpret the user's natural language command with context."""
@@ -257,11 +450,11 @@ def interpret_command_with_gpt4(user_input):
 
     if re.search(vision_pattern, user_input.lower()):
         st.write("An image is required for this command. Capturing image...")
-        filename = capture_and_resize_image()
+        vision_image = capture_vision_image(user_input)
 
-        if filename:
+        if vision_image:
             # Now, send the image to GPT
-            action_commands = send_image_to_gpt(user_input, filename)
+            action_commands = send_image_to_gpt(user_input, *vision_image)
             return action_commands
         else:
             st.write("Image capture failed.")
@@ -275,6 +468,7 @@ def interpret_command_with_gpt4(user_input):
             if selected_objects:
                 # Write selected objects to 'selected_objects.txt'
                 write_selected_objects_to_file(selected_objects)
+                st.session_state.selected_objects = selected_objects
                 st.write(f"Objects '{', '.join(selected_objects)}' selected for pick and place.")
                 st.session_state.pick_and_place_active = True
                 return ["RUN_PICK_AND_PLACE"]
@@ -286,13 +480,10 @@ def interpret_command_with_gpt4(user_input):
             return []
     else:
         try:
-            # Call GPT-4 Mini API
-            response = openai.ChatCompletion.create(
-                model="gpt-4o-mini",
-                messages=messages,
-                temperature=0
-            )
-            llm_output = response['choices'][0]['message']['content'].strip()
+            # Stream from GPT-4 Mini; motions start while the reply is still arriving, and a repeat of
+            # the same conversation is answered from the cache
+            llm_output, remaining_commands, found_commands = stream_reply_and_execute("gpt-4o-mini", messages,
+                                                                                      temperature=0)
 
             # Log the assistant's response for debugging
             logging.info(f"Assistant's response: {llm_output}")
@@ -300,19 +491,48 @@ def interpret_command_with_gpt4(user_input):
             # Update conversation history with assistant's response
             st.session_state.conversation_history.append({"role": "assistant", "content": llm_output})
 
-            # Extract commands if present
-            if "BEGIN COMMANDS" in llm_output and "END COMMANDS" in llm_output:
-                command_block = re.search(r"BEGIN COMMANDS\s+(.*?)\s+END COMMANDS", llm_output, re.DOTALL).group(1)
-                return [line.strip() for line in command_block.splitlines() if line.strip()]
-            else:
-                st.write(llm_output)
-                return []
+            if not found_commands:
+                st.write("No command executed; only conversational reply provided.")
+            return remaining_commands
         except Exception as e:
             st.error(f"Error with LLM interpretation: {e}")
             return []
 
+def chat_completion(model, messages, **params):
+    """Completion text for a chat request, through the shared cache."""
+    def request():
+        response = openai.ChatCompletion.create(model=model, messages=messages, **params)
+        return response['choices'][0]['message']['content'].strip()
+    return get_llm_cache().get_or_compute(cache_key(model, messages, **params), request)
+
+
+def parse_objects_locally(command):
+    """Objects named in the command (class names, plurals and synonyms), in order of appearance.
+
+    Names right next to each other are one noun phrase and one object, so 'cardboard box' is a single box.
+    Returns None when such a phrase mixes classes ('glass jar'), leaving the command to the LLM.
+    """
+    phrases = []
+    previous_end = None
+    for match in OBJECT_PATTERN.finditer(command.lower()):
+        if previous_end is not None and not command[previous_end:match.start()].strip():
+            phrases[-1].add(OBJECT_NAMES[match.group(1)])
+        else:
+            phrases.append({OBJECT_NAMES[match.group(1)]})
+        previous_end = match.end()
+    if any(len(phrase) > 1 for phrase in phrases):
+        return None
+    return [phrase.pop() for phrase in phrases]
+
+
 def extract_objects_from_command(command, model="gpt-4o-mini"):
 
+    # Commands that name the objects directly need no LLM round-trip
+    local_objects = parse_objects_locally(command)
+    if local_objects:
+        logging.info(f"Parsed objects locally: {local_objects}")
+        return local_objects
+
     messages = [
         {
             "role": "system",
@@ -325,19 +545,18 @@ def extract_objects_from_command(command, model="gpt-4o-mini"):
     ]
 
     try:
-        response = openai.ChatCompletion.create(
-            model=model,
-            messages=messages,
+        extracted_text = chat_completion(
+            model,
+            messages,
             max_tokens=50,
             temperature=0.0,  # Set to 0 for deterministic output
             n=1,
             stop=["\n"]  # Stop at newline to prevent additional text
-        )
-        extracted_text = response['choices'][0]['message']['content'].strip().lower()
+        ).lower()
 
         extracted_objects = [obj.strip() for obj in extracted_text.split(',') if obj.strip()]
 
-        logging.debug(f"Raw GPT-4o-mini response: '{response['choices'][0]['message']['content']}'")
+        logging.debug(f"Raw GPT-4o-mini response: '{extracted_text}'")
         logging.debug(f"Extracted Objects List: {extracted_objects}")
 
         return extracted_objects
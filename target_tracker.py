@@ -0,0 +1,126 @@
+import logging
+
+import cv2
+import numpy as np
+
+TRACKER_FACTORIES = {
+    'KCF': 'TrackerKCF_create',
+    'CSRT': 'TrackerCSRT_create',
+    'MIL': 'TrackerMIL_create',
+}
+
+
+def create_tracker(tracker_type):
+    """Build an OpenCV tracker, looking in cv2.legacy as well for opencv-contrib builds. Returns None if unavailable."""
+    factory_name = TRACKER_FACTORIES.get(tracker_type.upper())
+    if factory_name is None:
+        raise ValueError(f"Unknown tracker type '{tracker_type}'. Use one of {list(TRACKER_FACTORIES)}.")
+    for namespace in (cv2, getattr(cv2, 'legacy', None)):
+        factory = getattr(namespace, factory_name, None) if namespace is not None else None
+        if factory is not None:
+            return factory()
+    return None
+
+
+def expand_box(box, margin, frame_width, frame_height):
+    """Grow an [x1, y1, x2, y2] box by `margin` of its size on every side, clipped to the frame."""
+    x1, y1, x2, y2 = box
+    pad_x = (x2 - x1) * margin
+    pad_y = (y2 - y1) * margin
+    return (int(max(0, x1 - pad_x)), int(max(0, y1 - pad_y)),
+            int(min(frame_width, x2 + pad_x)), int(min(frame_height, y2 + pad_y)))
+
+
+class TargetTracker:
+    """Detect-then-track for one target class.
+
+    YOLO runs on the full frame until the target is found, then a lightweight OpenCV tracker
+    follows the box. The detector runs again every `redetect_interval` frames inside an
+    expanded crop around the tracked box, or on the full frame whenever the tracker fails.
+    """
+
+    def __init__(self, detect, target_class, redetect_interval=10, roi_margin=0.5,
+                 tracker_type='KCF', max_area_change=0.5):
+        self.detect = detect
+        self.target_class = target_class.lower()
+        self.redetect_interval = redetect_interval
+        self.roi_margin = roi_margin
+        self.tracker_type = tracker_type
+        self.max_area_change = max_area_change
+        self.tracker = None
+        self.last_detection = None
+        self.frames_since_detection = 0
+        self.stats = {'full': 0, 'roi': 0, 'tracked': 0}
+        self._tracker_missing_logged = False
+
+    def reset(self):
+        self.tracker = None
+        self.last_detection = None
+        self.frames_since_detection = 0
+
+    def update(self, frame):
+        """Return the detections for the target class in this frame, in the same format as detect_objects."""
+        if self.tracker is not None:
+            if self.frames_since_detection >= self.redetect_interval:
+                detection = self._detect_in_roi(frame)
+                if detection is not None:
+                    return [detection]
+            else:
+                detection = self._track(frame)
+                if detection is not None:
+                    return [detection]
+        return self._detect_full(frame)
+
+    def _detect_full(self, frame):
+        self.stats['full'] += 1
+        detections = [d for d in self.detect(frame) if d['class_name'].lower() == self.target_class]
+        if detections:
+            self._start_tracking(frame, max(detections, key=lambda d: d['confidence']))
+        else:
+            self.reset()
+        return detections
+
+    def _detect_in_roi(self, frame):
+        frame_height, frame_width = frame.shape[:2]
+        x1, y1, x2, y2 = expand_box(self.last_detection['box'], self.roi_margin, frame_width, frame_height)
+        self.stats['roi'] += 1
+        detections = [d for d in self.detect(frame[y1:y2, x1:x2])
+                      if d['class_name'].lower() == self.target_class]
+        if not detections:
+            logging.debug("Target not found in ROI; falling back to a full-frame detection.")
+            return None
+        detection = max(detections, key=lambda d: d['confidence'])
+        detection['box'] = detection['box'] + np.array([x1, y1, x1, y1], dtype=detection['box'].dtype)
+        self._start_tracking(frame, detection)
+        return detection
+
+    def _track(self, frame):
+        ok, (x, y, w, h) = self.tracker.update(frame)
+        self.frames_since_detection += 1
+        if not ok or w <= 0 or h <= 0:
+            logging.debug("Tracker lost the target; running the detector.")
+            return None
+
+        last_box = self.last_detection['box']
+        last_area = (last_box[2] - last_box[0]) * (last_box[3] - last_box[1])
+        if last_area > 0 and abs(w * h - last_area) / last_area > self.max_area_change:
+            logging.debug("Tracked box changed size too much; running the detector.")
+            return None
+
+        self.stats['tracked'] += 1
+        detection = dict(self.last_detection)
+        detection['box'] = np.array([x, y, x + w, y + h], dtype=np.float32)
+        detection['tracked'] = True
+        return detection
+
+    def _start_tracking(self, frame, detection):
+        self.last_detection = dict(detection)
+        self.frames_since_detection = 0
+        self.tracker = create_tracker(self.tracker_type)
+        if self.tracker is None:
+            if not self._tracker_missing_logged:
+                logging.warning(f"OpenCV tracker '{self.tracker_type}' is not available; detecting every frame.")
+                self._tracker_missing_logged = True
+            return
+        x1, y1, x2, y2 = (int(v) for v in detection['box'])
+        self.tracker.init(frame, (x1, y1, x2 - x1, y2 - y1))
@@ -0,0 +1,52 @@
+import json
+import urllib.request
+
+import llm_stub
+from command_stream import CommandStreamParser
+
+REPLY = "Turning to the bottle.\nBEGIN COMMANDS\nleft 300\nforward 500\nRUN_PICK_AND_PLACE\nEND COMMANDS\nDone."
+
+
+def stream_chunks(base_url, prompt):
+    """Yield the text deltas of a streamed completion, parsed from the stub's server-sent events."""
+    body = {'model': 'gpt-4o-mini', 'stream': True, 'messages': [{'role': 'user', 'content': prompt}]}
+    request = urllib.request.Request(f"{base_url}/chat/completions", data=json.dumps(body).encode(),
+                                     headers={'Content-Type': 'application/json'})
+    with urllib.request.urlopen(request) as response:
+        for raw in response:
+            line = raw.decode().strip()
+            if not line.startswith('data: ') or line == 'data: [DONE]':
+                continue
+            text = json.loads(line[len('data: '):])['choices'][0]['delta'].get('content')
+            if text:
+                yield text
+
+
+def test_commands_complete_while_the_reply_streams():
+    server, _ = llm_stub.serve(port=0, replies={'go to the bottle': REPLY}, token_delay_s=0.01)
+    try:
+        parser = CommandStreamParser()
+        chunks = list(stream_chunks(f"http://localhost:{server.server_address[1]}/v1", "go to the bottle"))
+        commands = []
+        first_command_chunk = None
+        for index, chunk in enumerate(chunks):
+            completed = parser.feed(chunk)
+            if completed and first_command_chunk is None:
+                first_command_chunk = index
+            commands.extend(completed)
+        commands.extend(parser.close())
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    assert len(chunks) > 1
+    assert commands == ['left 300', 'forward 500', 'RUN_PICK_AND_PLACE']
+    assert first_command_chunk < len(chunks) - 1
+    assert parser.found_block
+    assert parser.text == REPLY
+
+
+def test_only_the_first_block_is_read():
+    parser = CommandStreamParser()
+    commands = parser.feed("BEGIN COMMANDS\nup 100\nEND COMMANDS\nBEGIN COMMANDS\ndown 100\nEND COMMANDS\n")
+    assert commands + parser.close() == ['up 100']
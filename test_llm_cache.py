@@ -0,0 +1,86 @@
+import json
+import threading
+import time
+import urllib.request
+
+import pytest
+
+import llm_stub
+from llm_cache import LLMCache, cache_key
+
+MODEL = 'gpt-4o-mini'
+
+
+@pytest.fixture
+def stub():
+    server, state = llm_stub.serve(port=0, replies={'pick up the bottle': 'bottle'}, delay_s=0.2)
+    yield f"http://localhost:{server.server_address[1]}/v1", state
+    server.shutdown()
+    server.server_close()
+
+
+def complete(base_url, messages):
+    request = urllib.request.Request(f"{base_url}/chat/completions",
+                                     data=json.dumps({'model': MODEL, 'messages': messages}).encode(),
+                                     headers={'Content-Type': 'application/json'})
+    with urllib.request.urlopen(request) as response:
+        return json.load(response)['choices'][0]['message']['content']
+
+
+def cached_complete(cache, base_url, prompt):
+    messages = [{'role': 'user', 'content': prompt}]
+    return cache.get_or_compute(cache_key(MODEL, messages), lambda: complete(base_url, messages))
+
+
+def test_normalised_prompt_hits_cache(stub, tmp_path):
+    base_url, state = stub
+    cache = LLMCache(path=str(tmp_path / 'cache.sqlite'))
+    assert cached_complete(cache, base_url, "Pick up the bottle.") == 'bottle'
+    assert cached_complete(cache, base_url, "  pick up   THE bottle") == 'bottle'
+    assert state.requests == 1
+
+
+def test_entries_expire_after_ttl(stub, tmp_path):
+    base_url, state = stub
+    cache = LLMCache(path=str(tmp_path / 'cache.sqlite'), ttl_s=0.3)
+    cached_complete(cache, base_url, "pick up the bottle")
+    time.sleep(0.4)
+    cached_complete(cache, base_url, "pick up the bottle")
+    assert state.requests == 2
+
+
+def test_disk_evicts_least_recently_used(tmp_path):
+    # No memory level, so every get() reads the table and refreshes the row's use time
+    cache = LLMCache(path=str(tmp_path / 'cache.sqlite'), memory_entries=0, disk_entries=2)
+    cache.put('a', 'first')
+    time.sleep(0.01)
+    cache.put('b', 'second')
+    time.sleep(0.01)
+    assert cache.get('a') == 'first'
+    time.sleep(0.01)
+    cache.put('c', 'third')
+    assert cache.get('b') is None
+    assert cache.get('a') == 'first'
+    assert cache.get('c') == 'third'
+
+
+def test_entries_reload_from_sqlite(stub, tmp_path):
+    base_url, state = stub
+    path = str(tmp_path / 'cache.sqlite')
+    cached_complete(LLMCache(path=path), base_url, "pick up the bottle")
+    assert cached_complete(LLMCache(path=path), base_url, "pick up the bottle") == 'bottle'
+    assert state.requests == 1
+
+
+def test_concurrent_identical_requests_share_one_call(stub, tmp_path):
+    base_url, state = stub
+    cache = LLMCache(path=str(tmp_path / 'cache.sqlite'))
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(cached_complete(cache, base_url, "pick up the bottle")))
+               for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert results == ['bottle'] * 8
+    assert state.requests == 1
@@ -0,0 +1,43 @@
+import time
+
+import pipeline
+import pipeline_service
+
+
+def wait_until_finished(runner, job_id, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        job = runner.get(job_id)
+        if job['finished_at'] is not None:
+            return job
+        time.sleep(0.01)
+    raise AssertionError(f"Job {job_id} did not finish.")
+
+
+def test_pick_after_a_cancelled_job_runs(monkeypatch):
+    started = []
+
+    def pick_from_plan(target, plan, grabber, display=False, viewer=None):
+        started.append(target)
+        # Stands in for the pick loop, which checks for an abort between frames
+        for _ in range(200):
+            pipeline.check_abort()
+            time.sleep(0.01)
+
+    monkeypatch.setattr(pipeline_service.PipelineService, 'start', lambda self: self)
+    monkeypatch.setattr(pipeline, 'plan_picks', lambda objects, grabber: (list(objects), None))
+    monkeypatch.setattr(pipeline, 'pick_from_plan', pick_from_plan)
+    monkeypatch.setattr(pipeline, 'stop_movement', lambda: None)
+    service = pipeline_service.PipelineService()
+    runner = pipeline_service.JobRunner(service)
+
+    job_id = runner.submit('pick', objects=['bottle'])
+    while not started:
+        time.sleep(0.01)
+    assert runner.cancel(job_id)
+    assert wait_until_finished(runner, job_id)['status'] == 'cancelled'
+    assert pipeline.abort_requested.is_set()
+
+    monkeypatch.setattr(pipeline, 'pick_from_plan',
+                        lambda target, plan, grabber, display=False, viewer=None: pipeline.check_abort())
+    assert service.pick(['cup']) == {'status': 'ok', 'picked': ['cup']}
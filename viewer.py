@@ -0,0 +1,148 @@
+import logging
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import cv2
+
+JPEG_QUALITY = 70
+MJPEG_BOUNDARY = 'frame'
+
+
+class FrameViewer:
+    """Shows the pick loop's results without slowing it down.
+
+    The loop only hands over the latest frame and its detections; a background thread downsizes,
+    annotates and JPEG-encodes them at most `max_fps` times per second for an MJPEG stream on
+    localhost. Frames submitted faster than that are simply dropped. HighGUI is not thread-safe, and
+    on macOS windows only work from the main thread, so the window is updated by pump() from the
+    caller's loop instead of by the render thread.
+    """
+
+    def __init__(self, render, scale=0.5, max_fps=10.0, window_name=None, mjpeg_port=None):
+        self.render = render  # render(small_frame, detected_objects, scale) -> annotated frame
+        self.scale = scale
+        self.max_fps = max_fps
+        self.window_name = window_name
+        self.mjpeg_port = mjpeg_port
+        self.quit_requested = threading.Event()
+        self._latest = None
+        self._latest_id = 0
+        self._condition = threading.Condition()
+        self._jpeg = None
+        self._jpeg_id = 0
+        self._window_frame = None
+        self._window_frame_id = 0
+        self._shown_id = 0
+        self._running = threading.Event()
+        self._server = None
+
+    def start(self):
+        self._running.set()
+        threading.Thread(target=self._render_loop, name='frame-viewer', daemon=True).start()
+        if self.mjpeg_port:
+            self._start_mjpeg()
+        return self
+
+    def submit(self, frame, detected_objects):
+        """Hand over the latest frame; never blocks the caller on rendering or display."""
+        with self._condition:
+            self._latest = (frame, detected_objects)
+            self._latest_id += 1
+            self._condition.notify_all()
+
+    def pump(self):
+        """Show the newest rendered frame in the window, if one is new; call it from the thread that owns the GUI."""
+        if not self.window_name:
+            return
+        with self._condition:
+            frame, frame_id = self._window_frame, self._window_frame_id
+        if frame is None or frame_id == self._shown_id:
+            return
+        self._shown_id = frame_id
+        cv2.imshow(self.window_name, frame)
+        if cv2.waitKey(1) & 0xFF == ord('q'):
+            self.quit_requested.set()
+
+    def close(self):
+        """Stop rendering; call it from the thread that called pump() so the window closes there too."""
+        self._running.clear()
+        if self._shown_id:
+            cv2.destroyWindow(self.window_name)
+            self._shown_id = 0
+        with self._condition:
+            self._condition.notify_all()
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def _render_loop(self):
+        rendered_id = 0
+        interval = 1.0 / self.max_fps
+        while self._running.is_set():
+            with self._condition:
+                self._condition.wait_for(lambda: self._latest_id != rendered_id or not self._running.is_set())
+                if not self._running.is_set():
+                    break
+                (frame, detected_objects), rendered_id = self._latest, self._latest_id
+
+            started = time.monotonic()
+            small = cv2.resize(frame, None, fx=self.scale, fy=self.scale, interpolation=cv2.INTER_AREA)
+            annotated = self.render(small, detected_objects, self.scale)
+
+            if self.mjpeg_port:
+                ok, jpeg = cv2.imencode('.jpg', annotated, [cv2.IMWRITE_JPEG_QUALITY, JPEG_QUALITY])
+                if ok:
+                    with self._condition:
+                        self._jpeg = jpeg.tobytes()
+                        self._jpeg_id += 1
+                        self._condition.notify_all()
+            if self.window_name:
+                with self._condition:
+                    self._window_frame = annotated
+                    self._window_frame_id += 1
+
+            remaining = interval - (time.monotonic() - started)
+            if remaining > 0:
+                time.sleep(remaining)
+
+    def _next_jpeg(self, last_id, timeout=1.0):
+        with self._condition:
+            self._condition.wait_for(lambda: self._jpeg_id != last_id or not self._running.is_set(), timeout)
+            return self._jpeg, self._jpeg_id
+
+    def _start_mjpeg(self):
+        viewer = self
+
+        class MjpegHandler(BaseHTTPRequestHandler):
+
+            def do_GET(self):
+                self.send_response(200)
+                self.send_header('Content-Type', f'multipart/x-mixed-replace; boundary={MJPEG_BOUNDARY}')
+                self.end_headers()
+                last_id = 0
+                try:
+                    while viewer._running.is_set():
+                        jpeg, jpeg_id = viewer._next_jpeg(last_id)
+                        if jpeg is None or jpeg_id == last_id:
+                            continue
+                        last_id = jpeg_id
+                        self.wfile.write(f"--{MJPEG_BOUNDARY}\r\nContent-Type: image/jpeg\r\n"
+                                         f"Content-Length: {len(jpeg)}\r\n\r\n".encode())
+                        self.wfile.write(jpeg)
+                        self.wfile.write(b"\r\n")
+                except (BrokenPipeError, ConnectionResetError):
+                    pass  # Viewer closed the stream
+
+            def log_message(self, format, *args):
+                pass
+
+        try:
+            self._server = ThreadingHTTPServer(('localhost', self.mjpeg_port), MjpegHandler)
+        except OSError as e:
+            logging.warning(f"MJPEG stream could not start on port {self.mjpeg_port}: {e}")
+            return
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, name='mjpeg-stream', daemon=True).start()
+        logging.info(f"Live view streaming at http://localhost:{self.mjpeg_port}/")
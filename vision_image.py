@@ -0,0 +1,72 @@
+import base64
+import re
+import threading
+from collections import namedtuple
+
+import cv2
+import numpy as np
+
+from metrics import metrics
+
+# max_side bounds the longer image side in pixels; detail is the OpenAI image_url detail level
+VisionSettings = namedtuple('VisionSettings', ['max_side', 'quality', 'detail'])
+
+PRESENCE_SETTINGS = VisionSettings(512, 70, 'low')  # Yes/no questions such as "do you see a bottle?"
+DEFAULT_SETTINGS = VisionSettings(720, 85, 'auto')
+CROP_MARGIN = 0.25  # Fraction of the crop size added on each side, so the model still sees some context
+MIN_CROP_FRACTION = 0.2  # Crops never shrink below this fraction of each frame side
+
+PRESENCE_PATTERN = re.compile(
+    r"^\s*(is|are|do|does|can|could)\b.*\b(see|there|any|visible|present)\b|\b(is there|are there)\b")
+
+
+def vision_settings(instruction):
+    """Image size, JPEG quality and detail level for a vision request."""
+    return PRESENCE_SETTINGS if PRESENCE_PATTERN.search(instruction.lower()) else DEFAULT_SETTINGS
+
+
+def crop_box(detected_objects, class_names, frame_shape, margin=CROP_MARGIN):
+    """Frame region [x1, y1, x2, y2] around every detection of the named classes, or None if none was detected."""
+    wanted = {name.lower() for name in class_names}
+    boxes = [obj['box'] for obj in detected_objects if obj['class_name'].lower() in wanted]
+    if not boxes:
+        return None
+    height, width = frame_shape[:2]
+    x1, y1 = min(box[0] for box in boxes), min(box[1] for box in boxes)
+    x2, y2 = max(box[2] for box in boxes), max(box[3] for box in boxes)
+    pad_x = max((x2 - x1) * margin, (width * MIN_CROP_FRACTION - (x2 - x1)) / 2, 0)
+    pad_y = max((y2 - y1) * margin, (height * MIN_CROP_FRACTION - (y2 - y1)) / 2, 0)
+    return (int(max(x1 - pad_x, 0)), int(max(y1 - pad_y, 0)),
+            int(min(x2 + pad_x, width)), int(min(y2 + pad_y, height)))
+
+
+class VisionEncoder:
+    """Crops, downsizes and JPEG-encodes frames for vision queries entirely in memory.
+
+    Downsized images go into one preallocated buffer per output size, so repeated queries do not
+    allocate a new image each time. Frames are only read, so they may be zero-copy views.
+    """
+
+    def __init__(self):
+        self._buffers = {}
+        self._lock = threading.Lock()
+
+    @metrics.timed('vision_encode')
+    def encode(self, frame, settings, box=None):
+        """Return the base64 JPEG of `frame` (or of its `box` region) with its longer side at most settings.max_side."""
+        if box is not None:
+            frame = frame[box[1]:box[3], box[0]:box[2]]
+        height, width = frame.shape[:2]
+        scale = min(1.0, settings.max_side / max(height, width))
+        size = (max(int(round(width * scale)), 1), max(int(round(height * scale)), 1))
+        with self._lock:
+            if scale < 1.0:
+                buffer = self._buffers.get(size)
+                if buffer is None:
+                    buffer = self._buffers[size] = np.empty((size[1], size[0], *frame.shape[2:]), dtype=np.uint8)
+                frame = cv2.resize(frame, size, dst=buffer, interpolation=cv2.INTER_AREA)
+            ok, jpeg = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, settings.quality])
+        if not ok:
+            raise ValueError("JPEG encoding failed.")
+        metrics.increment('vision_image_bytes', len(jpeg))
+        return base64.b64encode(jpeg).decode('ascii')